@@ -6,6 +6,7 @@ from instamatic.formats import write_tiff
 from instamatic import config
 from instamatic.camera import Camera
 from .microscope import Microscope
+from .shadow_state import ShadowState
 
 from typing import Tuple
 from contextlib import contextmanager
@@ -84,6 +85,7 @@ class Deflector(object):
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._cache = None  # `ShadowState`, set by `TEMController`
         self.key = "def"
 
     def __repr__(self):
@@ -95,9 +97,14 @@ class Deflector(object):
         return self.__class__.__name__
 
     def set(self, x: int, y: int):
-        self._setter(x, y)
+        if self._cache:
+            self._cache.set(self.name, (x, y), lambda: self._setter(x, y))
+        else:
+            self._setter(x, y)
 
     def get(self) -> Tuple[int, int]:
+        if self._cache:
+            return DeflectorTuple(*self._cache.get(self.name, self._getter))
         return DeflectorTuple(*self._getter())
 
     @property
@@ -129,6 +136,8 @@ class Deflector(object):
 
     def neutral(self):
         self._tem.setNeutral(self.key)
+        if self._cache:
+            self._cache.invalidate(self.name)
 
 
 class Lens(object):
@@ -139,6 +148,7 @@ class Lens(object):
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._cache = None  # `ShadowState`, set by `TEMController`
         self.key = "lens"
         
     def __repr__(self):
@@ -153,9 +163,14 @@ class Lens(object):
         return self.__class__.__name__
 
     def set(self, value: int):
-        self._setter(value)
+        if self._cache:
+            self._cache.set(self.name, value, lambda: self._setter(value))
+        else:
+            self._setter(value)
 
     def get(self) -> int:
+        if self._cache:
+            return self._cache.get(self.name, self._getter)
         return self._getter()
 
     @property
@@ -179,7 +194,10 @@ class DiffFocus(Lens):
         """confirm_mode: verify that TEM is set to the correct mode ('diff').
             IL1 maps to different values in image and diffraction mode. 
             Turning it off results in a 2x speed-up in the call, but it will silently fail if the TEM is in the wrong mode."""
-        self._setter(value, confirm_mode=confirm_mode)
+        if self._cache:
+            self._cache.set(self.name, value, lambda: self._setter(value, confirm_mode=confirm_mode))
+        else:
+            self._setter(value, confirm_mode=confirm_mode)
 
     def defocus(self, offset):
         """Apply a defocus to the IL1 lens, use `.refocus` to restore the previous setting"""
@@ -190,6 +208,8 @@ class DiffFocus(Lens):
             self._focused_value = current = self.get()
         except ValueError:
             self._tem.setFunctionMode("diff")
+            if self._cache:
+                self._cache.invalidate()
             self._focused_value = current = self.get()
 
         target = current + offset
@@ -235,6 +255,17 @@ class Magnification(Lens):
         index = self.index
         return "Magnification(value={}, index={})".format(value, index)
 
+    def set(self, value: int):
+        if self._cache:
+            self._cache.set(self.name, value, lambda: self._set_and_invalidate(value))
+        else:
+            self._setter(value)
+
+    def _set_and_invalidate(self, value: int):
+        # the other lens/deflector values may change with the magnification
+        self._setter(value)
+        self._cache.invalidate()
+
     @property
     def index(self) -> int:
         return self._indexgetter()
@@ -242,6 +273,8 @@ class Magnification(Lens):
     @index.setter
     def index(self, index: int):
         self._indexsetter(index)
+        if self._cache:
+            self._cache.invalidate()
 
     def increase(self) -> None:
         try:
@@ -438,8 +471,11 @@ class StagePosition(object):
 
     @property
     def a(self) -> int:
-        x, y, z, a, b = self.get()
-        return a
+        try:
+            return self._tem.getStageA()  # only read the angle if the interface supports it
+        except AttributeError:
+            x, y, z, a, b = self.get()
+            return a
 
     @a.setter
     def a(self, value: int):
@@ -652,12 +688,29 @@ class TEMController(object):
         self.difffocus = DiffFocus(tem)
         self.HTValue = HTValue(tem)
 
+        # opt-in cache of the last commanded lens/deflector values, see `ShadowState`
+        self.cache = ShadowState(enabled=getattr(config.cfg, "tem_shadow_state", False),
+                                 max_age=getattr(config.cfg, "tem_shadow_state_max_age", 1.0))
+        for obj in (self.gunshift, self.guntilt, self.beamshift, self.beamtilt, self.imageshift1, self.imageshift2,
+                    self.diffshift, self.magnification, self.brightness, self.difffocus):
+            obj._cache = self.cache
+
+        self._async = None
+
         self.autoblank = False
         self._saved_settings = {}
         print()
         print(self)
         self.store()
 
+    @property
+    def async_(self) -> "AsyncTEMController":
+        """Futures based interface to the microscope, see `AsyncTEMController`"""
+        if self._async is None:
+            from .async_controller import AsyncTEMController
+            self._async = AsyncTEMController(self, workers=getattr(config.cfg, "tem_async_workers", 4))
+        return self._async
+
     @property
     def spotsize(self) -> int:
         return self.tem.getSpotSize()
@@ -667,16 +720,16 @@ class TEMController(object):
         self.tem.setSpotSize(value)
 
     def mode_lowmag(self):
-        self.tem.setFunctionMode("lowmag")
+        self.mode = "lowmag"
 
     def mode_mag1(self):
-        self.tem.setFunctionMode("mag1")
+        self.mode = "mag1"
 
     def mode_samag(self):
-        self.tem.setFunctionMode("samag")
+        self.mode = "samag"
 
     def mode_diffraction(self):
-        self.tem.setFunctionMode("diff")
+        self.mode = "diff"
 
     @property
     def screen(self):
@@ -715,6 +768,7 @@ class TEMController(object):
     def mode(self, value: str):
         """Should be one of 'mag1', 'mag2', 'lowmag', 'samag', 'diff'"""
         self.tem.setFunctionMode(value)
+        self.cache.invalidate()
 
     @property
     def beamblank(self):
@@ -800,7 +854,7 @@ class TEMController(object):
         }
 
         mode = dct["FunctionMode"]
-        self.tem.setFunctionMode(mode)
+        self.mode = mode
 
         for k, v in dct.items():
             if k in funcs:
@@ -0,0 +1,217 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# devices on `TEMController` that get an asynchronous counterpart
+DEVICES = ("gunshift", "guntilt", "beamshift", "beamtilt", "imageshift1", "imageshift2",
+           "diffshift", "stageposition", "magnification", "brightness", "difffocus")
+
+# changing these affects the other lens/deflector values, so they wait for all earlier
+# commands and all later commands wait for them
+BARRIER_DEVICES = ("magnification", )
+READ_METHODS = ("get", "get_ranges")
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+_local = threading.local()
+
+
+def _init_worker():
+    """COM must be initialized in every thread that talks to the microscope (Windows only).
+    Called by every job, the initialization is done once per worker thread."""
+    if getattr(_local, "initialized", False):
+        return
+    _local.initialized = True
+    try:
+        import comtypes
+    except ImportError:
+        return
+    try:
+        comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+    except OSError:
+        pass
+
+
+def get_executor(tem, workers: int=4) -> ThreadPoolExecutor:
+    """Return the worker pool for microscope interface `tem`, there is one pool per interface"""
+    with _executors_lock:
+        executor = _executors.get(id(tem))
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tem-async")
+            _executors[id(tem)] = executor
+        return executor
+
+
+class AsyncDevice(object):
+    """Asynchronous counterpart of a `Deflector`/`Lens`/`StagePosition`,
+    every method call is sent to the worker pool and returns a `Future`"""
+    def __init__(self, controller, device, key: str):
+        super().__init__()
+        self._controller = controller
+        self._device = device
+        self._key = key
+
+    def __repr__(self):
+        return f"Async{self._device.name}()"
+
+    def __getattr__(self, name: str):
+        func = getattr(self._device, name)
+        if not callable(func):
+            raise AttributeError(f"`{name}` is not a method of {self._device.name}, use `get` or `set` instead")
+
+        barrier = self._key in BARRIER_DEVICES and name not in READ_METHODS
+
+        def submit(*args, **kwargs) -> Future:
+            return self._controller.submit(func, *args, key=self._key, barrier=barrier, **kwargs)
+
+        submit.__name__ = name
+        submit.__doc__ = func.__doc__
+        return submit
+
+
+class AsyncTEMController(object):
+    """Futures based interface to `TEMController`.
+
+    Commands are executed by a pool of worker threads (one pool per microscope interface), so that
+    independent commands do not have to wait for each other, and the calling thread can continue
+    (e.g. with the camera) while the microscope is busy. The ordering is guaranteed where needed:
+        - commands to the same device are executed in the order they were submitted
+        - mode and magnification changes wait for all earlier commands, and all later commands
+          wait for them (the lens/deflector values depend on the mode/magnification)
+
+    Whether commands to different devices actually overlap depends on the microscope interface:
+    the TEM server handles one command at a time, the JEOL COM interface several.
+
+    Usage:
+        f1 = ctrl.async_.beamshift.set(x, y)
+        f2 = ctrl.async_.diffshift.set(x, y)
+        f3 = ctrl.async_.set_spotsize(3)
+        ctrl.async_.wait()  # or f1.result(), ...
+
+        bs = ctrl.async_.beamshift.get().result()
+    """
+    def __init__(self, ctrl, workers: int=4):
+        super().__init__()
+        self._ctrl = ctrl
+        self.executor = get_executor(ctrl.tem, workers=workers)
+
+        self._lock = threading.Lock()
+        self._last = {}         # key -> last future submitted for the key
+        self._barrier = None    # last barrier future
+        self._pending = set()
+
+        for name in DEVICES:
+            setattr(self, name, AsyncDevice(self, getattr(ctrl, name), key=name))
+
+    def submit(self, func, *args, key: str=None, barrier: bool=False, **kwargs) -> Future:
+        """Run `func(*args, **kwargs)` in the worker pool.
+
+        key: commands with the same key are executed in order
+        barrier: wait for all earlier commands, all later commands wait for this one
+        """
+        with self._lock:
+            if barrier:
+                deps = list(self._pending)
+            else:
+                deps = [f for f in (self._barrier, self._last.get(key)) if f is not None]
+
+            def run():
+                # `ThreadPoolExecutor(initializer=...)` requires python 3.7
+                _init_worker()
+                # the dependencies were submitted earlier, so they are already running
+                # or done (the pool takes jobs in order), this cannot deadlock
+                if deps:
+                    wait(deps)
+                return func(*args, **kwargs)
+
+            future = self.executor.submit(run)
+
+            if barrier:
+                self._barrier = future
+            if key is not None:
+                self._last[key] = future
+            self._pending.add(future)
+
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+            if self._barrier is future:
+                self._barrier = None
+            for key, last in list(self._last.items()):
+                if last is future:
+                    del self._last[key]
+        if future.exception() is not None:
+            logger.error("Asynchronous TEM command failed: %s", future.exception())
+
+    def set_mode(self, mode: str) -> Future:
+        """Set the function mode, see `TEMController.mode`"""
+        return self.submit(setattr, self._ctrl, "mode", mode, key="mode", barrier=True)
+
+    def set_spotsize(self, value: int) -> Future:
+        """Set the spot size, see `TEMController.spotsize`"""
+        return self.submit(setattr, self._ctrl, "spotsize", value, key="spotsize")
+
+    def set_beamblank(self, on: bool) -> Future:
+        """Blank/unblank the beam, see `TEMController.beamblank`"""
+        return self.submit(setattr, self._ctrl, "beamblank", on, key="beamblank")
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for all submitted commands to finish and raise the first exception if any failed.
+        Returns False on timeout."""
+        with self._lock:
+            pending = list(self._pending)
+        done, not_done = wait(pending, timeout=timeout)
+        for future in done:
+            future.result()
+        return not not_done
+
+    @staticmethod
+    def gather(*futures) -> list:
+        """Wait for `futures` and return their results"""
+        return [future.result() for future in futures]
+
+
+def benchmark(n: int=20, latency: float=0.05, max_concurrent_calls: int=4, workers: int=4):
+    """Time the settings made before every diffraction pattern in serialED/autoCRED
+    (beamshift, diffshift, spotsize, brightness) on the simulated microscope,
+    sequentially and through `AsyncTEMController`"""
+    import time
+    from instamatic.TEMController.simu_microscope import SimuMicroscope
+    from instamatic.TEMController.TEMController import TEMController
+
+    tem = SimuMicroscope(simulation={"latency": latency, "latency_jitter": 0.0, "max_concurrent_calls": max_concurrent_calls})
+    ctrl = TEMController(tem)
+    async_ = AsyncTEMController(ctrl, workers=workers)
+
+    def sequential(i):
+        ctrl.beamshift.set(1000 + i, 2000 + i)
+        ctrl.diffshift.set(3000 + i, 4000 + i)
+        ctrl.spotsize = 1 + i % 3
+        ctrl.brightness.set(40000 + i)
+
+    def concurrent(i):
+        async_.beamshift.set(1000 + i, 2000 + i)
+        async_.diffshift.set(3000 + i, 4000 + i)
+        async_.set_spotsize(1 + i % 3)
+        async_.brightness.set(40000 + i)
+        async_.wait()
+
+    print(f"\nlatency={latency*1000:.0f} ms, max_concurrent_calls={max_concurrent_calls}, workers={workers}")
+    for name, func in (("sequential", sequential), ("async", concurrent)):
+        t0 = time.perf_counter()
+        for i in range(n):
+            func(i)
+        dt = (time.perf_counter() - t0) / n
+        print(f"{name:12s} {dt*1000:7.1f} ms/pattern")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -46,4 +46,8 @@ def Microscope(name: str=None, use_server: bool=False):
         cls = get_tem(name)
         tem = cls()
 
+    if getattr(config.cfg, "instrument_calls", True):
+        from instamatic.utils.instrumentation import instrument
+        instrument(tem, prefix="tem")
+
     return tem
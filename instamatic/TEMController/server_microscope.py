@@ -44,6 +44,7 @@ class ServerMicroscope(object):
         
         self.name = name
         self._bufsize = BUFSIZE
+        self._lock = threading.Lock()  # calls may come from several threads (e.g. the stage recorder)
 
         try:
             self.connect()
@@ -91,8 +92,9 @@ class ServerMicroscope(object):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'"""
         # t0 = time.perf_counter()
 
-        self.s.send(pickle.dumps(dct))
-        response = self.s.recv(self._bufsize)
+        with self._lock:
+            self.s.send(pickle.dumps(dct))
+            response = self.s.recv(self._bufsize)
         if response:
             status, data = pickle.loads(response)
 
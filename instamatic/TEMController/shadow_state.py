@@ -0,0 +1,114 @@
+import time
+import threading
+
+
+def _normalize(value):
+    """Values read through the TEM server may come back as lists"""
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class ShadowState(object):
+    """Write-through cache of the lens/deflector values last commanded through `TEMController`.
+
+    Every call to the microscope is a round trip through COM (or the TEM server), so writing
+    a value that is already active, or reading back a value that was just set, wastes time.
+    When enabled:
+        - `set` calls with the value that was last written/read are skipped
+        - `get` calls are served from the cache
+    as long as the cached value is younger than `max_age` seconds. This limits the time
+    during which a change made outside instamatic (e.g. with the knobs on the microscope)
+    goes unnoticed. The cache is cleared on a change of the function mode or magnification,
+    because the lens/deflector values depend on them. Use `invalidate()` after changing
+    the microscope by other means (e.g. `ctrl.tem` directly).
+
+    Disabled by default, enable with `ctrl.cache.enabled = True` or by setting
+    `tem_shadow_state: true` in `global.yaml`.
+    """
+    def __init__(self, enabled: bool=False, max_age: float=1.0):
+        super().__init__()
+        self.enabled = enabled
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self._values = {}   # key -> (value, time)
+        self._timing = {}   # key -> [n_calls, total time of the calls]
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the hit/miss counters"""
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.writes = 0
+        self.saved = 0.0  # estimated time saved in seconds
+
+    def _fresh(self, key: str):
+        entry = self._values.get(key)
+        if entry and time.perf_counter() - entry[1] < self.max_age:
+            return entry
+        return None
+
+    def _average(self, key: str) -> float:
+        n, total = self._timing.get(key, (0, 0.0))
+        return total / n if n else 0.0
+
+    def get(self, key: str, getter):
+        """Return the cached value for `key`, or call `getter()` and cache the result"""
+        if not self.enabled:
+            return getter()
+
+        with self.lock:
+            entry = self._fresh(key)
+            if entry:
+                self.hits += 1
+                self.saved += self._average(f"get_{key}")
+                return entry[0]
+            self.misses += 1
+
+        t0 = time.perf_counter()
+        value = getter()
+        self._store(key, value, f"get_{key}", t0)
+        return value
+
+    def set(self, key: str, value, setter):
+        """Call `setter()` to write `value`, unless `value` is already the cached value for `key`"""
+        if not self.enabled:
+            return setter()
+
+        with self.lock:
+            entry = self._fresh(key)
+            if entry and entry[0] == _normalize(value):
+                self.skipped += 1
+                self.saved += self._average(f"set_{key}")
+                return
+            self.writes += 1
+
+        t0 = time.perf_counter()
+        setter()
+        self._store(key, value, f"set_{key}", t0)
+
+    def _store(self, key: str, value, timing_key: str, t0: float):
+        t1 = time.perf_counter()
+        with self.lock:
+            self._values[key] = (_normalize(value), t1)
+            timing = self._timing.setdefault(timing_key, [0, 0.0])
+            timing[0] += 1
+            timing[1] += t1 - t0
+
+    def invalidate(self, key: str=None):
+        """Forget the cached value for `key`, or all values if `key` is None"""
+        with self.lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters and the estimated time saved"""
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses,
+                "skipped": self.skipped, "writes": self.writes, "saved": self.saved}
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(enabled={self.enabled}, hits={self.hits}, misses={self.misses}, "
+                f"skipped={self.skipped}, writes={self.writes}, saved={self.saved:.3f} s)")
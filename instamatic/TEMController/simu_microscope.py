@@ -1,5 +1,9 @@
 from instamatic import config
 from typing import Tuple
+import functools
+import random
+import threading
+import time
 
 NTRLMAPPING = {
    "GUN1" : 0,
@@ -25,12 +29,26 @@ ZERO = 32768
 MAX = 65535
 MIN = 0
 
+# Default timing model, can be overridden with the `simulation` block in the microscope config
+# The latencies correspond to a JEOL 2100, where each call costs about 40-60 ms, stageposition about 265 ms
+SIMULATION_DEFAULTS = {
+    "latency": 0.0,                 # s, per getter/setter call
+    "latency_jitter": 0.2,          # fraction of the latency
+    "latency_stageposition": 0.0,   # s, for `getStagePosition`
+    "stage_speed_xy": 50_000,       # nm/s
+    "stage_speed_z": 10_000,        # nm/s
+    "stage_speed_a": 10.0,          # degrees/s, rotation speed
+    "stage_speed_b": 10.0,          # degrees/s
+    "stage_settle": 0.0,            # s, settling time after each stage movement
+    "max_concurrent_calls": 1,      # number of calls the microscope handles at the same time
+}
+
 
 class SimuMicroscope(object):
     """docstring for microscope"""
-    def __init__(self, name: str="simulate"):
+    def __init__(self, name: str="simulate", simulation: dict=None):
+        """simulation: overrides for the timing model (see `SIMULATION_DEFAULTS`)"""
         super(SimuMicroscope, self).__init__()
-        import random
         
         self.Brightness_value = random.randint(MIN, MAX)
 
@@ -111,6 +129,63 @@ class SimuMicroscope(object):
         self.objectivelensefine_value = random.randint(MIN, MAX)
         self.objectiveminilens_value = random.randint(MIN, MAX)
 
+        self._stage_moves = {}  # axis -> (start, target, t_start, duration)
+
+        self.simulation = dict(SIMULATION_DEFAULTS)
+        self.simulation.update(getattr(config.microscope, "simulation", None) or {})
+        self.simulation.update(simulation or {})
+        self._setup_latency()
+
+    def _setup_latency(self):
+        """Wrap all getters/setters so that each call takes `latency` seconds.
+        At most `max_concurrent_calls` calls are handled at the same time, the
+        others wait for their turn (1: the microscope handles one command at a time)."""
+        latency = self.simulation["latency"]
+        latency_stage = self.simulation["latency_stageposition"]
+        if not (latency or latency_stage):
+            return
+
+        jitter = self.simulation["latency_jitter"]
+        slots = threading.BoundedSemaphore(self.simulation["max_concurrent_calls"])
+
+        def with_latency(func, delay):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with slots:
+                    time.sleep(delay * random.uniform(1 - jitter, 1 + jitter))
+                return func(*args, **kwargs)
+            return wrapper
+
+        for name in dir(self):
+            if not name.startswith(("get", "set", "is")):
+                continue
+            func = getattr(self, name)
+            if not callable(func):
+                continue
+            delay = latency_stage if name == "getStagePosition" else latency
+            setattr(self, name, with_latency(func, delay))
+
+    def _get_stage_value(self, axis: str):
+        """Return the current value of the stage `axis`, interpolated if the stage is moving"""
+        target = getattr(self, f"StagePosition_{axis}")
+        move = self._stage_moves.get(axis)
+        if not move:
+            return target
+
+        start, target, t_start, duration = move
+        dt = time.perf_counter() - t_start
+        if dt >= duration:
+            return target
+        return start + (target - start) * dt / duration
+
+    def _move_stage(self, axis: str, value, speed: float=1.0):
+        """Start moving the stage `axis` towards `value` with the configured speed (scaled by `speed`)"""
+        current = self._get_stage_value(axis)
+        rate = self.simulation[f"stage_speed_{'xy' if axis in 'xy' else axis}"] * speed
+        duration = abs(value - current) / rate if rate > 0 else 0.0
+        self._stage_moves[axis] = (current, value, time.perf_counter(), duration)
+        setattr(self, f"StagePosition_{axis}", value)
+
     def getHTValue(self):
         return 200000
 
@@ -231,64 +306,74 @@ class SimuMicroscope(object):
         self.ImageShift2_y = y
 
     def getStagePosition(self) -> Tuple[int, int, int, int, int]:
-        return self.StagePosition_x, self.StagePosition_y, self.StagePosition_z, self.StagePosition_a, self.StagePosition_b
+        return tuple(self._get_stage_value(axis) for axis in "xyzab")
+
+    def getStageA(self) -> float:
+        return self._get_stage_value("a")
 
     def isStageMoving(self) -> bool:
-        return False
+        settle = self.simulation["stage_settle"]
+        now = time.perf_counter()
+        return any(now < t_start + duration + settle for start, target, t_start, duration in self._stage_moves.values())
 
     def waitForStage(self, delay: float=0.1):
         while self.isStageMoving():
             time.sleep(delay)
 
-    def setStageX(self, value: int, wait: bool=True):
-        self.StagePosition_x = value
-        if True:
+    def setStageX(self, value: int, wait: bool=True, speed: float=1.0):
+        self._move_stage("x", value, speed=speed)
+        if wait:
             self.waitForStage()
 
-    def setStageY(self, value: int, wait: bool=True):
-        self.StagePosition_y = value
-        if True:
+    def setStageY(self, value: int, wait: bool=True, speed: float=1.0):
+        self._move_stage("y", value, speed=speed)
+        if wait:
             self.waitForStage()
 
-    def setStageZ(self, value: int, wait: bool=True):
-        self.StagePosition_z = value
-        if True:
+    def setStageZ(self, value: int, wait: bool=True, speed: float=1.0):
+        self._move_stage("z", value, speed=speed)
+        if wait:
             self.waitForStage()
 
-    def setStageA(self, value: int, wait: bool=True):
-        self.StagePosition_a = value
-        if True:
+    def setStageA(self, value: int, wait: bool=True, speed: float=1.0):
+        self._move_stage("a", value, speed=speed)
+        if wait:
             self.waitForStage()
 
-    def setStageB(self, value: int, wait: bool=True):
-        self.StagePosition_b = value
-        if True:
+    def setStageB(self, value: int, wait: bool=True, speed: float=1.0):
+        self._move_stage("b", value, speed=speed)
+        if wait:
             self.waitForStage()
 
-    def setStageXY(self, x: int, y: int, wait: bool=True):
-        self.StagePosition_x = x
-        self.StagePosition_y = y
+    def setStageXY(self, x: int, y: int, wait: bool=True, speed: float=1.0):
+        self._move_stage("x", x, speed=speed)
+        self._move_stage("y", y, speed=speed)
         if wait:
             self.waitForStage()
 
     def stopStage(self):
-        pass
+        for axis in list(self._stage_moves):
+            setattr(self, f"StagePosition_{axis}", self._get_stage_value(axis))
+        self._stage_moves.clear()
 
     def setStagePosition(self, x: int=None, y: int=None, z: int=None, a: int=None, b: int=None, speed: float= -1, wait: bool=True):
+        """speed: fraction of the configured stage speed (-1 for full speed)"""
+        speed = 1.0 if speed <= 0 else speed
+
         if z is not None:
-            self.setStageZ(z, wait=wait)
+            self.setStageZ(z, wait=wait, speed=speed)
         if a is not None:
-            self.setStageA(a, wait=wait)
+            self.setStageA(a, wait=wait, speed=speed)
         if b is not None:
-            self.setStageB(b, wait=wait)
+            self.setStageB(b, wait=wait, speed=speed)
 
         if (x is not None) and (y is not None):
-            self.setStageXY(x=x, y=y, wait=wait)
+            self.setStageXY(x=x, y=y, wait=wait, speed=speed)
         else:
             if x is not None:
-                self.setStageX(x, wait=wait)     
+                self.setStageX(x, wait=wait, speed=speed)     
             if y is not None:
-                self.setStageY(y, wait=wait)
+                self.setStageY(y, wait=wait, speed=speed)
 
     def getFunctionMode(self) -> str:
         """mag1, mag2, lowmag, samag, diff"""
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from instamatic.tools import imgscale, printer
+from instamatic.processing.cross_correlate import cross_correlate
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def make_grid(gridsize: int, stepsize: float) -> np.ndarray:
+    """Return the (dx, dy) offsets of a square calibration grid centered on 0,
+    gridsize=5 results in 25 points. The order matches the `np.meshgrid` order
+    that the calibration routines have always used (x varies fastest)."""
+    n = int((gridsize - 1) / 2)  # number of points = n*(n+1)
+    x_grid, y_grid = np.meshgrid(np.arange(-n, n+1) * stepsize, np.arange(-n, n+1) * stepsize)
+    return np.stack([x_grid, y_grid]).reshape(2, -1).T
+
+
+def register_frame(img_cent: np.ndarray, img: np.ndarray, scale: float) -> np.ndarray:
+    """Scale `img` by `scale` and cross correlate it with the (already scaled) reference image"""
+    img = imgscale(img, scale)
+    return cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
+
+
+class GridAcquisition(object):
+    """Shared acquisition engine for the live calibration routines.
+
+    Grid points are visited sequentially on the calling thread (set position -> acquire),
+    while image registration (`imgscale` + `cross_correlate`) of the frames is streamed to
+    a pool of workers. Registration therefore overlaps with moving to and acquiring the next
+    point, instead of being paid on the microscope's clock.
+
+    ctrl:
+        Instance of `TEMController`
+    img_cent:
+        Reference image, already scaled by `scale`
+    scale:
+        Scale factor applied to every frame before cross correlation
+    exposure, binsize:
+        Passed to `ctrl.getImage`
+    workers:
+        Number of registration workers, set to 0 to register in the acquisition loop
+    """
+    def __init__(self, ctrl, img_cent: np.ndarray, scale: float, exposure: float, binsize: int, workers: int=2):
+        super().__init__()
+        self.ctrl = ctrl
+        self.img_cent = img_cent
+        self.scale = scale
+        self.exposure = exposure
+        self.binsize = binsize
+        self.workers = workers
+
+        self.timings = {}
+
+    def run(self, positions, set_position, header_key: str, readout=None, outfiles=None, comment: str="Calib image {i}: dx={dx} - dy={dy}", verbose: bool=True) -> (np.ndarray, np.ndarray, list):
+        """Visit all `positions` and return the pixel shifts with respect to the reference image,
+        the microscope readout, and the image headers.
+
+        positions: `np.ndarray` of (dx, dy)
+            Typically obtained from `make_grid`
+        set_position: callable
+            Called as `set_position(i, dx, dy)` to move to grid point `i`
+        header_key: `str`
+            Header key to read out together with every image (e.g. 'BeamShift', 'StagePosition')
+        readout: callable or None
+            Called as `readout(h)` to convert the image header to a (x, y) readout,
+            defaults to `h[header_key]`
+        outfiles: `list` of `str` or None
+            File names to save the images to (one for each position)
+
+        The pixel shifts are returned in scaled/binned pixels, use `* binsize / scale` to get unbinned pixels
+        """
+        if readout is None:
+            readout = lambda h: h[header_key]
+
+        ctrl = self.ctrl
+        tot = len(positions)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers else None
+
+        futures = []
+        readouts = []
+        headers = []
+
+        t_set = t_acq = 0.0
+        t0 = time.perf_counter()
+
+        for i, (dx, dy) in enumerate(positions):
+            t1 = time.perf_counter()
+            set_position(i, dx, dy)
+            t2 = time.perf_counter()
+
+            if verbose:
+                printer(f"Position: {i+1}/{tot}: dx={dx:.0f} dy={dy:.0f}")
+
+            outfile = outfiles[i] if outfiles else None
+
+            img, h = ctrl.getImage(exposure=self.exposure, binsize=self.binsize, out=outfile,
+                                   comment=comment.format(i=i, dx=dx, dy=dy), header_keys=header_key)
+            t3 = time.perf_counter()
+
+            if pool:
+                futures.append(pool.submit(register_frame, self.img_cent, img, self.scale))
+            else:
+                futures.append(register_frame(self.img_cent, img, self.scale))
+
+            readouts.append(readout(h))
+            headers.append(h)
+
+            t_set += t2 - t1
+            t_acq += t3 - t2
+
+        t4 = time.perf_counter()
+
+        if pool:
+            shifts = [future.result() for future in futures]
+            pool.shutdown()
+        else:
+            shifts = futures
+
+        t5 = time.perf_counter()
+
+        if verbose:
+            print("")
+
+        self.timings = {
+            "points": tot,
+            "set": t_set,
+            "acquire": t_acq,
+            "register_wait": t5 - t4,
+            "total": t5 - t0
+        }
+
+        logger.info("Grid acquisition (%d points): set %.2f s, acquire %.2f s, waiting for registration %.2f s, total %.2f s",
+                    tot, t_set, t_acq, t5 - t4, t5 - t0)
+
+        return np.array(shifts), np.array(readouts), headers
+
+
+def benchmark(gridsize: int=5, exposure: float=0.01, workers=(0, 2, 4)):
+    """Time the calibration grid acquisition on the simulated microscope/camera
+    for different numbers of registration workers. Only the registration is done
+    in the pool, so the gain depends on how much of the per-point time is spent
+    on the microscope/camera side."""
+    from instamatic.TEMController import initialize
+    from instamatic.tools import autoscale
+
+    ctrl = initialize(tem_name="simulate", cam_name="simulate", stream=False)
+
+    binsize = 1
+    img_cent, h_cent = ctrl.getImage(exposure=exposure, binsize=binsize, header_keys="BeamShift")
+    img_cent, scale = autoscale(img_cent)
+
+    x_cent, y_cent = h_cent["BeamShift"]
+    positions = make_grid(gridsize, stepsize=100)
+
+    def set_position(i, dx, dy):
+        ctrl.beamshift.set(x=x_cent+dx, y=y_cent+dy)
+
+    print(f"Gridsize: {gridsize} ({len(positions)} points) | exposure: {exposure} s")
+    for n in workers:
+        grid = GridAcquisition(ctrl, img_cent, scale, exposure=exposure, binsize=binsize, workers=n)
+        grid.run(positions, set_position, header_key="BeamShift", verbose=False)
+        t = grid.timings
+        print(f"workers={n:2d} | total: {t['total']:6.2f} s | set: {t['set']:6.2f} s | acquire: {t['acquire']:6.2f} s | waiting for registration: {t['register_wait']:6.2f} s")
+
+    ctrl.beamshift.set(x=x_cent, y=y_cent)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -2,12 +2,14 @@
 
 import sys, os
 import numpy as np
-import matplotlib.pyplot as plt
+from instamatic.utils.lazy_import import lazy_import
+plt = lazy_import("matplotlib.pyplot")
 
 from instamatic.tools import *
 from instamatic.processing.cross_correlate import cross_correlate
 from instamatic.TEMController import initialize
 from .fit import fit_affine_transformation
+from .acquisition import GridAcquisition, make_grid
 from .filenames import *
 
 from instamatic.processing.find_holes import find_holes
@@ -117,7 +119,7 @@ class CalibBeamShift(object):
             return beamshift
 
 
-def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=False, outdir=".", **kwargs):
+def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=False, outdir=".", workers=2, **kwargs):
     """
     Calibrate pixel->beamshift coordinates live on the microscope
 
@@ -131,6 +133,8 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
     exposure: `float` or None
         exposure time
     binsize: `int` or None
+    workers: `int`
+        Number of threads to register the images in while the next grid point is acquired
 
     In case paramers are not defined, camera specific default parameters are retrieved
 
@@ -163,41 +167,23 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
     print("Beamshift: x={} | y={}".format(*beamshift_cent))
     print("Pixel: x={} | y={}".format(*pixel_cent))
         
-    shifts = []
-    beampos = []
-    
-    n = int((gridsize - 1) / 2)  # number of points = n*(n+1)
-    x_grid, y_grid = np.meshgrid(np.arange(-n, n+1) * stepsize, np.arange(-n, n+1) * stepsize)
-    tot = gridsize*gridsize
+    positions = make_grid(gridsize, stepsize)
 
-    i = 0
-    for dx,dy in np.stack([x_grid, y_grid]).reshape(2,-1).T:
+    def set_position(i, dx, dy):
         ctrl.beamshift.set(x=x_cent+dx, y=y_cent+dy)
 
-        printer("Position: {}/{}: {}".format(i+1, tot, ctrl.beamshift))
-
-        outfile = os.path.join(outdir, "calib_beamshift_{:04d}".format(i)) if save_images else None
-
-        comment = "Calib image {}: dx={} - dy={}".format(i, dx, dy)
-        img, h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys="BeamShift")
-        img = imgscale(img, scale)
-
-        shift = cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
-        
-        beamshift = np.array(h["BeamShift"])
-        beampos.append(beamshift)
-        shifts.append(shift)
+    outfiles = [os.path.join(outdir, "calib_beamshift_{:04d}".format(i)) for i in range(len(positions))] if save_images else None
 
-        i += 1
+    grid = GridAcquisition(ctrl, img_cent, scale, exposure=exposure, binsize=binsize, workers=workers)
+    shifts, beampos, headers = grid.run(positions, set_position, header_key="BeamShift", outfiles=outfiles)
     
-    print("")
     # print "\nReset to center"
     
     ctrl.beamshift.set(*beamshift_cent)
 
     # correct for binsize, store in binsize=1
-    shifts = np.array(shifts) * binsize / scale
-    beampos = np.array(beampos) - np.array((beamshift_cent))
+    shifts = shifts * binsize / scale
+    beampos = beampos - np.array((beamshift_cent))
     
     c = CalibBeamShift.from_data(shifts, beampos, reference_shift=beamshift_cent, reference_pixel=pixel_cent, header=h_cent)
     
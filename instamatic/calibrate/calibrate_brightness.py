@@ -2,7 +2,8 @@
 
 import sys, os
 import numpy as np
-import matplotlib.pyplot as plt
+from instamatic.utils.lazy_import import lazy_import
+plt = lazy_import("matplotlib.pyplot")
 
 from instamatic.tools import *
 from instamatic.TEMController import initialize
@@ -2,12 +2,14 @@
 
 import sys, os
 import numpy as np
-import matplotlib.pyplot as plt
+from instamatic.utils.lazy_import import lazy_import
+plt = lazy_import("matplotlib.pyplot")
 
 from instamatic.tools import *
 from instamatic.processing.cross_correlate import cross_correlate
 from instamatic.TEMController import initialize
 from .fit import fit_affine_transformation
+from .acquisition import GridAcquisition, make_grid
 from .filenames import *
 
 from instamatic import config
@@ -175,7 +177,7 @@ class CalibDirectBeam(object):
             plt.show()
 
 
-def calibrate_directbeam_live(ctrl, key="DiffShift", gridsize=None, stepsize=None, save_images=False, outdir=".", **kwargs):
+def calibrate_directbeam_live(ctrl, key="DiffShift", gridsize=None, stepsize=None, save_images=False, outdir=".", workers=2, **kwargs):
     """
     Calibrate pixel->beamshift coordinates live on the microscope
 
@@ -190,6 +192,8 @@ def calibrate_directbeam_live(ctrl, key="DiffShift", gridsize=None, stepsize=Non
     exposure: `float` or None
         exposure time
     binsize: `int` or None
+    workers: `int`
+        Number of threads to register the images in while the next grid point is acquired
 
     In case paramers are not defined, camera specific default parameters are 
 
@@ -219,39 +223,22 @@ def calibrate_directbeam_live(ctrl, key="DiffShift", gridsize=None, stepsize=Non
 
     print("{}: x={} | y={}".format(key, *readout_cent))
             
-    shifts = []
-    readouts = []
-    
-    n = int((gridsize - 1) / 2) # number of points = n*(n+1)
-    x_grid, y_grid = np.meshgrid(np.arange(-n, n+1) * stepsize, np.arange(-n, n+1) * stepsize)
-    tot = gridsize*gridsize
-
-    for i, (dx,dy) in enumerate(np.stack([x_grid, y_grid]).reshape(2,-1).T):
-        i += 1
+    positions = make_grid(gridsize, stepsize)
 
+    def set_position(i, dx, dy):
         attr.set(x=x_cent+dx, y=y_cent+dy)
 
-        printer("Position: {}/{}: {}".format(i, tot, attr))
-        
-        outfile = os.path.join(outdir, "calib_db_{}_{:04d}".format(key, i)) if save_images else None
-
-        comment = "Calib image {}: dx={} - dy={}".format(i, dx, dy)
-        img, h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys=key)
-        img = imgscale(img, scale)
+    outfiles = [os.path.join(outdir, "calib_db_{}_{:04d}".format(key, i+1)) for i in range(len(positions))] if save_images else None
 
-        shift = cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
-        
-        readout = np.array(h[key])
-        readouts.append(readout)
-        shifts.append(shift)
+    grid = GridAcquisition(ctrl, img_cent, scale, exposure=exposure, binsize=binsize, workers=workers)
+    shifts, readouts, headers = grid.run(positions, set_position, header_key=key, outfiles=outfiles)
     
-    print("")
     # print "\nReset to center"
     attr.set(*readout_cent)
 
     # correct for binsize, store in binsize=1
-    shifts = np.array(shifts) * binsize / scale
-    readouts = np.array(readouts) - np.array((readout_cent))
+    shifts = shifts * binsize / scale
+    readouts = readouts - np.array((readout_cent))
     
     c = CalibDirectBeam.from_data(shifts, readouts, key, header=h_cent, **refine_params[key])
     
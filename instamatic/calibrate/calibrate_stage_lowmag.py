@@ -2,13 +2,14 @@
 
 import sys, os
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
+from instamatic.utils.lazy_import import lazy_import
+plt = lazy_import("matplotlib.pyplot")
 
 from instamatic.tools import *
 from instamatic.processing.cross_correlate import cross_correlate
 from instamatic.TEMController import initialize
 from .fit import fit_affine_transformation
+from .acquisition import GridAcquisition, make_grid
 from .filenames import *
 
 import pickle
@@ -216,7 +217,7 @@ class CalibStage(object):
         plt.show()
 
 
-def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=False, **kwargs):
+def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=False, workers=2, **kwargs):
     """
     Calibrate pixel->stageposition coordinates live on the microscope
 
@@ -229,6 +230,8 @@ def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=Fa
     exposure: `float`
         exposure time
     binsize: `int`
+    workers: `int`
+        Number of threads to register the images in while the next grid point is acquired
 
     return:
         instance of Calibration class with conversion methods
@@ -248,43 +251,27 @@ def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=Fa
     
     img_cent, scale = autoscale(img_cent)
 
-    stagepos = []
-    shifts = []
-    
-    n = int((gridsize - 1) / 2) # number of points = n*(n+1)
-    x_grid, y_grid = np.meshgrid(np.arange(-n, n+1) * stepsize, np.arange(-n, n+1) * stepsize)
-    tot = gridsize*gridsize
+    positions = make_grid(gridsize, stepsize)
 
-    i = 0
-    for dx,dy in np.stack([x_grid, y_grid]).reshape(2,-1).T:
+    def set_position(i, dx, dy):
         print()
-        print("Position {}/{}: x: {:.0f}, y: {:.0f}".format(i+1, tot, x_cent+dx, y_cent+dy))
-        
+        print("Position {}/{}: x: {:.0f}, y: {:.0f}".format(i+1, len(positions), x_cent+dx, y_cent+dy))
         ctrl.stageposition.set(x=x_cent+dx, y=y_cent+dy)
         print(ctrl.stageposition)
-        
-        outfile = "calib_{:04d}".format(i) if save_images else None
 
-        comment = comment
-        img, h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys="StagePosition")
-        
-        img = imgscale(img, scale)
+    outfiles = ["calib_{:04d}".format(i) for i in range(len(positions))] if save_images else None
 
-        shift = cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
-        
-        xobs, yobs, _, _, _ = h["StagePosition"]
-        stagepos.append((xobs, yobs))
-        shifts.append(shift)
-        
-        i += 1
+    grid = GridAcquisition(ctrl, img_cent, scale, exposure=exposure, binsize=binsize, workers=workers)
+    shifts, stagepos, headers = grid.run(positions, set_position, header_key="StagePosition", 
+                                         readout=lambda h: h["StagePosition"][:2], outfiles=outfiles, verbose=False)
     
     print(" >> Reset to center")
     ctrl.stageposition.set(x=x_cent, y=y_cent)
     ctrl.stageposition.reset_xy()
 
     # correct for binsize, store as binsize=1
-    shifts = np.array(shifts) * binsize / scale
-    stagepos = np.array(stagepos) - np.array((x_cent, y_cent))
+    shifts = shifts * binsize / scale
+    stagepos = stagepos - np.array((x_cent, y_cent))
 
     m = gridsize**2 // 2 
     if gridsize % 2 and stagepos[m].max() > 50:
@@ -299,7 +286,7 @@ def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=Fa
     
     # Calling c.plot with videostream crashes program
     if not hasattr(ctrl.cam, "VideoLoop"):
-        c.plot(key)
+        c.plot()
 
     return c
 
@@ -8,6 +8,7 @@ from instamatic.io import get_new_work_subdirectory
 from instamatic.processing.cross_correlate import cross_correlate
 from instamatic.TEMController import initialize
 from .fit import fit_affine_transformation
+from .acquisition import GridAcquisition
 from .filenames import *
 from .calibrate_stage_lowmag import CalibStage
 from instamatic.formats import read_image
@@ -45,7 +46,7 @@ def plot_it(arr1, arr2, params):
     plt.show()
 
 
-def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True, save_images=False, **kwargs):
+def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True, save_images=False, workers=2, **kwargs):
     """
     Calibrate pixel->stageposition coordinates live on the microscope
 
@@ -61,6 +62,8 @@ def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True,
     exposure: `float`
         Exposure time in seconds
     binsize: `int`
+    workers: `int`
+        Number of threads to register the images in while the next grid point is acquired
 
     return:
         instance of Calibration class with conversion methods
@@ -100,18 +103,14 @@ def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True,
     
     img_cent, scale = autoscale(img_cent)
 
-    stagepos = []
-    shifts = []
-    
     n = int((gridsize - 1) / 2) # number of points = n*(n+1)
-    x_grid, y_grid = np.meshgrid(np.arange(-n, n+1) * stepsize, np.arange(-n, n+1) * stepsize)
-    tot = gridsize*gridsize
-
-    i = 0
 
     x_range = np.arange(-n, n+1) * stepsize
     y_range = np.arange(-n, n+1) * stepsize
 
+    positions = np.array([(dx, dy) for dx in x_range for dy in y_range])
+    tot = len(positions)
+
     if minimize_backlash:
         xtarget = x_cent + x_range[0]
         ytarget = y_cent + y_range[0]
@@ -120,38 +119,25 @@ def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True,
 
         print("(minimize_backlash) Overshoot a bit in XY: ", ctrl.stageposition.xy)
 
-    for dx in x_range:
-        for dy in y_range:
-            ctrl.stageposition.set(x=x_cent+dx, y=y_cent+dy)
+    def set_position(i, dx, dy):
+        if minimize_backlash and i > 0 and dy == y_range[0]:
+            ytarget = y_cent + y_range[0]
+            ctrl.stageposition.set(y=ytarget-stepsize)
             time.sleep(settle_delay)
-            stage = ctrl.stageposition.get()
-
-            print()
-            print("Position {}/{}".format(i+1, tot))
-            print(stage)
-            
-            outfile = work_drc / "calib_{:04d}".format(i) if save_images else None
-
-            comment = "Calib image {}: dx={} - dy={}".format(i, dx, dy)
-            img, h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=comment)
-            
-            img = imgscale(img, scale)
+            print("(minimize_backlash) Overshoot a bit in Y: ", ctrl.stageposition.xy)
 
-            shift = cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
+        ctrl.stageposition.set(x=x_cent+dx, y=y_cent+dy)
+        time.sleep(settle_delay)
 
-            xobs = stage.x
-            yobs = stage.y        
+        print()
+        print("Position {}/{}".format(i+1, tot))
+        print(ctrl.stageposition)
 
-            stagepos.append((xobs, yobs))
-            shifts.append(shift)
-            
-            i += 1
+    outfiles = [work_drc / "calib_{:04d}".format(i) for i in range(tot)] if save_images else None
 
-        if minimize_backlash:
-            ytarget = y_cent + y_range[0]
-            ctrl.stageposition.set(y=ytarget-stepsize)
-            time.sleep(settle_delay)
-            print("(minimize_backlash) Overshoot a bit in Y: ", ctrl.stageposition.xy)
+    grid = GridAcquisition(ctrl, img_cent, scale, exposure=exposure, binsize=binsize, workers=workers)
+    shifts, stagepos, headers = grid.run(positions, set_position, header_key="StagePosition", 
+                                         readout=lambda h: h["StagePosition"][:2], outfiles=outfiles, verbose=False)
     
     print(" >> Reset to center")
     ctrl.stageposition.set(x=x_cent, y=y_cent)
@@ -159,8 +145,8 @@ def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True,
     # ctrl.stageposition.reset_xy()
 
     # correct for binsize, store as binsize=1
-    shifts = np.array(shifts) * binsize / scale
-    stagepos = np.array(stagepos) - np.array((x_cent, y_cent))
+    shifts = shifts * binsize / scale
+    stagepos = stagepos - np.array((x_cent, y_cent))
 
     m = gridsize**2 // 2 
     if gridsize % 2 and stagepos[m].max() > 50:
@@ -1,9 +1,151 @@
 import numpy as np
-import lmfit
-from instamatic.tools import *
 
 
-def fit_affine_transformation(a, b, rotation=True, scaling=True, translation=False, shear=False, as_params=False, verbose=False, **x0):
+def _affine_matrix(angle, sx, sy, k1=1, k2=1):
+    """Return the transformation matrix `r` for the given parameters, so that `fit = np.dot(arr1, r) + t`.
+    Works on scalars or arrays of parameters (returns shape (..., 2, 2))"""
+    sin = np.sin(angle)
+    cos = np.cos(angle)
+
+    r = np.array([
+        [ sx*cos, -sy*k1*sin],
+        [ sx*k2*sin,  sy*cos]])
+
+    return np.moveaxis(r, (0, 1), (-2, -1))
+
+
+def _polymul(p, q):
+    """Multiply polynomials with coefficients along the last axis (ascending order), broadcasting over the rest"""
+    n, m = p.shape[-1], q.shape[-1]
+    out = np.zeros(np.broadcast(p[..., :1], q[..., :1]).shape[:-1] + (n+m-1,))
+    for i in range(n):
+        out[..., i:i+m] += p[..., i:i+1] * q
+    return out
+
+
+def _polyder(p):
+    """Derivative of polynomials with coefficients along the last axis (ascending order)"""
+    return p[..., 1:] * np.arange(1, p.shape[-1])
+
+
+def _best_angle_with_scaling(C, P):
+    """Find the rotation angle that minimizes the residual when sx and sy are refined freely.
+
+    For a fixed angle, the optimal scale factors follow from linear least squares, and the residual
+    reduces to `const - f(theta)` with
+        f = (p00 + t*p10)**2 / (C00 + 2*t*C01 + t**2*C11) + (p11 - t*p01)**2 / (C11 - 2*t*C01 + t**2*C00)
+    where t = tan(theta). The stationary points of f are the roots of a polynomial of degree 6 in t,
+    so the optimum is found by evaluating f at those roots (+ theta=pi/2) and taking the maximum."""
+    C00, C01, C11 = C[..., 0, 0], C[..., 0, 1], C[..., 1, 1]
+    p00, p01, p10, p11 = P[..., 0, 0], P[..., 0, 1], P[..., 1, 0], P[..., 1, 1]
+
+    N0 = np.stack([p00, p10], axis=-1)
+    D0 = np.stack([C00, 2*C01, C11], axis=-1)
+    N1 = np.stack([p11, -p01], axis=-1)
+    D1 = np.stack([C11, -2*C01, C00], axis=-1)
+
+    # numerator of d/dt (N**2/D) = 2*N*N'*D - N**2*D'
+    Q0 = 2 * _polymul(_polymul(N0, _polyder(N0)), D0) - _polymul(_polymul(N0, N0), _polyder(D0))
+    Q1 = 2 * _polymul(_polymul(N1, _polyder(N1)), D1) - _polymul(_polymul(N1, N1), _polyder(D1))
+    Q = _polymul(Q0, _polymul(D1, D1)) + _polymul(Q1, _polymul(D0, D0))
+
+    batch_shape = Q.shape[:-1]
+    Q = Q.reshape(-1, Q.shape[-1])
+
+    ncand = Q.shape[-1]  # 1 + maximum number of roots
+    candidates = np.full((len(Q), ncand), np.pi / 2)
+    for i, coefs in enumerate(Q):
+        if not np.any(coefs):
+            continue
+        roots = np.roots(coefs[::-1])
+        roots = roots[np.abs(roots.imag) <= 1e-6 * (1 + np.abs(roots.real))].real
+        candidates[i, :len(roots)] = np.arctan(roots)
+
+    candidates = candidates.reshape(batch_shape + (ncand,))
+
+    sin = np.sin(candidates)
+    cos = np.cos(candidates)
+    f0 = (cos*p00[..., None] + sin*p10[..., None])**2 / (cos**2*C00[..., None] + 2*cos*sin*C01[..., None] + sin**2*C11[..., None])
+    f1 = (cos*p11[..., None] - sin*p01[..., None])**2 / (sin**2*C00[..., None] - 2*cos*sin*C01[..., None] + cos**2*C11[..., None])
+    f = np.nan_to_num(f0 + f1)
+
+    best = np.argmax(f, axis=-1)
+    return np.take_along_axis(candidates, best[..., None], axis=-1)[..., 0]
+
+
+def _fit_linear(a, b, rotation=True, scaling=True, translation=False, **x0):
+    """Closed-form least-squares solution for the affine transformation without shear.
+
+    `a` and `b` have shape (..., N, 2), all leading dimensions are treated as a batch.
+    Returns `angle, sx, sy, tx, ty` as arrays with the batch shape."""
+    batch_shape = a.shape[:-2]
+
+    if translation:
+        a_mean = a.mean(axis=-2)
+        b_mean = b.mean(axis=-2)
+        a_c = a - a_mean[..., None, :]
+        b_c = b - b_mean[..., None, :]
+    else:
+        a_c = a
+        b_c = b - np.array([x0.get("tx", 0), x0.get("ty", 0)])
+
+    C = np.einsum("...ni,...nj->...ij", a_c, a_c)
+    P = np.einsum("...ni,...nj->...ij", a_c, b_c)
+
+    if rotation and scaling:
+        angle = _best_angle_with_scaling(C, P)
+    elif rotation:
+        # Orthogonal Procrustes with isotropic fixed scale, maximizes trace(r.T * P)
+        s = np.sign(x0.get("sx", 1)) or 1
+        angle = np.arctan2(s*(P[..., 1, 0] - P[..., 0, 1]), s*(P[..., 0, 0] + P[..., 1, 1]))
+    else:
+        angle = np.full(batch_shape, x0.get("angle", 0), dtype=float)
+
+    sin = np.sin(angle)
+    cos = np.cos(angle)
+
+    if scaling:
+        rho0 = np.stack([cos, sin], axis=-1)
+        rho1 = np.stack([-sin, cos], axis=-1)
+        sx = np.einsum("...i,...i->...", rho0, P[..., :, 0]) / np.einsum("...i,...ij,...j->...", rho0, C, rho0)
+        sy = np.einsum("...i,...i->...", rho1, P[..., :, 1]) / np.einsum("...i,...ij,...j->...", rho1, C, rho1)
+    else:
+        sx = np.full(batch_shape, x0.get("sx", 1), dtype=float)
+        sy = np.full(batch_shape, x0.get("sy", 1), dtype=float)
+
+    if rotation and scaling:
+        # angle and angle+pi describe the same matrix, prefer positive sx
+        flip = sx < 0
+        angle = np.where(flip, angle + np.pi, angle)
+        angle = np.where(angle > np.pi, angle - 2*np.pi, angle)
+        sx = np.where(flip, -sx, sx)
+        sy = np.where(flip, -sy, sy)
+
+    if translation:
+        r = _affine_matrix(angle, sx, sy)
+        t = b_mean - np.einsum("...i,...ij->...j", a_mean, r)
+        tx, ty = t[..., 0], t[..., 1]
+    else:
+        tx = np.full(batch_shape, x0.get("tx", 0), dtype=float)
+        ty = np.full(batch_shape, x0.get("ty", 0), dtype=float)
+
+    return angle, sx, sy, tx, ty
+
+
+def _can_fit_linear(rotation, scaling, shear, **x0):
+    """Check whether the parameter set can be solved with the closed-form solution"""
+    if shear:
+        return False
+    if x0.get("k1", 1) != 1 or x0.get("k2", 1) != 1:
+        return False
+    if rotation and not scaling and x0.get("sx", 1) != x0.get("sy", 1):
+        return False
+    return True
+
+
+def _fit_lmfit(a, b, rotation=True, scaling=True, translation=False, shear=False, verbose=False, **x0):
+    import lmfit
+
     params = lmfit.Parameters()
     params.add("angle", value=x0.get("angle", 0), vary=rotation, min=-np.pi, max=np.pi)
     params.add("sx"   , value=x0.get("sx"   , 1), vary=scaling)
@@ -12,54 +154,169 @@ def fit_affine_transformation(a, b, rotation=True, scaling=True, translation=Fal
     params.add("ty"   , value=x0.get("ty"   , 0), vary=translation)
     params.add("k1"   , value=x0.get("k1"   , 1), vary=shear)
     params.add("k2"   , value=x0.get("k2"   , 1), vary=shear)
-    
+
     def objective_func(params, arr1, arr2):
         angle = params["angle"].value
         sx    = params["sx"].value
-        sy    = params["sy"].value 
+        sy    = params["sy"].value
         tx    = params["tx"].value
         ty    = params["ty"].value
         k1    = params["k1"].value
         k2    = params["k2"].value
-        
-        sin = np.sin(angle)
-        cos = np.cos(angle)
 
-        r = np.array([
-            [ sx*cos, -sy*k1*sin],
-            [ sx*k2*sin,  sy*cos]])
+        r = _affine_matrix(angle, sx, sy, k1, k2)
         t = np.array([tx, ty])
 
         fit = np.dot(arr1, r) + t
         return fit-arr2
-    
+
     method = "leastsq"
     args = (a, b)
     res = lmfit.minimize(objective_func, params, args=args, method=method)
-    
+
     if res.success and not verbose:
         print("Minimization converged after {} cycles with chisqr of {}".format(res.nfev, res.chisqr))
     else:
         lmfit.report_fit(res)
 
-    angle = res.params["angle"].value
-    sx    = res.params["sx"].value
-    sy    = res.params["sy"].value 
-    tx    = res.params["tx"].value
-    ty    = res.params["ty"].value
-    k1    = res.params["k1"].value
-    k2    = res.params["k2"].value
-    
-    sin = np.sin(angle)
-    cos = np.cos(angle)
-    
-    r = np.array([
-        [ sx*cos, -sy*k1*sin],
-        [ sx*k2*sin,  sy*cos]])
-    t = np.array([tx, ty])
-    
+    return res.params
+
+
+def fit_affine_transformation(a, b, rotation=True, scaling=True, translation=False, shear=False, as_params=False, verbose=False, method="auto", **x0):
+    """Fit the affine transformation `b = np.dot(a, r) + t`, with `r` composed of a rotation (`angle`),
+    scaling (`sx`, `sy`) and optionally shear (`k1`, `k2`). Parameters that are not refined are taken from `x0`.
+
+    method: `str`
+        'auto' uses the closed-form least-squares solution when no shear is refined, and lmfit otherwise
+        'lmfit' always uses the iterative lmfit minimizer
+
+    Returns the transformation matrix `r` and translation `t`, or the lmfit parameters if `as_params` is set.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+
+    if method == "auto" and _can_fit_linear(rotation, scaling, shear, **x0):
+        angle, sx, sy, tx, ty = (float(val) for val in _fit_linear(a, b, rotation=rotation, scaling=scaling, translation=translation, **x0))
+        k1 = k2 = 1.0
+
+        r = _affine_matrix(angle, sx, sy)
+        t = np.array([tx, ty])
+        chisqr = np.sum((np.dot(a, r) + t - b)**2)
+
+        if verbose:
+            print("Linear least-squares fit with chisqr of {}".format(chisqr))
+            print("angle: {:.6f} | sx: {:.6f} | sy: {:.6f} | tx: {:.6f} | ty: {:.6f}".format(angle, sx, sy, tx, ty))
+
+        if as_params:
+            import lmfit
+            params = lmfit.Parameters()
+            for name, value, vary in (("angle", angle, rotation), ("sx", sx, scaling), ("sy", sy, scaling),
+                                      ("tx", tx, translation), ("ty", ty, translation), ("k1", k1, False), ("k2", k2, False)):
+                params.add(name, value=value, vary=vary)
+            return params
+        else:
+            return r, t
+
+    params = _fit_lmfit(a, b, rotation=rotation, scaling=scaling, translation=translation, shear=shear, verbose=verbose, **x0)
+
     if as_params:
-        return res.params
-    else:
-        return r, t
+        return params
+
+    angle = params["angle"].value
+    sx    = params["sx"].value
+    sy    = params["sy"].value
+    tx    = params["tx"].value
+    ty    = params["ty"].value
+    k1    = params["k1"].value
+    k2    = params["k2"].value
+
+    r = _affine_matrix(angle, sx, sy, k1, k2)
+    t = np.array([tx, ty])
+
+    return r, t
+
+
+def fit_affine_transformation_batch(a, b, rotation=True, scaling=True, translation=False, shear=False, **x0):
+    """Fit many sets of points at once, for example to build per-magnification calibration tables.
+
+    a, b: `np.ndarray` with shape (M, N, 2) or `list` of (N_i, 2) arrays
+        M sets of N corresponding points
+
+    Returns the transformation matrices with shape (M, 2, 2) and translations with shape (M, 2).
+    Sets with the same number of points are solved in a single vectorized call,
+    shear/constrained fits fall back to lmfit for every set.
+    """
+    if not _can_fit_linear(rotation, scaling, shear, **x0):
+        rs, ts = zip(*(fit_affine_transformation(a_i, b_i, rotation=rotation, scaling=scaling, translation=translation, shear=shear, **x0)
+                       for a_i, b_i in zip(a, b)))
+        return np.array(rs), np.array(ts)
+
+    if len(set(len(a_i) for a_i in a)) > 1:
+        # point sets with different lengths, solve each group with the same number of points at once
+        rs = np.empty((len(a), 2, 2))
+        ts = np.empty((len(a), 2))
+        for n in set(len(a_i) for a_i in a):
+            idx = [i for i, a_i in enumerate(a) if len(a_i) == n]
+            rs[idx], ts[idx] = fit_affine_transformation_batch([a[i] for i in idx], [b[i] for i in idx],
+                                                               rotation=rotation, scaling=scaling, translation=translation, **x0)
+        return rs, ts
+
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+
+    if a.ndim != 3 or a.shape != b.shape:
+        raise ValueError("Expected point sets with shape (M, N, 2), got {} and {}".format(a.shape, b.shape))
+
+    angle, sx, sy, tx, ty = _fit_linear(a, b, rotation=rotation, scaling=scaling, translation=translation, **x0)
+
+    r = _affine_matrix(angle, sx, sy)
+    t = np.stack([tx, ty], axis=-1)
+
+    return r, t
+
+
+def benchmark(npoints: int=25, nsets: int=200, noise: float=0.5):
+    """Compare the closed-form solution with lmfit on random rotation+scaling+translation data"""
+    import time
+    import io
+    from contextlib import redirect_stdout
+
+    np.random.seed(0)
+
+    a = np.random.uniform(-250, 250, size=(nsets, npoints, 2))
+    angle = np.random.uniform(-np.pi, np.pi, size=nsets)
+    sx = np.random.uniform(0.5, 2.0, size=nsets)
+    sy = sx * np.random.uniform(0.95, 1.05, size=nsets)
+    t = np.random.uniform(-100, 100, size=(nsets, 2))
+
+    r = _affine_matrix(angle, sx, sy)
+    b = np.einsum("mni,mij->mnj", a, r) + t[:, None, :] + np.random.normal(scale=noise, size=a.shape)
+
+    n_lmfit = min(nsets, 20)
+
+    t0 = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        r_lm = np.array([fit_affine_transformation(a[i], b[i], translation=True, method="lmfit")[0] for i in range(n_lmfit)])
+    t1 = time.perf_counter()
+    for i in range(nsets):
+        r_cf, t_cf = fit_affine_transformation(a[i], b[i], translation=True)
+    t2 = time.perf_counter()
+    r_batch, t_batch = fit_affine_transformation_batch(a, b, translation=True)
+    t3 = time.perf_counter()
+
+    t_lmfit = (t1 - t0) / n_lmfit
+    t_single = (t2 - t1) / nsets
+    t_batch = (t3 - t2) / nsets
+
+    diff = np.abs(r_lm - r_batch[:n_lmfit]).max()
+
+    print(f"Points per set: {npoints} | sets: {nsets}")
+    print(f"lmfit       : {t_lmfit*1000:8.3f} ms/set")
+    print(f"closed-form : {t_single*1000:8.3f} ms/set ({t_lmfit/t_single:.0f}x)")
+    print(f"batch       : {t_batch*1000:8.3f} ms/set ({t_lmfit/t_batch:.0f}x)")
+    print(f"Max. difference in `r` between lmfit and closed-form: {diff:.2e}")
+    print(f"Max. difference in `r` with the ground truth: {np.abs(r_batch - r).max():.2e}")
+
 
+if __name__ == '__main__':
+    benchmark()
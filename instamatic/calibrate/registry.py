@@ -0,0 +1,89 @@
+import os
+import pickle
+import threading
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def load_pickle(fn: str):
+    with open(fn, "rb") as f:
+        return pickle.load(f)
+
+
+class CalibrationRegistry(object):
+    """Load calibration files once per session.
+
+    Files are parsed on first use and kept in memory. On every access the modification time
+    and size of the file are checked, and the file is only parsed again if it has changed
+    (e.g. after a new calibration has been run). Missing files raise `FileNotFoundError`
+    (an `IOError`), like the `from_file` loaders of the calibration classes.
+
+    Inverse transformation matrices are also cached, so that they are only computed once
+    for every calibration.
+
+    Usage:
+        from instamatic.calibrate.registry import registry
+        calib_beamshift = registry.get(CALIB_BEAMSHIFT, loader=CalibBeamShift.from_file)
+        transform, c = registry.get(CALIB_IS1_FOC)
+        transform_inv = registry.inv(transform)
+    """
+    def __init__(self):
+        super().__init__()
+        self._cache = {}     # path -> (stamp, value)
+        self._inverse = {}   # matrix bytes -> inverse
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _stamp(fn: str) -> tuple:
+        st = os.stat(fn)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, fn: str, loader=load_pickle):
+        """Return the contents of calibration file `fn`, parsed with `loader(fn)` if it
+        has not been loaded before or if it has changed on disk"""
+        key = os.path.abspath(fn)
+        stamp = self._stamp(key)
+
+        with self.lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == stamp:
+                self.hits += 1
+                return cached[1]
+
+            value = loader(fn)
+            self._cache[key] = (stamp, value)
+            self.misses += 1
+
+        logger.debug("Loaded calibration: %s", key)
+        return value
+
+    def inv(self, matrix: np.ndarray) -> np.ndarray:
+        """Return the (cached) inverse of `matrix`"""
+        matrix = np.asarray(matrix)
+        key = (matrix.shape, matrix.dtype.str, matrix.tobytes())
+        with self.lock:
+            inverse = self._inverse.get(key)
+            if inverse is None:
+                inverse = np.linalg.inv(matrix)
+                inverse.flags.writeable = False
+                self._inverse[key] = inverse
+        return inverse
+
+    def invalidate(self, fn: str=None):
+        """Forget the cached file `fn`, or all files if `fn` is None"""
+        with self.lock:
+            if fn is None:
+                self._cache.clear()
+                self._inverse.clear()
+            else:
+                self._cache.pop(os.path.abspath(fn), None)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(files={len(self._cache)}, hits={self.hits}, misses={self.misses})"
+
+
+registry = CalibrationRegistry()
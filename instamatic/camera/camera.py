@@ -55,6 +55,10 @@ def Camera(name: str=None, as_stream: bool=False, use_server: bool=False):
         else:
             cam = cam_cls()
 
+    if getattr(config.cfg, "instrument_calls", True):
+        from instamatic.utils.instrumentation import instrument
+        instrument(cam, prefix="cam")
+
     if as_stream:
         if cam.streamable:
             from .videostream import VideoStream
@@ -6,10 +6,15 @@ import logging
 logger = logging.getLogger(__name__)
 
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 
 from instamatic import config
+from instamatic.formats import write_tiff
 
-import comtypes.client
+try:
+    import comtypes.client
+except ImportError:
+    comtypes = None  # only the stand-in (`emmenu_simu`) can be used
 
 import sys
 
@@ -29,6 +34,16 @@ type_dict = {
     11: "IMG_EMVECTOR"  # no method on EMImage
 }
 
+dtype_dict = {
+    1: np.uint8,
+    2: np.uint16,
+    3: np.int16,
+    4: np.int32,
+    5: np.float32,
+    6: np.float64,
+    7: np.complex64,
+}
+
 
 def EMVector2dict(vec):
     """Convert EMVector object to a Python dictionary"""
@@ -37,16 +52,18 @@ def EMVector2dict(vec):
         if k.startswith("_"):
             continue
         v = getattr(vec, k)
+        if callable(v):  # methods of the COM object
+            continue
         if isinstance(v, int):
             d[k] = v
         elif isinstance(v, float):
             d[k] = v
         elif isinstance(v, str):
             d[k] = v
-        elif isinstance(v, comtypes.Array):
+        elif comtypes and isinstance(v, comtypes.Array):
             d[k] = list(v)
         else:
-            print(k, v, type(v))
+            logger.debug(f"EMVector: skipped {k}={v} ({type(v)})")
 
     return d
 
@@ -54,18 +71,26 @@ def EMVector2dict(vec):
 class CameraEMMENU(object):
     """docstring for CameraEMMENU"""
 
-    def __init__(self, drc_name: str="Instamatic data", interface: str="emmenu"):
-        """Initialize camera module """
+    def __init__(self, drc_name: str="Instamatic data", interface: str="emmenu", app=None):
+        """Initialize camera module
+
+        app: EMMENU application object to use instead of the COM server (e.g. `emmenu_simu.EMMENUApplication`)"""
         super().__init__()
 
-        try:
-            comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
-        except WindowsError:
-            comtypes.CoInitialize()
+        self._com = app is None
+
+        if self._com:
+            try:
+                comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+            except WindowsError:
+                comtypes.CoInitialize()
 
         self.name = interface
 
-        self._obj = comtypes.client.CreateObject("EMMENU4.EMMENUApplication.1", comtypes.CLSCTX_ALL)
+        if self._com:
+            self._obj = comtypes.client.CreateObject("EMMENU4.EMMENUApplication.1", comtypes.CLSCTX_ALL)
+        else:
+            self._obj = app
 
         self._recording = False
 
@@ -284,14 +309,34 @@ class CameraEMMENU(object):
     def getImageDataByIndex(self, img_index: int, drc_index: int=None) -> np.array:
         """Grab data from the image manager by index. Return numpy 2D array"""
         p = self.getImageByIndex(img_index, drc_index)
+        return self.getImageData(p)
+
+    def getImageData(self, image_pointer) -> np.array:
+        """Grab data from the image pointer. Return numpy 2D array"""
+        p = image_pointer
 
         tpe = p.DataType
         method = type_dict[tpe]
 
         f = getattr(p, method)
         arr = f()  # -> tuple of tuples
-        
-        return np.array(arr)
+
+        # `comtypes.npsupport.enable()` is not used to get numpy arrays directly,
+        # because it affects all COM interfaces in the process (e.g. the microscope)
+        return np.array(arr, dtype=dtype_dict.get(tpe))
+
+    def deleteImages(self, image_pointers: list) -> int:
+        """Delete a batch of images from EMMENU (also clears their buffers)
+        Returns the number of images that could not be deleted"""
+        failed = 0
+        for p in image_pointers:
+            try:
+                self._emi.DeleteImage(p)
+            except Exception:
+                failed += 1
+        if failed:
+            logger.warning(f"Failed to delete {failed} image buffers")
+        return failed
 
     def getDimensions(self) -> (int, int):
         """alias to getImageDimensions"""
@@ -329,15 +374,59 @@ class CameraEMMENU(object):
         TODO: write tiff from image_index instead of image_pointer??"""
         self._emf.WriteTiff(image_pointer, filename)
 
-    def writeTiffs(self, start_index: int, stop_index: int, path: str, clear_buffer: bool=True) -> None:
+    def writeTiffs(self, start_index: int, stop_index: int, path: str, clear_buffer: bool=True, workers: int=0) -> None:
         """Write a series of data in tiff format and writes them to 
-        the given `path` using EMMENU machinery"""
+        the given `path`.
+
+        By default (`workers=0`), the files are written one by one using the EMMENU machinery (`writeTiff`),
+        which stores the TVIPS metadata in the files.
+
+        With `workers>0`, the raw data are pulled from EMMENU on the calling thread (COM objects must stay
+        on their thread), and the files are written by a pool of `workers` threads. The fields of the
+        EMVector (exposure, magnification, tilt, binning, etc.) are stored in the tiff header. The buffers
+        are deleted in one batch at the end. This is only faster if the image data are transferred
+        quickly, compare both with `emmenu_simu.benchmark` and on the microscope PC."""
         path = Path(path)
-        drc_index = self.drc_index
 
         if stop_index <= start_index:
             raise IndexError(f"`stop_index`: {stop_index} >= `start_index`: {start_index}")
 
+        if not workers:
+            return self._writeTiffsEMMENU(start_index, stop_index, path, clear_buffer=clear_buffer)
+
+        drc_index = self.drc_index
+        t0 = time.perf_counter()
+
+        pointers = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for i, image_index in enumerate(range(start_index, stop_index)):
+                p = self.getImageByIndex(image_index, drc_index)
+                arr = self.getImageData(p)
+                h = EMVector2dict(p.EMVector)
+                h["ImageIndex"] = image_index
+                h["ImgCreationTime"] = h.get("lImgCreationTime")
+
+                fn = path / f"{i:04d}.tiff"
+                futures.append(pool.submit(write_tiff, fn, arr, header=h))
+                pointers.append(p)
+
+            for future in futures:
+                future.result()  # raise errors from the writers
+
+        t1 = time.perf_counter()
+
+        if clear_buffer:
+            self.deleteImages(pointers)
+
+        t2 = time.perf_counter()
+
+        print(f"Wrote {len(pointers)} images to {path} ({t1-t0:.2f} s, clearing buffers: {t2-t1:.2f} s)")
+
+    def _writeTiffsEMMENU(self, start_index: int, stop_index: int, path: Path, clear_buffer: bool=True) -> None:
+        """Write the images one by one using the EMMENU machinery"""
+        drc_index = self.drc_index
+
         for i, image_index in enumerate(range(start_index, stop_index)):
             p = self.getImageByIndex(image_index, drc_index)
 
@@ -450,7 +539,8 @@ class CameraEMMENU(object):
         # print(msg)
         logger.info(msg)
 
-        comtypes.CoUninitialize()
+        if self._com:
+            comtypes.CoUninitialize()
 
 
 if __name__ == '__main__':
@@ -10,6 +10,23 @@ import atexit
 from instamatic import config
 
 
+# Default settings for the simulated frames, can be overridden with the `simulation` block in the camera config
+SIMULATION_DEFAULTS = {
+    "frames": "diffraction",    # `diffraction` for synthetic diffraction patterns, `noise` for random noise
+    "readout": 0.0,             # s, dead time added to every exposure
+    "beam_center": None,        # (x, y), defaults to the center of the frame
+    "beam_jitter": 0.5,         # pixels, random displacement of the primary beam per frame
+    "n_spots": 200,             # number of reflections on the reciprocal lattice
+    "spot_sigma": 1.2,          # pixels
+    "spot_intensity": 2000,     # counts/s at the peak of a reflection
+    "beam_intensity": 50000,    # counts/s at the peak of the direct beam
+    "background": 20,           # counts/s, flat background
+    "rotation_speed": 0.86,     # degrees/s, only used to let the reflections fade in and out over time
+    "rocking_width": 0.5,       # degrees
+    "seed": None,
+}
+
+
 class CameraSimu(object):
     """docstring for CameraSimu"""
 
@@ -36,6 +53,91 @@ class CameraSimu(object):
 
         self.streamable = True
 
+        self.simulation = dict(SIMULATION_DEFAULTS)
+        self.simulation.update(config.camera.d.get("simulation") or {})
+        self._rng = np.random.RandomState(self.simulation["seed"])
+        self._t_start = time.perf_counter()
+        self._lattice = {}
+        self._backgrounds = {}
+
+    def _get_lattice(self, shape: tuple) -> (np.ndarray, np.ndarray):
+        """Return the spot positions (N, 2) and the angle (degrees) at which
+        each reflection is in diffraction condition for a frame of `shape`."""
+        if shape not in self._lattice:
+            sim = self.simulation
+            n = sim["n_spots"]
+            scale = min(shape) / 512
+            a = self._rng.uniform(15, 30, size=2) * scale
+            theta = self._rng.uniform(0, np.pi)
+            gamma = self._rng.uniform(np.radians(60), np.radians(120))
+            basis = np.array([[a[0] * np.cos(theta), a[0] * np.sin(theta)],
+                              [a[1] * np.cos(theta + gamma), a[1] * np.sin(theta + gamma)]])
+
+            m = int(np.sqrt(n)) // 2 + 1
+            hk = np.mgrid[-m:m + 1, -m:m + 1].reshape(2, -1).T
+            hk = hk[np.any(hk != 0, axis=1)]
+            hk = hk[np.argsort(np.abs(hk).sum(axis=1), kind="stable")][:n]
+
+            positions = hk.dot(basis)
+            phases = self._rng.uniform(0, 360, size=len(positions))
+            self._lattice[shape] = positions, phases
+
+        return self._lattice[shape]
+
+    def _get_background(self, shape: tuple, center: tuple) -> np.ndarray:
+        """Flat background + diffuse scattering around the primary beam (counts/s)"""
+        key = (shape, center)
+        if key not in self._backgrounds:
+            sim = self.simulation
+            yy, xx = np.ogrid[:shape[0], :shape[1]]
+            r = np.hypot(yy - center[0], xx - center[1])
+            bg = sim["background"] + 0.01 * sim["beam_intensity"] * np.exp(-r / (0.1 * min(shape)))
+            self._backgrounds[key] = bg.astype(np.float32)
+        return self._backgrounds[key]
+
+    def _diffraction_frame(self, exposure: float, binsize: int) -> np.ndarray:
+        """Synthetic diffraction pattern: primary beam + reflections that fade in and out
+        as if the crystal was rotating, with Poisson noise"""
+        sim = self.simulation
+        shape = tuple(d // binsize for d in self.dimensions)
+
+        if sim["beam_center"]:
+            cx, cy = (c / binsize for c in sim["beam_center"])
+        else:
+            cy, cx = shape[0] / 2, shape[1] / 2
+
+        frame = self._get_background(shape, (round(cy), round(cx))).copy()
+
+        jitter = self._rng.normal(0, sim["beam_jitter"], size=2)
+        cy += jitter[0]
+        cx += jitter[1]
+
+        positions, phases = self._get_lattice(shape)
+        angle = (time.perf_counter() - self._t_start) * sim["rotation_speed"]
+        excitation = (angle - phases + 180) % 360 - 180
+        intensities = sim["spot_intensity"] * np.exp(-0.5 * (excitation / sim["rocking_width"])**2)
+
+        sel = intensities > 0.01 * sim["spot_intensity"]
+        spots = positions[sel] / binsize + (cx, cy)
+        spots = np.vstack([spots, (cx, cy)])
+        intensities = np.append(intensities[sel], sim["beam_intensity"])
+
+        sigma = sim["spot_sigma"]
+        w = int(np.ceil(3 * sigma))
+        offset = np.arange(-w, w + 1)
+        for (x, y), intensity in zip(spots, intensities):
+            ix, iy = int(round(x)), int(round(y))
+            x0, x1 = max(ix - w, 0), min(ix + w + 1, shape[1])
+            y0, y1 = max(iy - w, 0), min(iy + w + 1, shape[0])
+            if x0 >= x1 or y0 >= y1:
+                continue
+            gx = np.exp(-0.5 * ((offset + ix - x) / sigma)**2)[x0 - ix + w: x1 - ix + w]
+            gy = np.exp(-0.5 * ((offset + iy - y) / sigma)**2)[y0 - iy + w: y1 - iy + w]
+            frame[y0:y1, x0:x1] += intensity * np.outer(gy, gx)
+
+        frame = self._rng.poisson(frame * exposure)
+        return np.clip(frame, 0, self.dynamic_range).astype(np.uint16)
+
     def getImage(self, exposure=None, binsize=None, **kwargs) -> np.ndarray:
         """Image acquisition routine
 
@@ -48,9 +150,17 @@ class CameraSimu(object):
         if not binsize:
             binsize = self.default_binsize
 
-        time.sleep(exposure)
+        t0 = time.perf_counter()
+
+        if self.simulation["frames"] == "diffraction":
+            arr = self._diffraction_frame(exposure, binsize)
+        else:
+            arr = np.random.randint(256, size=self.dimensions)
 
-        arr = np.random.randint(256, size=self.dimensions)
+        # the frame is generated during the exposure, so only sleep for the remainder
+        remaining = exposure + self.simulation["readout"] - (time.perf_counter() - t0)
+        if remaining > 0:
+            time.sleep(remaining)
 
         return arr
 
@@ -116,5 +226,5 @@ class CameraSimu(object):
     def getBinning(self):
         return (1, 1)
 
-    def writeTiffs(self, start_index: int, stop_index: int, path: str, clear_buffer=True) -> None:
+    def writeTiffs(self, start_index: int, stop_index: int, path: str, clear_buffer=True, workers: int=0) -> None:
         pass
\ No newline at end of file
@@ -0,0 +1,259 @@
+import time
+import threading
+import itertools
+import numpy as np
+
+from instamatic.formats import write_tiff
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class _Collection(object):
+    """Mimics a COM collection (1-indexed)"""
+    def __init__(self, items):
+        super().__init__()
+        self._items = list(items)
+
+    def Item(self, i: int):
+        return self._items[i-1]
+
+    @property
+    def Count(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+
+class _Namespace(object):
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.__dict__.update(kwargs)
+
+
+class EMImage(object):
+    """Stand-in for the EMMENU image pointer, stores uint16 data"""
+    _handles = itertools.count(1)
+
+    def __init__(self, app, data: np.ndarray):
+        super().__init__()
+        self._app = app
+        self._data = data
+        self.DataType = 2
+        self.ImgHandle = next(self._handles)
+        self.EMVector = _Namespace(lImgCreationTime=int(time.time()),
+                                   lImgSizeX=data.shape[1], lImgSizeY=data.shape[0],
+                                   lImgBinningX=1, lImgBinningY=1, fImgExposureTime=0.5,
+                                   fTemMagnification=300.0, fGonioTiltA=0.0, szImgName="simulated")
+
+    def GetDataUShort(self):
+        """Returns a numpy array if numpy support is enabled (`comtypes.npsupport`), otherwise tuple of tuples"""
+        self._app._latency(self._app.transfer_latency)
+        if self._app.npsupport:
+            return self._data.copy()
+        return tuple(map(tuple, self._data))
+
+
+class ImageManager(object):
+    def __init__(self, app, drc_name: str):
+        super().__init__()
+        self._app = app
+        self.TopDirectory = 1
+        self._directories = {1: "Top", 2: drc_name}
+        self._images = {drc: {} for drc in self._directories}
+
+    def DirectoryName(self, drc_index: int) -> str:
+        return self._directories[drc_index]
+
+    def FullDirectoryName(self, drc_index: int) -> str:
+        return "/".join(self._directories[i] for i in range(1, drc_index+1))
+
+    def DirectoryExist(self, top_index: int, drc_name: str) -> bool:
+        return drc_name in self._directories.values()
+
+    def DirectoryHandleFromName(self, drc_name: str) -> int:
+        for drc_index, name in self._directories.items():
+            if name == drc_name:
+                return drc_index
+
+    def SubDirectory(self, drc_index: int) -> int:
+        return drc_index + 1 if drc_index + 1 in self._directories else 0
+
+    def NextDirectory(self, drc_index: int) -> int:
+        return 0
+
+    def Image(self, drc_index: int, img_index: int) -> EMImage:
+        self._app._latency()
+        try:
+            return self._images[drc_index][img_index]
+        except KeyError:
+            raise IndexError(f"No image at index {img_index} in directory {drc_index}")
+
+    def ImageEmpty(self, drc_index: int, img_index: int) -> bool:
+        self._app._latency()
+        return img_index not in self._images[drc_index]
+
+    def _add(self, drc_index: int, img_index: int, img: EMImage):
+        self._images[drc_index][img_index] = img
+
+    def _remove(self, img: EMImage):
+        for images in self._images.values():
+            for img_index, other in list(images.items()):
+                if other is img:
+                    del images[img_index]
+
+
+class EMImages(object):
+    def __init__(self, app):
+        super().__init__()
+        self._app = app
+
+    def __iter__(self):
+        images = self._app.ImageManager._images
+        return iter([img for drc in images.values() for img in drc.values()])
+
+    def DeleteImage(self, img: EMImage):
+        self._app._latency()
+        self._app.ImageManager._remove(img)
+
+
+class EMFile(object):
+    def __init__(self, app):
+        super().__init__()
+        self._app = app
+
+    def WriteTiff(self, img: EMImage, filename: str):
+        self._app._latency(self._app.write_latency)
+        write_tiff(filename, img._data)
+
+
+class Viewport(object):
+    def __init__(self, app):
+        super().__init__()
+        self._app = app
+        self.FlapState = 0
+        self.DirectoryHandle = 1
+        self.Configuration = "Simulated"
+        self.IndexInDirectory = 0
+        self.ExposureTime = 100  # ms
+        self.AutoIncrement = 1
+        self._caption = "Image"
+        self._recorder = None
+        self._stop = threading.Event()
+
+    def SetCaption(self, caption: str):
+        self._caption = caption
+
+    def _acquire(self):
+        app = self._app
+        data = np.random.randint(0, 256, size=(app.size, app.size)).astype(np.uint16)
+        app.ImageManager._add(self.DirectoryHandle, self.IndexInDirectory, EMImage(app, data))
+        if self.AutoIncrement:
+            self.IndexInDirectory += 1
+
+    def AcquireAndDisplayImage(self):
+        time.sleep(self.ExposureTime / 1000)
+        self._acquire()
+
+    def _record(self):
+        while not self._stop.is_set():
+            time.sleep(self.ExposureTime / 1000)
+            self._acquire()
+
+    def StartRecorder(self):
+        self._stop.clear()
+        self._recorder = threading.Thread(target=self._record, daemon=True)
+        self._recorder.start()
+
+    def StopRecorder(self):
+        self._stop.set()
+        if self._recorder:
+            self._recorder.join()
+            self._recorder = None
+
+    def StartContinuous(self):
+        pass
+
+    def StopContinuous(self):
+        self.StopRecorder()
+
+
+class EMMENUApplication(object):
+    """Stand-in for the EMMENU COM server (`EMMENU4.EMMENUApplication.1`), so that
+    `CameraEMMENU` can be used and tested without EMMENU/Windows:
+
+        from instamatic.camera.camera_emmenu import CameraEMMENU
+        cam = CameraEMMENU(interface="simulate", app=EMMENUApplication())
+
+    latency: s, time taken by every call that goes through COM
+    transfer_latency: s, additional time to transfer the data of a single image to Python
+    write_latency: s, additional time for EMMENU to write a single image to disk (`EMFile.WriteTiff`)
+    size: dimensions of the (square) images
+    npsupport: return image data as numpy arrays (as with `comtypes.npsupport.enable()`, which is not used by `CameraEMMENU`)
+    """
+    def __init__(self, drc_name: str="Instamatic data", latency: float=0.0, transfer_latency: float=0.0,
+                 write_latency: float=0.0, size: int=512, npsupport: bool=False):
+        super().__init__()
+        self.latency = latency
+        self.transfer_latency = transfer_latency
+        self.write_latency = write_latency
+        self.size = size
+        self.npsupport = npsupport
+
+        self.EMMENUVersion = "simulated"
+
+        camera = _Namespace(name="EMMENU simulated camera", RealSizeX=size, RealSizeY=size,
+                            MaximumSizeX=size, MaximumSizeY=size, PixelSizeX=15500, PixelSizeY=15500)
+        configuration = _Namespace(Name="Simulated", BinningX=1, BinningY=1, CameraType="simulated")
+
+        self.TEMCameras = _Collection([camera])
+        self.Viewports = _Collection([Viewport(self)])
+        self.CameraConfigurations = _Collection([configuration])
+        self.ImageManager = ImageManager(self, drc_name)
+        self.EMFile = EMFile(self)
+        self.EMImages = EMImages(self)
+
+        self._options = set()
+
+    def _latency(self, extra: float=0.0):
+        delay = self.latency + extra
+        if delay:
+            time.sleep(delay)
+
+    def Option(self, option: str):
+        self._options.add(option)
+
+    def EnableMainframe(self, toggle: int):
+        pass
+
+
+def benchmark(n: int=200, latency: float=0.002, transfer_latency: float=0.003, write_latency: float=0.015, workers=(0, 4), npsupport: bool=False):
+    """Time `CameraEMMENU.writeTiffs` against the stand-in for the one-by-one EMMENU path (workers=0)
+    and the bulk path with a writer pool. The default latencies are rough guesses for
+    a 2k x 2k camera, adjust them to match the measurements on the microscope PC.
+    `npsupport` simulates the transfer of the image data as numpy arrays instead of tuples."""
+    import tempfile
+    from pathlib import Path
+    from instamatic.camera.camera_emmenu import CameraEMMENU
+
+    for nworkers in workers:
+        app = EMMENUApplication(latency=latency, transfer_latency=transfer_latency, write_latency=write_latency, npsupport=npsupport)
+        cam = CameraEMMENU(interface="simulate", app=app)
+
+        vp = app.Viewports.Item(1)
+        vp.DirectoryHandle = cam.drc_index
+        for i in range(n):
+            vp._acquire()
+
+        with tempfile.TemporaryDirectory() as drc:
+            t0 = time.perf_counter()
+            cam.writeTiffs(0, n, path=drc, workers=nworkers)
+            t1 = time.perf_counter()
+            nfiles = len(list(Path(drc).glob("*.tiff")))
+
+        print(f"workers={nworkers}: {nfiles} files in {t1-t0:.2f} s ({(t1-t0)/n*1000:.1f} ms/frame)")
+
+
+if __name__ == '__main__':
+    benchmark()
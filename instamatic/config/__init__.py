@@ -1,5 +1,8 @@
 import os, sys
 import yaml
+import pickle
+import threading
+import numpy as np
 from pathlib import Path
 import shutil
 import datetime
@@ -48,6 +51,120 @@ def get_base_drc():
         initialize_in_appData()
 
 
+# The C loader (libyaml) is much faster, but is not available in every PyYAML installation
+YAMLLoader = getattr(yaml, "CLoader", yaml.Loader)
+
+# Parsed config files are cached in memory and on disk (pickled), keyed by the path,
+# modification time and size of the file, so that the yaml files are only parsed when they change
+_cache = {}  # path -> (mtime_ns, size, pickled dict)
+_cache_lock = threading.Lock()
+_cache_changed = False
+
+
+def _cache_file() -> Path:
+    return base_drc / "cache" / "config.pickle"
+
+
+def _load_cache():
+    """Read the on-disk cache of parsed config files into memory"""
+    try:
+        with open(_cache_file(), "rb") as f:
+            _cache.update(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError) as e:
+        logger.debug("Cannot read config cache: %s", e)
+
+
+def _save_cache():
+    """Write the parsed config files to the on-disk cache (only if something changed)"""
+    global _cache_changed
+    if not _cache_changed:
+        return
+    fn = _cache_file()
+    try:
+        fn.parent.mkdir(exist_ok=True, parents=True)
+        tmp = fn.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, fn)
+        _cache_changed = False
+    except OSError as e:
+        logger.debug("Cannot write config cache: %s", e)
+
+
+def read_yaml(path) -> dict:
+    """Parse yaml file `path`, the result is cached until the file changes.
+    Every call returns a new copy, so it is safe to modify the result."""
+    global _cache_changed
+    path = Path(path)
+    stat = path.stat()
+    key = str(path.resolve())
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return pickle.loads(entry[2])
+
+    with open(path, "r") as f:
+        d = yaml.load(f, Loader=YAMLLoader)
+
+    with _cache_lock:
+        _cache[key] = (stat.st_mtime_ns, stat.st_size, pickle.dumps(d, protocol=pickle.HIGHEST_PROTOCOL))
+        _cache_changed = True
+    return d
+
+
+def clear_cache():
+    """Remove all parsed config files from the cache"""
+    global _cache_changed
+    with _cache_lock:
+        _cache.clear()
+        _cache_changed = False
+    try:
+        _cache_file().unlink()
+    except OSError:
+        pass
+
+
+class CalibrationTable(dict):
+    """Calibration table (e.g. pixelsize per camera length), behaves as a normal dict,
+    the keys and values are also stored as sorted arrays to look up the nearest entry."""
+    def __init__(self, d: dict):
+        super().__init__(d)
+        keys = sorted(self)
+        self.keys_array = np.array(keys)
+        try:
+            self.values_array = np.array([self[key] for key in keys])
+        except ValueError:  # values of unequal length
+            self.values_array = None
+
+    def nearest_key(self, key):
+        """Return the calibrated key nearest to `key`"""
+        keys = self.keys_array
+        if not len(keys) or not isinstance(key, (int, float, np.number)):
+            raise KeyError(key)
+        i = np.searchsorted(keys, key)
+        if i == len(keys) or (i > 0 and key - keys[i-1] <= keys[i] - key):
+            i -= 1
+        return keys[i].item()
+
+    def nearest(self, key):
+        """Return the value for `key`, or for the nearest calibrated key if `key` is not calibrated"""
+        try:
+            return self[key]
+        except KeyError:
+            nearest = self.nearest_key(key)
+            logger.warning("No calibration for %s, using the nearest value (%s)", key, nearest)
+            return self[nearest]
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), ))
+
+
+def _is_table(value) -> bool:
+    return (isinstance(value, dict) and len(value) > 0
+            and all(isinstance(key, (int, float)) and not isinstance(key, bool) for key in value))
+
+
 class ConfigObject(object):
     """Namespace for configuration (maps dict items to attributes"""
     def __init__(self, d):
@@ -63,7 +180,7 @@ class ConfigObject(object):
     @classmethod
     def from_file(cls, path):
         """Read configuration from yaml file, returns namespace"""
-        return cls(yaml.load(open(path, "r"), Loader=yaml.Loader))
+        return cls(read_yaml(path))
 
 
 def load(microscope_name=None, calibration_name=None, camera_name=None):
@@ -91,6 +208,13 @@ def load(microscope_name=None, calibration_name=None, camera_name=None):
     calibration_cfg = ConfigObject.from_file(base_drc / "config" / "calibration" / f"{calibration_name}.yaml")
     camera_cfg = ConfigObject.from_file(base_drc / "config" / "camera" / f"{camera_name}.yaml")
 
+    _save_cache()
+
+    # calibration tables with numeric keys (e.g. `pixelsize_diff`) support nearest lookups
+    for key, value in calibration_cfg.d.items():
+        if _is_table(value):
+            setattr(calibration_cfg, key, CalibrationTable(value))
+
     # assign in two steps to ensure an exception is raised if any of the configs cannot be loaded
     microscope = microscope_cfg
     calibration = calibration_cfg
@@ -123,4 +247,5 @@ microscope = None
 calibration = None
 camera = None
 
+_load_cache()
 load()
@@ -6,6 +6,7 @@ import time
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
 from instamatic import config
 from instamatic.formats import write_tiff
+from instamatic.experiments.stage_recorder import StageRecorder
 from skimage.feature import register_translation
 from instamatic.calibrate import CalibBeamShift, CalibDirectBeam
 from instamatic.calibrate.calibrate_beamshift import calibrate_beamshift
@@ -13,11 +14,15 @@ from instamatic.calibrate.calibrate_imageshift12 import Calibrate_Imageshift, Ca
 from instamatic.calibrate.center_z import center_z_height, center_z_height_HYMethod
 from instamatic.tools import find_defocused_image_center, find_beam_center
 from instamatic.processing.flatfield import apply_flatfield_correction
+from instamatic.processing.frame_store import FrameStore
 from instamatic.neural_network import predict, preprocess
 import pickle
 from pathlib import Path
 from tqdm import tqdm
 from instamatic.calibrate.filenames import CALIB_IS1_DEFOC, CALIB_IS1_FOC, CALIB_IS2_DEFOC, CALIB_IS2_FOC, CALIB_BEAMSHIFT_DP
+from instamatic.calibrate.filenames import CALIB_BEAMSHIFT, CALIB_DIRECTBEAM
+from instamatic.calibrate.registry import registry
+import copy
 from instamatic.processing.find_crystals import find_crystals_timepix
 import traceback
 import socket
@@ -69,8 +74,7 @@ def load_IS_Calibrations(imageshift, ctrl, diff_defocus, logger, mode):
         return 0
     
     try:
-        with open(file,'rb') as f:
-            transform_imgshift, c = pickle.load(f)
+        transform_imgshift, c = registry.get(file)
     except:
         print("No {}, defocus = {} calibration found. Choose the desired defocus value.".format(imageshift, diff_defocus))
         inp = input("Press ENTER when ready.")
@@ -250,7 +254,7 @@ class Experiment(object):
         
     def center_particle_ofinterest(self, pos_arr, transform_stagepos):
         """Used to center the particle of interest in the view to minimize usage of lens"""
-        transform_stagepos_ = np.linalg.inv(transform_stagepos)
+        transform_stagepos_ = registry.inv(transform_stagepos)
         if pos_arr[0] < 200 or pos_arr[0] > 316 or pos_arr[1] < 200 or pos_arr[1] > 316:
 
             #print(pos_arr)
@@ -435,19 +439,19 @@ class Experiment(object):
         self.logger.info("Data collection spot size: {}".format(spotsize))
         # TODO: Mostly above is setup, split off into own function
 
-        buffer = []
-        image_buffer = []
+        buffer = FrameStore()
+        image_buffer = FrameStore()
             
         if self.mode > 0:
 
             print("Auto tracking feature activated. Please remember to bring sample to proper Z height in order for autotracking to be effective.")
             
-            transform_imgshift_ = np.linalg.inv(transform_imgshift)
-            transform_imgshift2_ = np.linalg.inv(transform_imgshift2)
-            transform_imgshift_foc_ = np.linalg.inv(transform_imgshift_foc)
-            transform_imgshift2_foc_ = np.linalg.inv(transform_imgshift2_foc)
+            transform_imgshift_ = registry.inv(transform_imgshift)
+            transform_imgshift2_ = registry.inv(transform_imgshift2)
+            transform_imgshift_foc_ = registry.inv(transform_imgshift_foc)
+            transform_imgshift2_foc_ = registry.inv(transform_imgshift2_foc)
             
-            transform_beamshift_d_ = np.linalg.inv(transform_beamshift_d)
+            transform_beamshift_d_ = registry.inv(transform_beamshift_d)
         
             self.logger.debug("Transform_imgshift: {}".format(transform_imgshift))
             self.logger.debug("Transform_imgshift_foc: {}".format(transform_imgshift_foc))
@@ -534,6 +538,11 @@ class Experiment(object):
 
         t0 = time.perf_counter()
         self.startangle = a
+
+        if config.cfg.cred_track_stage_positions:
+            recorder = StageRecorder(self.ctrl, interval=getattr(config.cfg, "cred_stage_interval", 0.05)).start()
+        else:
+            recorder = None
         
         self.stopEvent.clear()
 
@@ -667,7 +676,7 @@ class Experiment(object):
                 else:
                     t_start = time.perf_counter()
                     img, h = self.ctrl.getImage(self.expt, header_keys=None)
-                    if buffer == []:
+                    if len(buffer) == 0:
                         imgscale0 = np.sum(img)
                     else:
                         imgscale = np.sum(img)
@@ -697,6 +706,9 @@ class Experiment(object):
 
         t1 = time.perf_counter()
 
+        if recorder:
+            recorder.stop()
+
         self.ctrl.cam.unblock()
         if self.mode > 1:
             self.ctrl.stageposition.stop()
@@ -717,7 +729,12 @@ class Experiment(object):
         self.ctrl.imageshift1.set(x = is1_init[0], y = is1_init[1])
         self.ctrl.imageshift2.set(x = is2_init[0], y = is2_init[1])
 
-        #stage_positions = tracer.stop()
+        if recorder:
+            # stage angle interpolated at the middle of each frame
+            for i_frame, img, h in buffer:
+                h["StageAngle"] = float(recorder.angles_at((h["ImageGetTimeStart"] + h["ImageGetTimeEnd"]) / 2))
+            recorder.write(os.path.join(path, "stage_angles.txt"))
+
         stageposx, stageposy, stageposz, stageposa, stageposb = self.ctrl.stageposition.get()
         rotrange = abs(self.endangle-self.startangle)
         
@@ -735,7 +752,7 @@ class Experiment(object):
 
         rotation_angle = config.camera.camera_rotation_vs_stage_xy
 
-        self.pixelsize = config.calibration.pixelsize_diff[camera_length] # px / Angstrom
+        self.pixelsize = config.calibration.pixelsize_diff.nearest(camera_length) # px / Angstrom
         self.physical_pixelsize = config.camera.physical_pixelsize # mm
         self.wavelength = config.microscope.wavelength # angstrom
         self.stretch_azimuth = config.camera.stretch_azimuth
@@ -803,6 +820,9 @@ class Experiment(object):
                 i, img, h = image_buffer.pop(0)
                 fn = os.path.join(drc, "{:05d}.tiff".format(i))
                 write_tiff(fn, img, header=h)
+
+        buffer.close()
+        image_buffer.close()
         
         self.ctrl.beamblank = False
 
@@ -918,14 +938,15 @@ class Experiment(object):
             if not os.path.exists(path):
                 os.makedirs(path)
         
+        # calibrations are only parsed once per session (or when the files change), see `registry`
         try:
-            with open("beam_brightness.pkl",'rb') as f:
-                [img_brightness, bs, dp_focus, is1status, is2status, plastatus] = pickle.load(f)
+            [img_brightness, bs, dp_focus, is1status, is2status, plastatus] = registry.get("beam_brightness.pkl")
         except IOError:
             [img_brightness, bs, dp_focus, is1status, is2status, plastatus] = self.write_BrightnessStates()
         
         try:
-            self.calib_beamshift = CalibBeamShift.from_file()
+            # copy, because the reference pixel is updated for every point
+            self.calib_beamshift = copy.copy(registry.get(CALIB_BEAMSHIFT, loader=CalibBeamShift.from_file))
             self.ctrl.beamshift.set(x = self.calib_beamshift.reference_shift[0], y = self.calib_beamshift.reference_shift[1])
 
         except IOError:
@@ -947,9 +968,8 @@ class Experiment(object):
         self.logger.debug("Transform_beamshift: {}".format(self.calib_beamshift.transform))
         
         try:
-            self.calib_directbeam = CalibDirectBeam.from_file()
-            with open('diff_par.pkl','rb') as f:
-                self.diff_brightness, self.diff_difffocus = pickle.load(f)
+            self.calib_directbeam = registry.get(CALIB_DIRECTBEAM, loader=CalibDirectBeam.from_file)
+            self.diff_brightness, self.diff_difffocus = registry.get("diff_par.pkl")
         except IOError:
             if not self.ctrl.mode == 'diff':
                 self.ctrl.mode = 'samag'
@@ -4,10 +4,13 @@ from tkinter import *
 import numpy as np
 import time
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
+from instamatic.processing.frame_store import FrameStore
 from instamatic import config
 from instamatic.formats import write_tiff
 from pathlib import Path
 from instamatic import version
+from instamatic.experiments.stage_recorder import StageRecorder
+from instamatic.experiments.frame_scheduler import FrameScheduler
 
 # degrees to rotate before activating data collection procedure
 ACTIVATION_THRESHOLD = 0.2
@@ -47,6 +50,11 @@ class Experiment(object):
         Specify which data types/input files should be written
     stop_event:
         Instance of `threading.Event()` that signals the experiment to be terminated.
+    writer:
+        Function `writer(func, *args)` to run the data conversion elsewhere (e.g. in the processing
+        lane of the GUI job scheduler), so that the microscope is free for the next experiment.
+        Its return value is stored as `self.write_job`. By default, the data are written before
+        `start_collection` returns.
     """
     def __init__(self, ctrl, 
         path: str=None, 
@@ -65,6 +73,7 @@ class Experiment(object):
         write_dials: bool=True,
         write_red: bool=True,
         stop_event=None,
+        writer=None,
         ):
         super(Experiment,self).__init__()
         self.ctrl = ctrl
@@ -77,6 +86,8 @@ class Experiment(object):
             self.mode = "simulate"
         self.stopEvent = stop_event
         self.flatfield = flatfield
+        self.writer = writer
+        self.write_job = None
 
         self.footfree_rotate_to = footfree_rotate_to
 
@@ -99,7 +110,8 @@ class Experiment(object):
         self.relax_beam_before_experiment = self.image_interval_enabled and config.cfg.cred_relax_beam_before_experiment
 
         self.track_stage_position = config.cfg.cred_track_stage_positions
-        self.stage_positions = []
+        self.stage_positions = []  # list of (frame number, (x, y, z, a, b))
+        self.stage_trajectory = []  # list of (time, (x, y, z, a, b)) from the stage recorder
 
     def log_start_status(self):
         """Log the starting parameters"""
@@ -122,6 +134,8 @@ class Experiment(object):
         self.logger.info(f"Data collection spot size: {self.spotsize}")
 
         self.logger.info(self.stage_positions)
+        if self.stage_trajectory:
+            self.logger.info(f"Stage trajectory: {len(self.stage_trajectory)} positions recorded, see `stage_angles.txt`")
 
         with open(self.path / "cRED_log.txt", "w") as f:
             print(f"Program: {version.__long_title__}", file=f)
@@ -224,8 +238,8 @@ class Experiment(object):
         self.setup_paths()
         self.log_start_status()
         
-        buffer = []
-        image_buffer = []
+        buffer = FrameStore()
+        image_buffer = FrameStore()
 
         if self.ctrl.mode != 'diff':
             self.ctrl.mode = 'diff'
@@ -240,44 +254,32 @@ class Experiment(object):
         self.start_angle = self.start_rotation()
         self.ctrl.cam.block()
 
-        i = 1
-
-        t0 = time.perf_counter()
-
-        while not self.stopEvent.is_set():
-            if i % self.image_interval == 0:
-                t_start = time.perf_counter()
-                acquisition_time = (t_start - t0) / (i-1)
-
-                self.ctrl.difffocus.set(self.diff_focus_defocused, confirm_mode=False)
-                img, h = self.ctrl.getImage(exposure_image, header_keys=None)
-                self.ctrl.difffocus.set(self.diff_focus_proper, confirm_mode=False)
-
-                image_buffer.append((i, img, h))
-
-                next_interval = t_start + acquisition_time
-                # print i, "BLOOP! {:.3f} {:.3f} {:.3f}".format(next_interval-t_start, acquisition_time, t_start-t0)
-
-                while time.perf_counter() > next_interval:
-                    next_interval += acquisition_time
-                    i += 1
-                    # print i, "SKIP!  {:.3f} {:.3f}".format(next_interval-t_start, acquisition_time)
-
-                diff = next_interval - time.perf_counter() # seconds
-
-                if self.track_stage_position and diff > 0.1:
-                    self.stage_positions.append((i, self.ctrl.stageposition.get()))
-
-                time.sleep(diff)
+        if self.track_stage_position:
+            self.recorder = StageRecorder(self.ctrl, interval=getattr(config.cfg, "cred_stage_interval", 0.05)).start()
+        else:
+            self.recorder = None
 
-            else:
-                img, h = self.ctrl.getImage(self.exposure, header_keys=None)
-                # print i, "Image!"
-                buffer.append((i, img, h))
+        scheduler = FrameScheduler(image_interval=self.image_interval)
+        self.scheduler = scheduler
 
-            i += 1
+        t0 = scheduler.start()
 
-        t1 = time.perf_counter()
+        while not self.stopEvent.is_set():
+            with scheduler.frame() as (i, kind):
+                if kind == "image":
+                    self.ctrl.difffocus.set(self.diff_focus_defocused, confirm_mode=False)
+                    img, h = self.ctrl.getImage(exposure_image, header_keys=None)
+                    self.ctrl.difffocus.set(self.diff_focus_proper, confirm_mode=False)
+                    image_buffer.append((i, img, h))
+                else:
+                    img, h = self.ctrl.getImage(self.exposure, header_keys=None)
+                    buffer.append((i, img, h))
+
+        t1 = scheduler.stop()
+
+        if self.recorder:
+            self.recorder.stop()
+            self.stage_trajectory = list(self.recorder.positions)
 
         if self.mode == "footfree":
             self.ctrl.stageposition.stop()
@@ -306,12 +308,12 @@ class Experiment(object):
             self.ctrl.beamblank = True
 
         # in case something went wrong starting data collection, return gracefully
-        if i == 1:
+        if scheduler.nframes == 0:
             print_and_log(f"Data collection interrupted", logger=self.logger)
             return False
 
         self.spotsize = self.ctrl.spotsize
-        self.nframes = i-1 # len(buffer) can lie in case of frame skipping
+        self.nframes = scheduler.nframes # len(buffer) can lie in case of frame skipping
         self.osc_angle = abs(self.end_angle - self.start_angle) / self.nframes
         self.t_start = t0
         self.t_end = t1
@@ -320,7 +322,7 @@ class Experiment(object):
         self.total_angle = abs(self.end_angle - self.start_angle)
         self.rotation_axis = config.camera.camera_rotation_vs_stage_xy
 
-        self.pixelsize = config.calibration.pixelsize_diff[self.camera_length] # px / Angstrom
+        self.pixelsize = config.calibration.pixelsize_diff.nearest(self.camera_length) # px / Angstrom
         self.physical_pixelsize = config.camera.physical_pixelsize # mm
         self.wavelength = config.microscope.wavelength # angstrom
         self.stretch_azimuth = config.camera.stretch_azimuth # deg
@@ -331,15 +333,55 @@ class Experiment(object):
 
         self.log_end_status()
 
+        if self.recorder:
+            self.log_stage_angles(buffer)
+
+        self.log_frame_timings(scheduler)
+
         if self.nframes <= 3:
             print_and_log(f"Not enough frames collected. Data will not be written (nframes={self.nframes})", logger=self.logger)
             return False
 
+        if self.writer:
+            print("Data Collection Done, writing data in the background.")
+            self.write_job = self.writer(self.write_all, buffer, image_buffer)
+        else:
+            self.write_all(buffer, image_buffer)
+            print("Data Collection and Conversion Done.")
+        return True
+
+    def write_all(self, buffer: list, image_buffer: list):
+        """Write the diffraction and image data, and the input files for the processing programs"""
         self.write_data(buffer)
         self.write_image_data(image_buffer)
-
-        print("Data Collection and Conversion Done.")
-        return True
+        buffer.close()
+        image_buffer.close()
+        print_and_log(f"Data written to {self.path}", logger=self.logger)
+
+    def log_stage_angles(self, buffer: list):
+        """Store the stage angle interpolated at the middle of each frame in the headers,
+        and write the recorded stage trajectory to `stage_angles.txt`"""
+        times = [(h["ImageGetTimeStart"] + h["ImageGetTimeEnd"]) / 2 for i, img, h in buffer]
+        if times:
+            angles = self.recorder.angles_at(times)
+            for (i, img, h), a in zip(buffer, angles):
+                h["StageAngle"] = float(a)
+
+        self.recorder.write(self.path / "stage_angles.txt")
+
+    def log_frame_timings(self, scheduler):
+        """Log the frame pacing and the uniformity of the oscillation angle,
+        and write the per-frame timings to `frame_timings.txt`"""
+        report = scheduler.report(total_angle=self.total_angle, recorder=self.recorder)
+        self.logger.info(f"Frame timing: {report}")
+        print_and_log(f"Frames: {report['nframes_diff']} diffraction, {report['nframes_image']} image, "
+                      f"{report['skipped']} skipped, {report['late']} late", logger=self.logger)
+        if "osc_angle_std" in report:
+            print_and_log(f"Oscillation angle: {report['osc_angle_mean']:.4f} +- {report['osc_angle_std']:.4f} degrees "
+                          f"(min: {report['osc_angle_min']:.4f}, max: {report['osc_angle_max']:.4f}, "
+                          f"uniformity: {report['osc_angle_uniformity']:.1%})", logger=self.logger)
+
+        scheduler.write(self.path / "frame_timings.txt")
 
     def write_data(self, buffer: list):
         """Write diffraction data in the buffer.
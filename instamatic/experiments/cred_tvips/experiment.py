@@ -5,6 +5,7 @@ from pathlib import Path
 from instamatic.tools import get_acquisition_time
 import time
 from instamatic.formats import write_tiff
+from instamatic.experiments.stage_recorder import StageRecorder
 
 
 class SerialExperiment(object):
@@ -174,7 +175,7 @@ class Experiment(object):
         self.now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         self.stage_positions = []
-        interval = 1.0
+        interval = 1.0  # s, between tracking steps
 
         if self.track:
             start_angle, target_angle = self.prepare_tracking()
@@ -204,25 +205,25 @@ class Experiment(object):
         start_index = 1
         # start_index = self.emmenu.get_next_empty_image_index()
 
+        self.recorder = StageRecorder(self.ctrl, interval=getattr(config.cfg, "cred_stage_interval", 0.05), full_interval=interval)
+
         self.ctrl.stageposition.set(a=target_angle, wait=False)
         self.emmenu.start_record()  # start recording
+        self.recorder.start()
 
         t0 = time.perf_counter()
-        t_delta = t0       
 
         n = 0
-        
-        while self.ctrl.stageposition.is_moving():
-            t = time.perf_counter()
-            if t - t_delta > interval:
-                n += 1
-                x, y, z, a, _ = pos = self.ctrl.stageposition.get()
-                self.stage_positions.append((t, pos))
-                t_delta = t
-                # print(t, pos)
-
-                if self.track:
-                    self.track_crystal(n=n, angle=a)
+
+        # the recorder samples the stage in the background, this thread only wakes up for tracking
+        while not self.recorder.wait_until_stopped(timeout=interval):
+            n += 1
+            if self.track:
+                t, a = self.recorder.latest
+                self.track_crystal(n=n, angle=a)
+
+        self.recorder.stop()
+        self.stage_positions = self.recorder.positions
 
         t1 = time.perf_counter()
 
@@ -251,6 +252,8 @@ class Experiment(object):
         timestamps = self.emmenu.get_timestamps(start_index, end_index)
         acq_out = self.path / "acquisition_time.png"
         self.timings = get_acquisition_time(timestamps, exp_time=self.exposure_time, savefig=True, fn=acq_out)
+
+        self.frame_angles = self.recorder.angles_at_frames(timestamps)
        
         self.log_end_status()
         self.log_stage_positions()
@@ -259,7 +262,7 @@ class Experiment(object):
         path_data = self.path / "tiff"
         path_data.mkdir(exist_ok=True, parents=True)
 
-        self.emmenu.writeTiffs(start_index, end_index, path=path_data)
+        self.emmenu.writeTiffs(start_index, end_index, path=path_data, workers=getattr(config.cfg, "emmenu_write_workers", 0))
 
         if self.track:
             ### Center crystal position
@@ -283,7 +286,7 @@ class Experiment(object):
         wavelength = config.microscope.wavelength
 
         try:
-            pixelsize = config.calibration.pixelsize_diff[self.camera_length] # px / Angstrom
+            pixelsize = config.calibration.pixelsize_diff.nearest(self.camera_length) # px / Angstrom
         except KeyError:
             print(f"Warning: No such camera length: {self.camera_length} in diff calibration, defaulting to 1.0")
             pixelsize = 1.0
@@ -355,6 +358,15 @@ class Experiment(object):
 
         print(f"Wrote file {f.name}")
 
+        self.recorder.write(self.path / "stage_angles.txt")
+
+        with open(self.path / "frame_angles.txt", "w") as f:
+            print("# frame angle", file=f)
+            for i, a in enumerate(self.frame_angles):
+                print(f"{i:4d} {a:8.3f}", file=f)
+
+        print(f"Wrote file {f.name}")
+
 if __name__ == '__main__':
     expdir = controller.module_io.get_new_experiment_directory()
     expdir.mkdir(exist_ok=True, parents=True)
@@ -0,0 +1,184 @@
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+
+from instamatic.utils.high_precision_timers import enable as enable_high_precision_timers, sleep_until
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+FrameTiming = namedtuple("FrameTiming", "index kind deadline start end skipped")
+
+
+class FrameScheduler(object):
+    """Paces the frames of a continuous rotation experiment using absolute deadlines.
+
+    The frames are numbered so that the frame number is proportional to the rotation angle:
+    every frame occupies a slot of `period` seconds. Diffraction frames are taken back-to-back
+    (the camera exposure sets the pace). Every `image_interval`th frame is an image frame
+    (e.g. a defocused image for crystal tracking), which takes the place of one diffraction frame.
+    If it takes longer than one slot, the slots that have passed are skipped, and the scheduler
+    sleeps until the start of the next slot, so that the numbering stays in step with the rotation.
+
+    image_interval:
+        Every `image_interval`th frame is an image frame, None to disable
+    period:
+        Duration of one slot in seconds. By default, it is measured from the frames taken so far
+        (`(t - t0) / (n - 1)` at the start of each image frame). If it is given, every frame
+        gets an absolute deadline `t0 + (n - 1) * period`, and frames that are more than half
+        a slot late are skipped.
+    tolerance:
+        Frames that start more than `tolerance` seconds after their deadline are counted as late
+
+    Usage:
+        scheduler = FrameScheduler(image_interval=10)
+        scheduler.start()
+        while not stop_event.is_set():
+            with scheduler.frame() as (i, kind):
+                img, h = ctrl.getImage(...)
+        scheduler.stop()
+        scheduler.write(path / "frame_timings.txt")
+        print(scheduler.report(total_angle))
+    """
+    def __init__(self, image_interval: int=None, period: float=None, tolerance: float=0.005):
+        super().__init__()
+        self.image_interval = image_interval
+        self.period = period
+        self.tolerance = tolerance
+
+        self.log = []
+        self.index = 1
+        self.skipped = 0
+        self.late = 0
+        self.t0 = self.t1 = None
+        self._deadline = None
+
+    def start(self) -> float:
+        """Start the clock, returns the start time (`time.perf_counter`)"""
+        enable_high_precision_timers()
+        self.t0 = self._deadline = time.perf_counter()
+        return self.t0
+
+    def stop(self) -> float:
+        """Stop the clock, returns the end time (`time.perf_counter`)"""
+        self.t1 = time.perf_counter()
+        return self.t1
+
+    @property
+    def nframes(self) -> int:
+        """Number of frame slots used so far, including image frames and skipped slots"""
+        return self.index - 1
+
+    @property
+    def kind(self) -> str:
+        """Kind of the next frame, `image` or `diff`"""
+        if self.image_interval and self.index % self.image_interval == 0:
+            return "image"
+        return "diff"
+
+    def deadline(self, index: int) -> float:
+        """Absolute deadline of slot `index` when the period is fixed"""
+        return self.t0 + (index - 1) * self.period
+
+    @contextmanager
+    def frame(self):
+        """Context manager around the acquisition of the next frame, yields (index, kind)"""
+        i, kind = self.index, self.kind
+        deadline = self._deadline
+        start = time.perf_counter()
+
+        if self.period:
+            period = self.period
+        elif i > 1:
+            period = (start - self.t0) / (i - 1)
+        else:
+            period = 0.0
+
+        yield i, kind
+
+        end = time.perf_counter()
+        self.index += 1
+        skipped = 0
+
+        if self.period:
+            # skip the slots that cannot be started in time anymore
+            threshold = 0.0 if kind == "image" else self.period / 2
+            while end > self.deadline(self.index) + threshold:
+                self.index += 1
+                skipped += 1
+            self._deadline = max(self.deadline(self.index), end)
+        elif kind == "image" and period > 0:
+            # the image frame takes the slot of one diffraction frame
+            next_deadline = start + period
+            while end > next_deadline:
+                next_deadline += period
+                self.index += 1
+                skipped += 1
+            self._deadline = next_deadline
+        else:
+            self._deadline = end
+
+        if start - deadline > self.tolerance:
+            self.late += 1
+        self.skipped += skipped
+        self.log.append(FrameTiming(i, kind, deadline, start, end, skipped))
+
+        if self._deadline > end:
+            sleep_until(self._deadline)
+
+    def frames(self, kind: str=None) -> list:
+        """Return the timings of the frames of `kind` (`diff`/`image`), or all frames"""
+        return [t for t in self.log if kind is None or t.kind == kind]
+
+    def report(self, total_angle: float=None, recorder=None) -> dict:
+        """Summarize the frame timing.
+
+        The oscillation angle of every diffraction frame is the rotation between its start
+        and the start of the next diffraction frame, divided by the number of slots in between.
+        The angles are taken from `recorder` (`StageRecorder`) if given, otherwise a constant
+        rotation speed of `total_angle` over the duration of the experiment is assumed.
+        """
+        t1 = self.t1 or time.perf_counter()
+        total_time = t1 - self.t0
+        nframes = self.nframes
+        diff = self.frames("diff")
+
+        ret = {"nframes": nframes, "nframes_diff": len(diff), "nframes_image": len(self.frames("image")),
+               "skipped": self.skipped, "late": self.late, "total_time": total_time,
+               "period": total_time / nframes if nframes else 0.0}
+
+        if len(diff) < 2:
+            return ret
+
+        index = np.array([t.index for t in diff])
+        start = np.array([t.start for t in diff])
+        exposure = np.array([t.end - t.start for t in diff])
+        ret["exposure_mean"] = float(exposure.mean())
+        ret["exposure_std"] = float(exposure.std())
+
+        if recorder is not None:
+            angles = recorder.angles_at(start)
+        elif total_angle is not None:
+            angles = (start - self.t0) * total_angle / total_time
+        else:
+            return ret
+
+        steps = np.abs(np.diff(angles)) / np.diff(index)
+        ret["osc_angle"] = abs(total_angle) / nframes if total_angle is not None else float(steps.mean())
+        ret["osc_angle_mean"] = float(steps.mean())
+        ret["osc_angle_std"] = float(steps.std())
+        ret["osc_angle_min"] = float(steps.min())
+        ret["osc_angle_max"] = float(steps.max())
+        ret["osc_angle_uniformity"] = float(1 - steps.std() / steps.mean()) if steps.mean() else 0.0
+        return ret
+
+    def write(self, fn):
+        """Write the per-frame timing log to `fn`, the times are in ms relative to the start"""
+        header = "index kind deadline(ms) start(ms) end(ms) late(ms) skipped"
+        with open(fn, "w") as f:
+            print(f"# {header}", file=f)
+            for t in self.log:
+                deadline, start, end = ((x - self.t0) * 1000 for x in (t.deadline, t.start, t.end))
+                print(f"{t.index:6d} {t.kind:5s} {deadline:10.2f} {start:10.2f} {end:10.2f} {start - deadline:8.2f} {t.skipped:3d}", file=f)
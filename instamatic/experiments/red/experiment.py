@@ -5,6 +5,7 @@ from pathlib import Path
 from instamatic import config
 from instamatic.formats import write_tiff
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
+from instamatic.processing.frame_store import FrameStore
 
 
 class Experiment(object):
@@ -39,7 +40,7 @@ class Experiment(object):
 
         self.offset = 1
         self.current_angle = None
-        self.buffer = []
+        self.buffer = FrameStore()
         
     def start_collection(self, exposure_time: float, tilt_range: float, stepsize: float):
         """Start or continue data collection for `tilt_range` degrees with steps given by `stepsize`,
@@ -125,7 +126,7 @@ class Experiment(object):
         self.logger.info(f"Data saving path: {self.path}")
         self.rotation_axis = config.camera.camera_rotation_vs_stage_xy
 
-        self.pixelsize = config.calibration.pixelsize_diff[camera_length] # px / Angstrom
+        self.pixelsize = config.calibration.pixelsize_diff.nearest(self.camera_length) # px / Angstrom
         self.physical_pixelsize = config.camera.physical_pixelsize # mm
         self.wavelength = config.microscope.wavelength # angstrom
         self.stretch_azimuth = config.camera.stretch_azimuth
@@ -145,7 +146,7 @@ class Experiment(object):
             print(f"Stepsize: {self.stepsize:.4f} degrees", file=f)
             print(f"Number of frames: {self.nframes}", file=f)
 
-        img_conv = ImgConversion(buffer=buffer, 
+        img_conv = ImgConversion(buffer=self.buffer, 
                  osc_angle=self.stepsize,
                  start_angle=self.start_angle,
                  end_angle=self.end_angle,
@@ -170,6 +171,9 @@ class Experiment(object):
 
         img_conv.write_beam_centers(self.path)
 
+        del img_conv
+        self.buffer.close()
+
         print("Data Collection and Conversion Done.")
         print()
 
@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 from instamatic.formats import *
 from instamatic.processing.find_crystals import find_crystals, find_crystals_timepix
 from instamatic.processing.flatfield import remove_deadpixels, apply_flatfield_correction
+from instamatic.utils.session_index import SessionIndex, DEFAULT_INDEX
 from instamatic.calibrate import CalibBeamShift, CalibDirectBeam
 from instamatic import config
 from instamatic import neural_network
@@ -151,6 +152,9 @@ class Experiment(object):
         # set flags
         self.ctrl.tem.VERIFY_STAGE_POSITION = False
 
+        # set beamshift and diffshift concurrently through `ctrl.async_` (not validated on all microscopes yet)
+        self.async_shifts = getattr(config.cfg, "serialed_async_shifts", False)
+
     def setup_folders(self, expdir=None, name="experiment"):
         if not expdir:
             n = 1
@@ -232,7 +236,7 @@ class Experiment(object):
             self.diff_difffocus = self.ctrl.difffocus.value
             self.diff_cameralength = self.ctrl.magnification.value
 
-        self.diff_pixelsize  = config.calibration.pixelsize_diff[self.diff_cameralength]
+        self.diff_pixelsize  = config.calibration.pixelsize_diff.nearest(self.diff_cameralength)
         self.change_spotsize = self.diff_spotsize != self.image_spotsize
         self.crystal_spread = kwargs.get("crystal_spread", 0.6)
 
@@ -404,7 +408,11 @@ class Experiment(object):
 
         for k, beamshift in enumerate(t):
             # self.log.debug("Diffraction: crystal %d/%d", k+1, ncrystals)
-            self.ctrl.beamshift.set(*beamshift)
+            # beamshift and diffshift are independent, so they can be set concurrently
+            if self.async_shifts:
+                self.ctrl.async_.beamshift.set(*beamshift)
+            else:
+                self.ctrl.beamshift.set(*beamshift)
         
             # compensate beamshift
             beamshift_offset = beamshift - self.neutral_beamshift
@@ -413,7 +421,11 @@ class Experiment(object):
             diffshift_offset = self.calib_directbeam.pixelshift2diffshift(pixelshift)
             diffshift = self.neutral_diffshift - diffshift_offset
         
-            self.ctrl.diffshift.set(*diffshift.astype(int))
+            if self.async_shifts:
+                self.ctrl.async_.diffshift.set(*diffshift.astype(int))
+                self.ctrl.async_.wait()
+            else:
+                self.ctrl.diffshift.set(*diffshift.astype(int))
 
             t.set_description("BeamShift(x={:5.0f}, y={:5.0f})".format(*beamshift))
             time.sleep(delay)
@@ -463,6 +475,8 @@ class Experiment(object):
 
         input("\nPress <ENTER> to start experiment ('Ctrl-C' to interrupt)\n")
 
+        self.index = SessionIndex(self.expdir / DEFAULT_INDEX)
+
         for i, d_pos in enumerate(self.loop_positions()):
    
             outfile = self.imagedir / f"image_{i:04d}"
@@ -492,6 +506,8 @@ class Experiment(object):
             h["exp_crystal_coords"] = crystal_coords
 
             write_hdf5(outfile, img, header=h)
+            # index the image with its thumbnails for `instamatic.browser`
+            self.index.add(outfile.with_suffix(".h5"), img, header=h)
 
             ncrystals = len(crystal_coords)
             if ncrystals == 0:
@@ -537,6 +553,8 @@ class Experiment(object):
     
             self.image_mode()
 
+        self.index.close()
+
         print("\n\nData collection finished.")
 
 
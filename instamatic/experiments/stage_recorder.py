@@ -0,0 +1,169 @@
+import time
+import threading
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class StageRecorder(object):
+    """Record the stage trajectory in a background thread during a rotation experiment.
+
+    Only the rotation angle is polled at a high rate (`interval`), using `getStageA` on the
+    microscope interface if available. The full stage position (x, y, z, a, b) is read every
+    `full_interval` seconds, and `isStageMoving` every `moving_interval` seconds.
+
+    ctrl:
+        Instance of `TEMController`
+    interval:
+        Time between angle readings in seconds
+    full_interval:
+        Time between full stage position readings in seconds (None to disable)
+    moving_interval:
+        Time between checks whether the stage is still moving in seconds
+
+    Usage:
+        recorder = StageRecorder(ctrl, interval=0.05)
+        recorder.start()
+        ctrl.stageposition.set(a=60, wait=False)
+        recorder.wait_until_stopped()
+        trajectory = recorder.stop()  # (n, 2) array of (time, angle)
+        angles = recorder.angles_at(frame_times)
+    """
+    def __init__(self, ctrl, interval: float=0.05, full_interval: float=1.0, moving_interval: float=0.2):
+        super().__init__()
+        self.ctrl = ctrl
+        self.interval = interval
+        self.full_interval = full_interval
+        self.moving_interval = moving_interval
+
+        tem = ctrl.tem
+        try:
+            self._get_a = tem.getStageA
+        except AttributeError:
+            self._get_a = lambda: tem.getStagePosition()[3]
+
+        self._times = []
+        self._angles = []
+        self.positions = []  # list of (time, (x, y, z, a, b))
+
+        # offset to convert `time.perf_counter` to `time.time` (epoch)
+        self.epoch_offset = time.time() - time.perf_counter()
+
+        self._stop_event = threading.Event()
+        self._stopped_moving = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start recording in a background thread"""
+        self._stop_event.clear()
+        self._stopped_moving.clear()
+        self._thread = threading.Thread(target=self._run, name="stage-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> np.ndarray:
+        """Stop recording and return the trajectory"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        return self.trajectory
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, kind, value, traceback):
+        self.stop()
+
+    def _run(self):
+        t_full = t_moving = 0.0
+        moving = False
+        next_t = time.perf_counter()
+
+        while not self._stop_event.is_set():
+            t = time.perf_counter()
+
+            try:
+                if self.full_interval and t - t_full >= self.full_interval:
+                    pos = tuple(self.ctrl.tem.getStagePosition())
+                    a = pos[3]
+                    self.positions.append((t, pos))
+                    t_full = t
+                else:
+                    a = self._get_a()
+
+                self._times.append((t + time.perf_counter()) / 2)
+                self._angles.append(a)
+
+                if t - t_moving >= self.moving_interval:
+                    is_moving = bool(self.ctrl.tem.isStageMoving())
+                    # only signal the end of the movement after it has been seen moving
+                    if is_moving:
+                        moving = True
+                    elif moving or t - self._times[0] > 1.0:
+                        self._stopped_moving.set()
+                    t_moving = t
+            except Exception as e:
+                logger.exception("Stage recorder failed: %s", e)
+                self._stopped_moving.set()
+                break
+
+            next_t += self.interval
+            delay = next_t - time.perf_counter()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                next_t = time.perf_counter()  # fell behind, do not try to catch up
+
+    def wait_until_stopped(self, timeout: float=None) -> bool:
+        """Block until the stage has stopped moving, returns False on timeout"""
+        return self._stopped_moving.wait(timeout)
+
+    def is_moving(self) -> bool:
+        """Whether the stage was moving at the last check"""
+        return not self._stopped_moving.is_set()
+
+    @property
+    def latest(self) -> (float, float):
+        """Return the last recorded (time, angle)"""
+        if not self._angles:
+            return None, None
+        return self._times[-1], self._angles[-1]
+
+    @property
+    def trajectory(self) -> np.ndarray:
+        """Recorded (time, angle) pairs as an array, time is in `time.perf_counter` seconds"""
+        n = min(len(self._times), len(self._angles))
+        return np.column_stack([self._times[:n], self._angles[:n]]) if n else np.empty((0, 2))
+
+    def angles_at(self, times, epoch: bool=False) -> np.ndarray:
+        """Interpolate the stage angle at `times`.
+
+        times: in `time.perf_counter` seconds, or in `time.time` seconds if `epoch` is set
+               (e.g. timestamps from the camera)"""
+        trajectory = self.trajectory
+        if not len(trajectory):
+            raise ValueError("No stage angles have been recorded")
+        t, a = trajectory.T
+        if epoch:
+            t = t + self.epoch_offset
+        return np.interp(times, t, a)
+
+    def angles_at_frames(self, timestamps) -> np.ndarray:
+        """Interpolate the stage angle for every frame from the camera `timestamps` (`time.time` seconds).
+        The timestamps are replaced by a linear fit first, because camera timestamps are often
+        only accurate to the second, while the frames are acquired at a constant rate."""
+        timestamps = np.asarray(timestamps, dtype=float)
+        x = np.arange(len(timestamps))
+        if len(timestamps) > 1:
+            slope, intercept = np.polyfit(x, timestamps, 1)
+            timestamps = intercept + slope * x
+        return self.angles_at(timestamps, epoch=True)
+
+    def write(self, fn):
+        """Write the trajectory (time, angle) to `fn`, the times are relative to the first reading"""
+        trajectory = self.trajectory
+        if len(trajectory):
+            trajectory[:, 0] -= trajectory[0, 0]
+        np.savetxt(fn, trajectory, fmt="%.4f", header="time(s) angle(deg)")
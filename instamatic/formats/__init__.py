@@ -4,23 +4,26 @@ import yaml
 import numpy as np
 from pathlib import Path
 
-import tifffile
+from instamatic.utils.lazy_import import lazy_import
 
-from .csvIO import read_csv, write_csv, read_ycsv, write_ycsv, yaml_ordered_load, yaml_ordered_dump
-from .adscimage import write_adsc, read_adsc
+# h5py and tifffile are slow to import, and not needed by most command line tools
+tifffile = lazy_import("tifffile")
+h5py = lazy_import("h5py", ignore_warnings=True)  # TODO: remove ignore_warnings later (annoying FutureWarning on import)
 
-import warnings
-with warnings.catch_warnings():
-    # TODO: remove me later
-    # Catch annoying futurewarning on import
-    warnings.simplefilter("ignore")
-    import h5py
+from .csvIO import read_csv, write_csv, read_ycsv, write_ycsv, yaml_ordered_load, yaml_ordered_dump
+from .adscimage import write_adsc, read_adsc, read_adsc_header
 
 from .mrc import read_image as read_mrc
 from .mrc import write_image as write_mrc
+from .mrc import read_header as read_mrc_header
 
 from .xdscbf import write as write_cbf
 
+from .header import dump_header, load_header, YAMLLoader
+
+# serialization of the header in `write_tiff`, `json` or `yaml`
+TIFF_HEADER_FORMAT = "json"
+
 
 def read_image(fname: str) -> (np.array, dict):
     """Guess filetype by extension"""
@@ -38,7 +41,37 @@ def read_image(fname: str) -> (np.array, dict):
     return img, h 
 
 
-def write_tiff(fname: str, data, header: dict=None):
+def read_header(fname: str) -> dict:
+    """Read only the header of an image, guess filetype by extension.
+    The image data are not read, so this is much faster than `read_image`"""
+    ext = Path(fname).suffix.lower()
+    if ext in (".tif", ".tiff"):
+        h = read_tiff_header(fname)
+    elif ext in (".h5", ".hdf5"):
+        h = read_hdf5_header(fname)
+    elif ext in (".img", ".smv"):
+        h = read_adsc_header(fname)
+    elif ext == ".mrc":
+        h = read_mrc_header(str(fname))
+    else:
+        raise IOError(f"Cannot open file {fname}, unknown extension: {ext}")
+    return h
+
+
+def read_headers(fnames: list, workers: int=8) -> list:
+    """Read the headers of all files in `fnames` using a pool of `workers` threads.
+    Reading headers is mostly waiting for the disk (or network share), so threads help
+    even though the parsing itself holds the GIL."""
+    fnames = list(fnames)
+    if workers <= 1 or len(fnames) < 2:
+        return [read_header(fname) for fname in fnames]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_header, fnames))
+
+
+def write_tiff(fname: str, data, header: dict=None, header_format: str=None):
     """Simple function to write a tiff file
 
     fname: str,
@@ -47,10 +80,13 @@ def write_tiff(fname: str, data, header: dict=None):
         numpy array containing image data
     header: dict,
         dictionary containing the metadata that should be saved
-        key/value pairs are stored as yaml in the TIFF ImageDescription tag
+        key/value pairs are stored in the TIFF ImageDescription tag
+    header_format: str,
+        serialization of the header, `json` or `yaml` (default: `TIFF_HEADER_FORMAT`)
+        both are detected automatically by `read_tiff`
     """
     if isinstance(header, dict):
-        header = yaml.dump(header)
+        header = dump_header(header, fmt=header_format or TIFF_HEADER_FORMAT)
     if not header:
         header = ""
 
@@ -74,15 +110,26 @@ def read_tiff(fname: str) -> (np.array, dict):
 
     page = tiff.pages[0]
     img = page.asarray()
+    header = _tiff_header(tiff)
+
+    return img, header
 
+
+def _tiff_header(tiff) -> dict:
+    page = tiff.pages[0]
     if page.software == 'instamatic':
-        header = yaml.load(page.tags["ImageDescription"].value, Loader=yaml.Loader)
+        header = load_header(page.tags["ImageDescription"].value)
     elif tiff.is_tvips:
         header = tiff.tvips_metadata
     else:
         header = {}
+    return header
 
-    return img, header
+
+def read_tiff_header(fname: str) -> dict:
+    """Read only the header of a tiff file, see `read_tiff`"""
+    with tifffile.TiffFile(fname) as tiff:
+        return _tiff_header(tiff)
 
 
 def write_hdf5(fname: str, data, header: dict=None):
@@ -122,6 +169,15 @@ def read_hdf5(fname: str) -> (np.array, dict):
     return np.array(f["data"]), dict(f["data"].attrs)
 
 
+def read_hdf5_header(fname: str) -> dict:
+    """Read only the header (attributes of "/data") of a hdf5 file written by Instamatic"""
+    if not os.path.exists(fname):
+        raise FileNotFoundError(f"No such file: '{fname}'")
+
+    with h5py.File(fname, "r") as f:
+        return dict(f["data"].attrs)
+
+
 def read_cbf(fname: str):
     """CBF reader not implemented"""
     raise NotImplementedError("CBF reader not implemented.")
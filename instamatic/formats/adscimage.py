@@ -64,6 +64,15 @@ def readheader(infile):
     return header
 
 
+def read_adsc_header(fname: str) -> dict:
+    """Read only the header of an adsc/smv file"""
+    with open(fname, "rb") as infile:
+        try:
+            return readheader(infile)
+        except:
+            raise Exception("Error processing adsc header")
+
+
 def read_adsc(fname: str) -> (np.array, dict):
     """ read in the file """
     with open(fname, "rb", buffering=0) as infile:
@@ -0,0 +1,105 @@
+import time
+import yaml
+import numpy as np
+from pathlib import Path
+
+from instamatic.formats import read_image, read_header, read_headers
+from instamatic.formats.header import dump_header, load_header
+
+
+def find_images(path, pattern: str="*") -> list:
+    """Return the image files in directory `path` (or `path` itself if it is a file)"""
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    exts = (".tif", ".tiff", ".h5", ".hdf5", ".img", ".smv", ".mrc")
+    return sorted(fn for fn in path.glob(pattern) if fn.suffix.lower() in exts)
+
+
+def _timeit(func, fns: list) -> float:
+    t0 = time.perf_counter()
+    func(fns)
+    return time.perf_counter() - t0
+
+
+def benchmark_read_header(fns: list, workers: int=8, full: bool=True):
+    """Print the number of headers/s for `read_image`, `read_header` and `read_headers`"""
+    n = len(fns)
+
+    tests = []
+    if full:
+        tests.append(("read_image", lambda fns: [read_image(fn) for fn in fns]))
+    tests.append(("read_header", lambda fns: [read_header(fn) for fn in fns]))
+    tests.append((f"read_headers (workers={workers})", lambda fns: read_headers(fns, workers=workers)))
+
+    for name, func in tests:
+        dt = _timeit(func, fns)
+        print(f"{name:30s} {n:6d} files in {dt:7.3f} s -> {n/dt:9.1f} headers/s")
+
+
+def example_header() -> dict:
+    """Header similar to the ones written by `TEMController.getImage` during a cRED experiment"""
+    h = {"ImageGetTime": time.time(), "ImageExposureTime": 0.5, "ImageBinSize": 1, "ImageResolution": (516, 516),
+         "ImageComment": "", "ImageCameraName": "timepix", "ImageCameraDimensions": (516, 516),
+         "ImagePixelsize": 0.00838, "ImageRotationAxis": -2.24, "exp_crystal_coords": np.random.random((5, 2)) * 516}
+    for key in ("Beamshift", "Beamtilt", "DiffShift", "GunShift", "GunTilt", "ImageShift1", "ImageShift2"):
+        h[key] = {"x": 32768, "y": 32768}
+    h.update(Brightness=40000, DiffFocus=30000, Magnification=2500, FunctionMode="diff", SpotSize=3,
+             StagePosition={"x": 1234.5, "y": -5678.9, "z": 0.0, "a": 45.123, "b": 0.0}, HTValue=200000)
+    return h
+
+
+def benchmark_header_format(header: dict, n: int=1000):
+    """Print the time to serialize/parse `header` for the YAML and JSON header formats"""
+    s_yaml = dump_header(header, fmt="yaml")
+    s_json = dump_header(header, fmt="json")
+
+    tests = (
+        ("yaml dump", lambda: yaml.dump(header)),
+        ("yaml load (yaml.Loader)", lambda: yaml.load(s_yaml, Loader=yaml.Loader)),
+        ("yaml load (C loader)", lambda: load_header(s_yaml)),
+        ("json dump", lambda: dump_header(header, fmt="json")),
+        ("json load", lambda: load_header(s_json)),
+    )
+
+    print(f"Header size: yaml={len(s_yaml)} bytes, json={len(s_json)} bytes")
+    for name, func in tests:
+        t0 = time.perf_counter()
+        for i in range(n):
+            func()
+        dt = (time.perf_counter() - t0) / n
+        print(f"{name:30s} {dt*1e6:9.1f} us/header")
+
+
+def main():
+    import argparse
+
+    description = "Benchmark reading image headers from a directory, or the serialization of headers."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("path", type=str, nargs="?", default=".",
+                        help="Directory with images (default: current directory)")
+    parser.add_argument("-p", "--pattern", type=str, default="*",
+                        help="Glob pattern for the files in the directory (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=8,
+                        help="Number of threads for `read_headers` (default: %(default)s)")
+    parser.add_argument("-n", "--no-full", action="store_false", dest="full",
+                        help="Do not time `read_image` (slow for large directories)")
+    parser.add_argument("-s", "--serialization", action="store_true",
+                        help="Benchmark the header serialization (yaml/json) instead, using the header of the first image, or an example header if there are no images")
+    options = parser.parse_args()
+
+    fns = find_images(options.path, options.pattern)
+
+    if options.serialization:
+        header = read_header(fns[0]) if fns else example_header()
+        benchmark_header_format(header)
+        return
+
+    if not fns:
+        parser.error(f"No images found in {options.path}")
+
+    benchmark_read_header(fns, workers=options.workers, full=options.full)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import yaml
 from collections import OrderedDict
-import pandas as pd
+from instamatic.utils.lazy_import import lazy_import
+pd = lazy_import("pandas")
 import io
 
 
@@ -0,0 +1,70 @@
+import json
+import yaml
+import numpy as np
+
+# The C loader (libyaml) is much faster, but is not available in every PyYAML installation
+YAMLLoader = getattr(yaml, "CLoader", yaml.Loader)
+
+# Headers are stored as JSON, prefixed by a tag with the version on the first line:
+#     instamatic-json/1
+#     {"ImageGetTime": 1543250000.0, ...}
+# Anything else is parsed as YAML (the format of the files written before)
+JSON_TAG = "instamatic-json"
+JSON_VERSION = 1
+
+HEADER_FORMATS = ("json", "yaml")
+
+
+def _json_default(obj):
+    """Serialize numpy types, arrays are tagged so that they can be restored as arrays"""
+    if isinstance(obj, np.ndarray):
+        return {"__ndarray__": obj.tolist(), "dtype": obj.dtype.str}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _json_object_hook(dct: dict):
+    if "__ndarray__" in dct:
+        return np.array(dct["__ndarray__"], dtype=dct["dtype"])
+    return dct
+
+
+def _str_keys(obj) -> bool:
+    """Check that all dicts in `obj` (at any depth) have only string keys,
+    `json.dumps` would silently convert other keys to strings"""
+    if isinstance(obj, dict):
+        return all(isinstance(key, str) and _str_keys(value) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return all(_str_keys(item) for item in obj)
+    return True
+
+
+def dump_header(header: dict, fmt: str="json") -> str:
+    """Serialize `header` to a string for the TIFF ImageDescription tag.
+
+    fmt: `json` (default) or `yaml`. Headers that cannot be represented in JSON
+         (e.g. with non-string keys at any depth, or custom objects) are written as YAML."""
+    if fmt not in HEADER_FORMATS:
+        raise ValueError(f"Unknown header format: {fmt}, must be one of {HEADER_FORMATS}")
+
+    if fmt == "json":
+        try:
+            if _str_keys(header):
+                return f"{JSON_TAG}/{JSON_VERSION}\n" + json.dumps(header, default=_json_default)
+        except TypeError:
+            pass
+
+    return yaml.dump(header)
+
+
+def load_header(s: str) -> dict:
+    """Parse a header written by `dump_header`, the format is detected automatically"""
+    if s.startswith(JSON_TAG):
+        tag, _, s = s.partition("\n")
+        version = int(tag.rsplit("/", 1)[-1])
+        if version > JSON_VERSION:
+            raise IOError(f"Unsupported header version: {tag} (this version of instamatic reads up to {JSON_VERSION})")
+        return json.loads(s, object_hook=_json_object_hook)
+
+    return yaml.load(s, Loader=YAMLLoader) or {}
@@ -231,7 +231,9 @@ def acquire_data_cRED(controller, **kwargs):
     expdir = controller.module_io.get_new_experiment_directory()
     expdir.mkdir(exist_ok=True, parents=True)
     
-    cexp = cRED.Experiment(ctrl=controller.ctrl, path=expdir, flatfield=controller.module_io.get_flatfield(), log=controller.log, **kwargs)
+    # the data conversion runs in the processing lane, so that the hardware lane is free for the next job
+    writer = lambda func, *args: controller.submit_call(func, *args, name="cred_write")
+    cexp = cRED.Experiment(ctrl=controller.ctrl, path=expdir, flatfield=controller.module_io.get_flatfield(), log=controller.log, writer=writer, **kwargs)
 
     success = cexp.start_collection()
 
@@ -240,12 +242,15 @@ def acquire_data_cRED(controller, **kwargs):
     
     controller.log.info("Finish cRED experiment")
 
-    if controller.use_indexing_server:
-        controller.q.put(("autoindex", {"task": "run", "path": cexp.smv_path} ))
-        controller.triggerEvent.set()
+    def data_written(job):
+        if job.status == DONE and controller.use_indexing_server:
+            controller.submit("autoindex", {"task": "run", "path": cexp.smv_path})
+
+    cexp.write_job.add_done_callback(data_written)
 
 
 from .base_module import BaseModule
+from .job_scheduler import DONE
 module = BaseModule("cred", "cRED", True, ExperimentalcRED, commands={
     "cred": acquire_data_cRED,
     "toggle_difffocus": toggle_difffocus,
@@ -91,6 +91,12 @@ class DebugFrame(LabelFrame):
 
         self.resetTriggers = Button(frame, text="Empty queue", command=self.empty_queue)
         self.resetTriggers.grid(row=2, column=0, sticky="EW")
+
+        self.callLatencies = Button(frame, text="Call latencies", command=self.show_call_latencies)
+        self.callLatencies.grid(row=2, column=1, sticky="EW")
+
+        self.jobStatus = Button(frame, text="Job status", command=self.job_status)
+        self.jobStatus.grid(row=3, column=0, sticky="EW")
         
         frame.columnconfigure(0, weight=1)
         frame.columnconfigure(1, weight=1)
@@ -140,6 +146,9 @@ class DebugFrame(LabelFrame):
             job, kwargs = self.q.get()
             print("Flushed job: {}->{}".format(job, kwargs))
 
+    def job_status(self):
+        print(self.q.status())
+
     def open_ipython(self):
         self.q.put(("debug", { "task": "open_ipython" } ))
         self.triggerEvent.set()
@@ -148,6 +157,9 @@ class DebugFrame(LabelFrame):
         self.q.put(("debug", { "task": "report_status" } ))
         self.triggerEvent.set()
 
+    def show_call_latencies(self):
+        CallLatencyWindow(self.parent)
+
     def close_down(self):
         script = self.scripts_drc / "close_down.py"
         print(script, script.exists())
@@ -177,6 +189,47 @@ class DebugFrame(LabelFrame):
         self.triggerEvent.set()
 
 
+class CallLatencyWindow(Toplevel):
+    """Shows the call statistics of the microscope/camera interfaces, see `instamatic.utils.instrumentation`"""
+    def __init__(self, parent):
+        Toplevel.__init__(self, parent)
+        self.title("Call latencies (ms)")
+
+        from instamatic.utils.instrumentation import instrumentation
+        self.instrumentation = instrumentation
+
+        self.text = Text(self, width=120, height=30, font=("Courier", 9), wrap=NONE)
+        self.text.pack(side="top", fill="both", expand=True, padx=10, pady=10)
+
+        frame = Frame(self)
+
+        Button(frame, text="Refresh", command=self.update_table).grid(row=0, column=0, sticky="EW")
+        Button(frame, text="Reset", command=self.reset).grid(row=0, column=1, sticky="EW")
+        Button(frame, text="Save JSON..", command=self.save_json).grid(row=0, column=2, sticky="EW")
+
+        for i in range(3):
+            frame.columnconfigure(i, weight=1)
+        frame.pack(side="bottom", fill="x", padx=10, pady=10)
+
+        self.update_table()
+
+    def update_table(self):
+        self.text.delete("1.0", END)
+        if not self.instrumentation.stats:
+            self.text.insert(END, "No calls recorded yet (the interfaces are only instrumented if `instrument_calls: true` in global.yaml)\n\n")
+        self.text.insert(END, self.instrumentation.table())
+
+    def reset(self):
+        self.instrumentation.reset()
+        self.update_table()
+
+    def save_json(self):
+        fn = tkinter.filedialog.asksaveasfilename(parent=self, title="Save call statistics",
+                                                  defaultextension=".json", initialfile="call_latencies.json")
+        if fn:
+            self.instrumentation.to_json(fn)
+
+
 def debug(controller, **kwargs):
     task = kwargs.pop("task")
     if task == "open_ipython":
@@ -215,7 +268,7 @@ def autoindex(controller, **kwargs):
         return
 
     elif task == "run":
-        payload = bytes(kwargs.get("path"))
+        payload = str(kwargs.get("path")).encode()
 
     elif task == "kill_server":
         payload = b"kill"
@@ -226,8 +279,6 @@ def autoindex(controller, **kwargs):
         s.send(payload)
         data = s.recv(BUFSIZE).decode()
         print(data)
-        data = s.recv(BUFSIZE).decode()
-        print(data)
 
     if task == "kill":
         del controller.indexing_server_process
@@ -16,6 +16,7 @@ import atexit
 
 from instamatic.camera.videostream import VideoStream
 from .modules import MODULES
+from .job_scheduler import JobScheduler
 
 job_dict = {}
 
@@ -34,7 +35,9 @@ class DataCollectionController(threading.Thread):
 
         self.log = log
 
-        self.q = queue.LifoQueue(maxsize=1)
+        # the modules submit jobs with `q.put((job, kwargs))`, the trigger is kept for compatibility
+        self.scheduler = JobScheduler(self, job_dict, call_in_gui=self.call_in_gui)
+        self.q = self.scheduler
         self.triggerEvent = threading.Event()
         
         self.module_io = self.app.get_module("io")
@@ -51,31 +54,24 @@ class DataCollectionController(threading.Thread):
         atexit.register(self.close)
 
     def run(self):
-        while True:
-            self.triggerEvent.wait()
-            self.triggerEvent.clear()
+        self.scheduler.start()
+        self.exitEvent.wait()
+        self.close()
 
-            if self.exitEvent.is_set():
-                self.close()
-                sys.exit()
+    def call_in_gui(self, func):
+        """Run `func` in the GUI thread (for job completion callbacks)"""
+        self.app.after(0, func)
 
-            job, kwargs = self.q.get()
+    def submit(self, job: str, kwargs: dict=None, **options):
+        """Submit job `job` (see `JobScheduler.submit`), returns the `Job`"""
+        return self.scheduler.submit(job, kwargs, **options)
 
-            try:
-                func = job_dict[job]
-            except KeyError:
-                print("Unknown job: {}".format(job))
-                print("Kwargs:\n{}".format(kwargs))
-                continue
-
-            try:
-                func(self, **kwargs)
-            except Exception as e:
-                traceback.print_exc()
-                self.log.debug("Error caught -> {} while running '{}' with {}".format(repr(e), job, kwargs))
-                self.log.exception(e)
+    def submit_call(self, func, *args, **kwargs):
+        """Run `func(*args, **kwargs)` in the processing lane (see `JobScheduler.submit_call`), returns the `Job`"""
+        return self.scheduler.submit_call(func, *args, **kwargs)
 
     def close(self):
+        self.scheduler.close()
         for item in (self.ctrl, self.stream, self.beam_ctrl, self.app):
             try:
                 item.close()
@@ -0,0 +1,298 @@
+import time
+import queue
+import itertools
+import threading
+import traceback
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Jobs run in lanes, every lane has its own queue and worker threads. The hardware lane has
+# a single worker, so that commands to the microscope/camera never overlap, the processing lane
+# is for work that does not touch the hardware (data conversion, indexing, file IO)
+HARDWARE = "hardware"
+PROCESSING = "processing"
+
+LANES = {HARDWARE: 1, PROCESSING: 2}  # lane -> number of workers
+
+# lane per job name (the keys in `job_dict`), jobs not listed here go to the hardware lane
+JOB_LANES = {
+    "autoindex": PROCESSING,
+}
+
+# lower numbers run first, jobs with the same priority run in the order they were submitted
+HIGH = 0
+NORMAL = 10
+LOW = 20
+
+JOB_PRIORITIES = {
+    "ctrl": HIGH,
+    "toggle_difffocus": HIGH,
+    "debug": HIGH,
+}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job(object):
+    """A unit of work submitted to the `JobScheduler`"""
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, func, args=(), kwargs=None, lane: str=HARDWARE, priority: int=NORMAL):
+        super().__init__()
+        self.id = next(self._ids)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.lane = lane
+        self.priority = priority
+
+        self.status = QUEUED
+        self.result = None
+        self.exception = None
+        self.t_submit = time.time()
+        self.t_start = self.t_end = None
+
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Job(id={self.id}, name='{self.name}', lane='{self.lane}', status='{self.status}')"
+
+    @property
+    def duration(self) -> float:
+        if self.t_start is None:
+            return 0.0
+        return (self.t_end or time.time()) - self.t_start
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel(self) -> bool:
+        """Cancel the job if it has not started yet, returns True if it was cancelled"""
+        with self._lock:
+            if self.status != QUEUED:
+                return False
+            self.status = CANCELLED
+        self._finish()
+        return True
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait until the job has finished (or was cancelled), returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """Call `callback(job)` when the job has finished, immediately if it is done already"""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _run(self):
+        with self._lock:
+            if self.status != QUEUED:
+                return
+            self.status = RUNNING
+        self.t_start = time.time()
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            self.exception = e
+            self.status = FAILED
+            traceback.print_exc()
+            logger.exception("Job %s failed: %s", self, e)
+        else:
+            self.status = DONE
+        self.t_end = time.time()
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.exception("Callback of job %s failed: %s", self, e)
+
+
+class JobScheduler(object):
+    """Prioritized job scheduler for the GUI, replaces the single-slot job queue + trigger.
+
+    Jobs are never dropped: every submitted job runs (or is cancelled). Jobs are queued
+    per lane (see `LANES`) by priority, so that a quick action (e.g. stopping the stage)
+    does not wait behind queued experiments, and the data conversion/indexing after an
+    experiment (processing lane) does not hold up the microscope (hardware lane).
+
+    For compatibility with the GUI modules, `put((job_name, kwargs))` submits a job from
+    `job_dict`, the job function is called as `func(controller, **kwargs)`.
+
+    call_in_gui: function to run the completion callbacks in the GUI thread, e.g.
+                 `lambda f: root.after(0, f)`. By default they run in the worker thread.
+    history: number of finished jobs to keep, queued and running jobs are always kept
+    """
+    def __init__(self, controller, job_dict: dict, lanes: dict=None, call_in_gui=None, history: int=100):
+        super().__init__()
+        self.controller = controller
+        self.job_dict = job_dict
+        self.lanes = dict(lanes or LANES)
+        self.call_in_gui = call_in_gui
+        self.history = history
+
+        self._queues = {lane: queue.PriorityQueue() for lane in self.lanes}
+        self._counter = itertools.count()
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+
+    def start(self):
+        """Start the worker threads"""
+        for lane, workers in self.lanes.items():
+            for i in range(workers):
+                t = threading.Thread(target=self._worker, args=(lane, ), name=f"{lane}-lane-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def _worker(self, lane: str):
+        q = self._queues[lane]
+        while True:
+            priority, count, job = q.get()
+            if job is None:
+                break
+            job._run()
+
+    def close(self):
+        """Stop the workers after the running jobs, queued jobs are cancelled"""
+        if self._closed:
+            return
+        self._closed = True
+        self.cancel_all()
+        for lane, workers in self.lanes.items():
+            for i in range(workers):
+                self._queues[lane].put((float("inf"), next(self._counter), None))
+
+    def submit_job(self, job: Job, callback=None) -> Job:
+        if self._closed:
+            raise RuntimeError("Job scheduler has been closed")
+        if job.lane not in self._queues:
+            raise ValueError(f"No such lane: `{job.lane}`, must be one of {tuple(self._queues)}")
+
+        if callback:
+            if self.call_in_gui:
+                job.add_done_callback(lambda job: self.call_in_gui(lambda: callback(job)))
+            else:
+                job.add_done_callback(callback)
+
+        with self._lock:
+            self._jobs.append(job)
+            self._trim()
+        self._queues[job.lane].put((job.priority, next(self._counter), job))
+        logger.debug("Submitted %s", job)
+        return job
+
+    def _trim(self):
+        """Drop the oldest finished jobs beyond `history`, call with the lock held"""
+        finished = [job for job in self._jobs if job.done()]
+        if len(finished) > self.history:
+            drop = set(finished[:len(finished) - self.history])
+            self._jobs = [job for job in self._jobs if job not in drop]
+
+    def submit(self, name: str, kwargs: dict=None, lane: str=None, priority: int=None, callback=None) -> Job:
+        """Submit job `name` from `job_dict`, called as `func(controller, **kwargs)`.
+        The lane and priority default to `JOB_LANES`/`JOB_PRIORITIES`."""
+        try:
+            func = self.job_dict[name]
+        except KeyError:
+            raise KeyError(f"Unknown job: {name}") from None
+
+        if lane is None:
+            lane = JOB_LANES.get(name, HARDWARE)
+        if priority is None:
+            priority = JOB_PRIORITIES.get(name, NORMAL)
+
+        job = Job(name, func, args=(self.controller, ), kwargs=kwargs, lane=lane, priority=priority)
+        return self.submit_job(job, callback=callback)
+
+    def submit_call(self, func, *args, name: str=None, lane: str=PROCESSING, priority: int=NORMAL, callback=None, **kwargs) -> Job:
+        """Run `func(*args, **kwargs)` in `lane` (default: processing)"""
+        name = name or getattr(func, "__name__", "call")
+        job = Job(name, func, args=args, kwargs=kwargs, lane=lane, priority=priority)
+        return self.submit_job(job, callback=callback)
+
+    # Queue interface used by the GUI modules
+
+    def put(self, item, block: bool=True, timeout: float=None):
+        """Submit `(job_name, kwargs)`, unknown jobs are reported and ignored"""
+        name, kwargs = item
+        try:
+            self.submit(name, kwargs)
+        except KeyError:
+            print(f"Unknown job: {name}")
+            print(f"Kwargs:\n{kwargs}")
+
+    def get(self, block: bool=False, timeout: float=None) -> tuple:
+        """Cancel the next queued job, and return it as `(job_name, kwargs)`"""
+        for job in self.queued():
+            if job.cancel():
+                return job.name, job.kwargs
+        raise queue.Empty
+
+    def qsize(self) -> int:
+        return len(self.queued())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    # Status
+
+    @property
+    def jobs(self) -> list:
+        """The queued and running jobs, and the most recent finished jobs (see `history`)"""
+        with self._lock:
+            return list(self._jobs)
+
+    def queued(self) -> list:
+        """Jobs that are waiting, in the order they will run per lane"""
+        jobs = [job for job in self.jobs if job.status == QUEUED]
+        return sorted(jobs, key=lambda job: (job.lane, job.priority, job.id))
+
+    def running(self) -> list:
+        return [job for job in self.jobs if job.status == RUNNING]
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancel the queued job with `job_id`"""
+        for job in self.jobs:
+            if job.id == job_id:
+                return job.cancel()
+        return False
+
+    def cancel_all(self, lane: str=None) -> int:
+        """Cancel all queued jobs (in `lane`), returns the number of cancelled jobs"""
+        return sum(job.cancel() for job in self.queued() if lane is None or job.lane == lane)
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for all submitted jobs to finish, returns False on timeout"""
+        t_end = None if timeout is None else time.time() + timeout
+        for job in self.jobs:
+            remaining = None if t_end is None else max(0, t_end - time.time())
+            if not job.wait(remaining):
+                return False
+        return True
+
+    def status(self) -> str:
+        """Return a table with the status of the queued, running and recent jobs"""
+        lines = [f"{'id':>5s} {'job':20s} {'lane':12s} {'prio':>4s} {'status':10s} {'time (s)':>9s}"]
+        for job in self.jobs:
+            lines.append(f"{job.id:5d} {job.name:20s} {job.lane:12s} {job.priority:4d} {job.status:10s} {job.duration:9.2f}")
+        return "\n".join(lines)
@@ -2,8 +2,18 @@ import numpy as np
 import pickle
 from pathlib import Path
 
-with open(Path(__file__).parent / "weights-py3.p", "rb") as p_file:
-    weights = pickle.load(p_file)
+WEIGHTS_FILE = Path(__file__).parent / "weights-py3.p"
+
+_weights = None
+
+
+def load_weights():
+    """Load the weights of the network on first use (unpickling them at import slows down every import of instamatic.neural_network)"""
+    global _weights
+    if _weights is None:
+        with open(WEIGHTS_FILE, "rb") as p_file:
+            _weights = pickle.load(p_file)
+    return _weights
 
 
 def conv_layer(in_layer, weight, offset):
@@ -33,7 +43,9 @@ def max_pooling(convoluted):
 def logistic(x):
     return 1/(1+np.exp(-x))
 
-def predict(image, weights=weights):
+def predict(image, weights=None):
+    if weights is None:
+        weights = load_weights()
     convoluted1 = relu(conv_layer(image, weights[0], weights[1]))
     pooled1 = max_pooling(convoluted1)
     convoluted2 = relu(conv_layer(pooled1, weights[2], weights[3]))
@@ -2,8 +2,8 @@ import numpy as np
 from datetime import datetime
 import time
 from instamatic.formats import read_tiff, write_tiff, write_mrc, write_adsc
-from instamatic.processing.flatfield import apply_flatfield_correction
-from instamatic.processing.stretch_correction import affine_transform_ellipse_to_circle
+from instamatic.processing.flatfield import apply_flatfield_correction, apply_flatfield_correction_inplace
+from instamatic.processing.frame_store import FrameStore
 from instamatic import config
 from instamatic.tools import find_beam_center, find_subranges
 from instamatic.tools import find_beam_center_with_beamstop, to_xds_untrusted_area
@@ -94,6 +94,37 @@ def get_calibrated_rotation_speed(val):
     return calibrated_value
 
 
+def read_buffer(buffer, flatfield=None) -> (dict, dict):
+    """Return the headers and images in the image buffer as dicts with the frame number as key,
+    and apply the flatfield correction if a flatfield is given.
+
+    The buffer is a list of (index, image, header) tuples, which is emptied, or a `FrameStore`.
+    The images in a `FrameStore` are not copied: the flatfield correction is applied in place
+    in the dtype of the store, and the images are views into the store."""
+    headers = {}
+    data = {}
+
+    if isinstance(buffer, FrameStore):
+        for i, img, h in buffer:
+            if flatfield is not None:
+                apply_flatfield_correction_inplace(img, flatfield)
+            headers[i] = h
+            data[i] = img
+        return headers, data
+
+    while len(buffer) != 0:
+        i, img, h = buffer.pop(0)
+
+        headers[i] = h
+
+        if flatfield is not None:
+            data[i] = apply_flatfield_correction(img, flatfield)
+        else:
+            data[i] = img
+
+    return headers, data
+
+
 class ImgConversion(object):
     """This class is for post RED/cRED data collection image conversion.
     Files can be generated for REDp, DIALS, XDS, and PETS.
@@ -117,30 +148,20 @@ class ImgConversion(object):
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = "data"
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.headers, self.data = read_buffer(buffer, flatfield=self.flatfield)
 
         self.untrusted_areas = []
+        self.camera_length = camera_length
 
         self.observed_range = set(self.data.keys())
         self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
         self.missing_range = self.observed_range ^ self.complete_range
 
-        self.data_shape = img.shape
+        self.data_shape = self.data[min(self.observed_range)].shape
         try:
-            self.pixelsize = config.calibration.pixelsize_diff[camera_length] # px / Angstrom
+            self.pixelsize = config.calibration.pixelsize_diff.nearest(camera_length) # px / Angstrom
         except KeyError:
             self.pixelsize = 1
             print("No calibrated pixelsize for camera length={}. Setting pixelsize to 1.".format(camera_length))
@@ -252,35 +273,13 @@ class ImgConversion(object):
             Y-GEO_CORR= YCORR.cbf
 
         Reads the stretch amplitude/azimuth from the config file
-        """
-        from instamatic.formats import write_cbf
-
-        center = np.array(self.mean_beam_center)
-        
-        amplitude_pc = self.stretch_amplitude / (2*100)
-        
-        # To create the correct corrections the azimuth is mirrored
-        azimuth_rad  = np.radians(180 - self.stretch_azimuth)
-
-        shape = self.data_shape
 
-        xi, yi = np.mgrid[0:shape[0], 0:shape[1]]
-        coords = np.stack([xi.flatten(), yi.flatten()], axis=1) - center
-        
-        s = affine_transform_ellipse_to_circle(azimuth_rad, amplitude_pc)
-        
-        new = np.dot(coords, s)
-
-        xcorr = (new[:,0].reshape(shape) + center[0]) - xi
-        ycorr = (new[:,1].reshape(shape) + center[1]) - yi
-
-        # reverse XY coordinates for XDS
-        xcorr, ycorr = ycorr, xcorr
+        The tables only depend on the detector shape, beam center and stretch parameters,
+        so they are taken from (or added to) the correction table cache and linked into `path`
+        """
+        from instamatic.processing.correction_tables import CorrectionTableCache
 
-        # In XDS, the geometrically corrected coordinates of a pixel at IX,IY 
-        # are found by adding the table_value(IX,IY)/100.0 for the X- and Y-tables, respectively.
-        write_cbf(path / "XCORR.cbf", np.int32((xcorr * 100)))
-        write_cbf(path / "YCORR.cbf", np.int32((ycorr * 100)))
+        CorrectionTableCache().link(path, self.data_shape, self.mean_beam_center, self.stretch_azimuth, self.stretch_amplitude)
 
     def tiff_writer(self, path: str) -> None:
         """Write all data as tiff files to given `path`"""
@@ -634,6 +633,14 @@ class ImgConversion(object):
             for i in self.observed_range:
                 print(f"{i:4d}{0:8.2f}{0:8.2f}", file=f)
 
-    def add_beamstop(self, rect):
-        """rect must be a 2x4 coordinate array"""
+    def add_beamstop(self, rect=None):
+        """rect must be a 2x4 coordinate array
+        If `rect` is None, the beamstop stored for this camera length is used. If there is none,
+        it is determined once from the mean of the data (and stored for the next dataset).
+        Call before `write_xds_inp` to add the beamstop to the untrusted areas."""
+        if rect is None:
+            if self.camera_length is None:
+                raise ValueError("The camera length is needed to look up the beamstop")
+            from instamatic.utils.beamstop import BeamstopStore
+            rect = BeamstopStore().find(self.data.values(), self.camera_length, center=self.mean_beam_center)
         self.untrusted_areas.append(("quadrilateral", rect))
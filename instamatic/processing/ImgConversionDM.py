@@ -21,35 +21,26 @@ class ImgConversionDM(ImgConversion):
                  pixelsize: float=None,          # p/Angstrom, size of the pixels (overrides camera_length)
                  physical_pixelsize: float=None, # mm, physical size of the pixels (overrides camera length)
                  wavelength: float=None,         # Angstrom, relativistic wavelength of the electron beam
+                 camera_length: float=None,      # virtual camera length, used to look up the beamstop (`add_beamstop`)
                  ):
         if flatfield is not None:
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = "data"
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.headers, self.data = read_buffer(buffer, flatfield=self.flatfield)
 
         self.observed_range = set(self.data.keys())
         self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
         self.missing_range = self.observed_range ^ self.complete_range
 
-        self.data_shape = img.shape
+        self.data_shape = self.data[min(self.observed_range)].shape
 
         self.pixelsize = pixelsize
         self.physical_pixelsize = physical_pixelsize
         self.wavelength = wavelength
+        self.camera_length = camera_length
 
         self.use_beamstop = False
         self.mean_beam_center, self.beam_center_std = self.get_beam_centers()
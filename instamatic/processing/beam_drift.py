@@ -0,0 +1,339 @@
+import os
+import warnings
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import as_strided
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+DRIFT_TABLE = "beam_drift.txt"
+CENTERS_CACHE = "beam_centers.npz"
+
+
+def find_beam_center_file(fn: str, sigma: int=10, m: int=50, kind: int=3) -> (float, float):
+    """Read image `fn` and return the position of the primary beam, see `tools.find_beam_center`.
+    Runs in a worker process, so it must be a module-level function."""
+    from instamatic.formats import read_image
+    from instamatic.tools import find_beam_center
+
+    img, h = read_image(fn)
+    return find_beam_center(img, sigma, m=m, kind=kind)
+
+
+def _stamps(fns: list) -> np.ndarray:
+    stamps = []
+    for fn in fns:
+        st = os.stat(fn)
+        stamps.append((st.st_size, st.st_mtime))
+    return np.array(stamps, dtype=float).reshape(-1, 2)
+
+
+def beam_centers(fns: list, sigma: int=10, m: int=50, kind: int=3, workers: int=None,
+                 chunksize: int=16, cache: str=None) -> np.ndarray:
+    """Find the position of the primary beam in all images in `fns`, returns an (n, 2) array.
+
+    The images are read and processed in parallel in `workers` processes (default: number
+    of cpus), every worker only reads the frames it processes. Set `workers=0` to process
+    in the current process.
+
+    If `cache` is given (path to an .npz file), the centers are stored together with the
+    size/mtime of the files, and only new or changed frames are processed on the next call.
+    """
+    fns = [str(fn) for fn in fns]
+    stamps = _stamps(fns)
+    params = np.array([sigma, m, kind], dtype=float)
+
+    centers = np.full((len(fns), 2), np.nan)
+    todo = np.arange(len(fns))
+
+    if cache and os.path.exists(cache):
+        with np.load(cache) as data:
+            if np.array_equal(data["params"], params):
+                known = {fn: (stamp, center) for fn, stamp, center in zip(data["fns"], data["stamps"], data["centers"])}
+                for i, (fn, stamp) in enumerate(zip(fns, stamps)):
+                    entry = known.get(fn)
+                    if entry is not None and np.array_equal(entry[0], stamp):
+                        centers[i] = entry[1]
+                todo = np.flatnonzero(np.isnan(centers[:, 0]))
+
+    if len(todo):
+        args = [fns[i] for i in todo]
+        n = len(args)
+        if workers == 0 or n < 2*chunksize:
+            results = [find_beam_center_file(fn, sigma, m, kind) for fn in args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(find_beam_center_file, args, [sigma]*n, [m]*n, [kind]*n, chunksize=chunksize))
+        centers[todo] = results
+        logger.info("Found the beam center in %d/%d frames", len(todo), len(fns))
+
+        if cache:
+            np.savez(cache, fns=np.array(fns), stamps=stamps, centers=centers, params=params)
+
+    return centers
+
+
+def insert_nan(xy: np.ndarray, interval: int=10) -> np.ndarray:
+    """Insert a row of NaN before every `interval-1` rows, to separate scan ranges in plots"""
+    repeat = interval - 1
+    return np.insert(np.asarray(xy, dtype=float), np.arange(0, len(xy), repeat), np.nan, axis=0)
+
+
+def _windows(xy: np.ndarray, n: int, step: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Strided view of windows of `n` rows every `step` rows, the last window ends at the end of `xy`
+    (and may be shorter, it is padded with NaN). Returns the windows and the start/end index of each."""
+    xy = np.asarray(xy, dtype=float)
+    nrows = len(xy)
+    nwin = 1 if n >= nrows else int(np.ceil((nrows - n) / step)) + 1
+    starts = np.arange(nwin) * step
+    ends = np.minimum(starts + n, nrows)
+
+    padded = np.full((starts[-1] + n, xy.shape[1]), np.nan)
+    padded[:nrows] = xy
+    s0, s1 = padded.strides
+    windows = as_strided(padded, shape=(nwin, n, xy.shape[1]), strides=(step*s0, s0, s1), writeable=False)
+    return windows, starts, ends
+
+
+def subrange_statistics(xy: np.ndarray, n: int=100, step: int=50) -> np.ndarray:
+    """Statistics of the beam position over windows of `n` frames every `step` frames.
+
+    Returns an array with one row per window:
+        start, end, mean_x, mean_y, std_x, std_y, range_x, range_y
+    where range is the largest deviation from the minimum within the window. NaN frames are ignored."""
+    windows, starts, ends = _windows(xy, n, step)
+    with warnings.catch_warnings():
+        # windows without valid frames give NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(windows, axis=1)
+        std = np.nanstd(windows, axis=1)
+        rng = np.nanmax(windows, axis=1) - np.nanmin(windows, axis=1)
+    return np.column_stack((starts, ends, mean, std, rng))
+
+
+def format_subranges(stats: np.ndarray) -> str:
+    """Format the output of `subrange_statistics` as a table"""
+    s = ""
+    for start, end, mean_x, mean_y, std_x, std_y, rng_x, rng_y in stats:
+        s += f"{start:4.0f} - {end:4.0f}    {mean_x:8.2f}  {mean_y:8.2f}   {std_x:6.2f}  {std_y:6.2f}   {rng_x:6.2f}  {rng_y:6.2f}\n"
+    return s
+
+
+def rolling_statistics(xy: np.ndarray, window: int=10) -> (np.ndarray, np.ndarray):
+    """Rolling mean and standard deviation of the beam position over the last `window` frames
+    (fewer at the start), NaN frames are ignored. Returns two (n, 2) arrays."""
+    xy = np.asarray(xy, dtype=float)
+    padded = np.vstack((np.full((window - 1, xy.shape[1]), np.nan), xy))
+    s0, s1 = padded.strides
+    windows = as_strided(padded, shape=(len(xy), window, xy.shape[1]), strides=(s0, s0, s1), writeable=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(windows, axis=1), np.nanstd(windows, axis=1)
+
+
+def scan_ranges(xy: np.ndarray) -> list:
+    """Split the frames into sequential ranges of valid beam positions.
+    Frames where the position is NaN or (0, 0) separate the ranges. Returns a list of (start, stop)."""
+    xy = np.asarray(xy, dtype=float)
+    valid = np.nansum(xy, axis=1) != 0
+    edges = np.diff(np.concatenate(([0], valid.astype(int), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def scan_range_drifts(xy: np.ndarray) -> np.ndarray:
+    """Drift of the beam (in pixels) within every scan range (see `scan_ranges`),
+    defined as the spread of the distances of the beam position to the first frame of the range"""
+    xy = np.asarray(xy, dtype=float)
+    ranges = scan_ranges(xy)
+    if not ranges:
+        return np.array([])
+
+    starts = np.array([start for start, stop in ranges])
+    lengths = np.array([stop - start for start, stop in ranges])
+    idx = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    origin = np.repeat(xy[starts], lengths, axis=0)
+
+    dist = np.linalg.norm(xy[idx] - origin, axis=1)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.maximum.reduceat(dist, offsets) - np.minimum.reduceat(dist, offsets)
+
+
+class DriftTable(object):
+    """Compact table of the drift of the primary beam in a dataset.
+
+    Stores for every frame the beam position and the smoothed offset from the reference
+    position (median of the first `n_ref` frames), so that an experiment can correct the
+    diffraction shift during data collection:
+
+        table = DriftTable.from_file("beam_drift.txt")
+        pixelshift = table.offset_at(frame_number)
+        diffshift = neutral_diffshift - calib_directbeam.pixelshift2diffshift(pixelshift)
+
+    frames: (n, ) frame numbers
+    xy: (n, 2) beam positions in pixels
+    window: number of frames for the rolling mean
+    n_ref: number of frames used to define the reference position
+    """
+    def __init__(self, frames, xy, window: int=10, n_ref: int=10):
+        super().__init__()
+        self.frames = np.asarray(frames)
+        self.xy = np.asarray(xy, dtype=float)
+        self.window = window
+        self.n_ref = n_ref
+
+        self.reference = np.nanmedian(self.xy[:n_ref], axis=0)
+        mean, std = rolling_statistics(self.xy, window=window)
+        self.offset = mean - self.reference
+        self.std = std
+
+    @classmethod
+    def from_images(cls, fns: list, workers: int=None, cache: bool=True, **kwargs):
+        """Make the drift table from the images in `fns`, the frame numbers are taken from the
+        file names (e.g. `00001.img`), or from the order of the files if that fails"""
+        fns = sorted(fns)
+        cache_fn = Path(fns[0]).parent / CENTERS_CACHE if cache else None
+        xy = beam_centers(fns, workers=workers, cache=cache_fn)
+        try:
+            frames = [int(Path(fn).stem.split("_")[-1]) for fn in fns]
+        except ValueError:
+            frames = range(len(fns))
+        return cls(frames, xy, **kwargs)
+
+    @classmethod
+    def from_file(cls, fn: str=DRIFT_TABLE, **kwargs):
+        """Read the drift table written by `write`"""
+        data = np.loadtxt(fn, ndmin=2)
+        return cls(data[:, 0].astype(int), data[:, 1:3], **kwargs)
+
+    def write(self, fn: str=DRIFT_TABLE):
+        """Write the table (frame, x, y, offset_x, offset_y, std_x, std_y) to `fn`"""
+        data = np.column_stack((self.frames, self.xy, self.offset, self.std))
+        header = f"reference: {self.reference[0]:.4f} {self.reference[1]:.4f}, window: {self.window}\n"
+        header += "frame x y offset_x offset_y std_x std_y"
+        np.savetxt(fn, data, fmt=["%6d"] + ["%10.4f"]*6, header=header)
+
+    def offset_at(self, frame: int) -> np.ndarray:
+        """Smoothed offset of the beam from the reference position at `frame` (interpolated, pixels)"""
+        ok = ~np.isnan(self.offset[:, 0])
+        frames = self.frames[ok]
+        return np.array([np.interp(frame, frames, self.offset[ok, 0]),
+                         np.interp(frame, frames, self.offset[ok, 1])])
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def drift_report(xy: np.ndarray, n: int=50, step: int=50) -> str:
+    """Text report with the beam position statistics for all frames, over windows
+    of `n` frames, and the drift per scan range"""
+    s  = "                   mean            std dev             diff        \n"
+    s += "      Range           X         Y        X       Y        X       Y\n"
+    s += format_subranges(subrange_statistics(xy, n=len(xy), step=len(xy)))
+    s += "\n"
+    s += format_subranges(subrange_statistics(xy, n=n, step=step))
+
+    drifts = scan_range_drifts(xy)
+    if len(drifts) > 1:
+        s += "\n"
+        s += f"Mean scan range beam drift: {drifts.mean():.4f} px\n"
+        s += f"(std: {drifts.std():.4f} | min: {drifts.min():.4f} | max: {drifts.max():.4f})\n"
+    return s
+
+
+def plot_drift(xy: np.ndarray, d: float=0.8):
+    """Plot the beam position vs frame number, `d` is the range of the y axis around the median (pixels)"""
+    import matplotlib.pyplot as plt
+
+    median_x, median_y = np.nanmedian(xy, axis=0)
+    std_x, std_y = np.nanstd(xy, axis=0)
+    start = 0
+    end = len(xy)
+
+    f, (ax1, ax2) = plt.subplots(2, sharex=True, sharey=False)
+
+    ax1.set_title("Frame number vs. Position of direct beam")
+
+    ax1.plot([start, end], [median_x, median_x], c="C0", ls=":", label=f"Median(X)={median_x:.2f}, Std(X)={std_x:.2f}")
+    ax2.plot([start, end], [median_y, median_y], c="C1", ls=":", label=f"Median(Y)={median_y:.2f}, Std(Y)={std_y:.2f}")
+
+    ax2.set_xlabel("Frame number")
+    ax1.set_ylabel("Pixel number")
+    ax2.set_ylabel("Pixel number")
+
+    ax1.plot(xy[:, 0], c="C0")
+    ax2.plot(xy[:, 1], c="C1")
+
+    ax1.set_ylim(median_x - d, median_x + d)
+    ax2.set_ylim(median_y - d, median_y + d)
+
+    ax1.legend()
+    ax2.legend()
+    plt.show()
+
+
+def load_beam_centers(fn: str) -> np.ndarray:
+    """Load beam centers from a .npy/.txt file, or an XDS-style .sc file"""
+    suffix = Path(fn).suffix
+    if suffix == ".npy":
+        return np.load(fn)
+    elif suffix == ".txt":
+        return np.loadtxt(fn)
+    elif suffix == ".sc":
+        with open(fn) as f:
+            first = np.array([float(val) for val in f.readline().split()])
+            xy = np.loadtxt(f, usecols=(1, 2))
+        return xy + first
+    else:
+        raise IOError(f"Cannot read beam centers from {fn}, unknown extension: {suffix}")
+
+
+def main():
+    import argparse
+    import glob
+
+    description = "Find the position of the primary beam in every frame of a dataset and report the beam drift."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("args", type=str, metavar="PATTERN",
+                        help="File pattern to the images (e.g. `SMV/data/*.img`), or a file with beam centers (.npy/.txt/.sc)")
+    parser.add_argument("-i", "--interval", type=int, default=None,
+                        help="Number of frames per scan range, inserts a break after every range")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of processes to find the beam centers with (default: number of cpus)")
+    parser.add_argument("-t", "--table", action="store_true",
+                        help=f"Write the drift table ({DRIFT_TABLE}) next to the images")
+    parser.add_argument("-n", "--no-plot", action="store_false", dest="plot",
+                        help="Do not plot the beam positions")
+    options = parser.parse_args()
+
+    filepat = options.args
+
+    if Path(filepat).suffix in (".npy", ".txt", ".sc"):
+        xy = load_beam_centers(filepat)
+    else:
+        fns = sorted(glob.glob(filepat))
+        print(len(fns))
+
+        table = DriftTable.from_images(fns, workers=options.workers)
+        xy = table.xy
+        np.savetxt(Path(fns[0]).parent / "beam_centers.txt", xy, fmt="%10.4f")
+        if options.table:
+            table.write(Path(fns[0]).parent / DRIFT_TABLE)
+
+    if options.interval:
+        xy = insert_nan(xy, interval=options.interval)
+
+    xy = np.array(xy, dtype=float)
+    xy[np.sum(xy, axis=1) == 0] = np.nan
+
+    print()
+    print(drift_report(xy))
+
+    if options.plot:
+        plot_drift(xy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import threading
+import numpy as np
+from pathlib import Path
+
+from instamatic.processing.stretch_correction import affine_transform_ellipse_to_circle
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+XCORR = "XCORR.cbf"
+YCORR = "YCORR.cbf"
+
+
+def geometric_correction_tables(shape: tuple, center: tuple, azimuth: float, amplitude: float) -> (np.ndarray, np.ndarray):
+    """Calculate the XDS geometric correction tables for the stretch correction.
+
+    shape: (nx, ny) shape of the detector
+    center: (x, y) beam center in pixels
+    azimuth: stretch azimuth in degrees
+    amplitude: stretch amplitude in %
+
+    Returns the XCORR and YCORR tables (in the XDS order) in units of 1/100 pixel as int32.
+    The coordinates are broadcast as a column and a row in float32, so the Nx2 coordinate
+    matrix is never materialized.
+    """
+    amplitude_pc = amplitude / (2*100)
+
+    # To create the correct corrections the azimuth is mirrored
+    azimuth_rad = np.radians(180 - azimuth)
+
+    s = affine_transform_ellipse_to_circle(azimuth_rad, amplitude_pc).astype(np.float32)
+
+    dx = np.arange(shape[0], dtype=np.float32)[:, None] - np.float32(center[0])
+    dy = np.arange(shape[1], dtype=np.float32)[None, :] - np.float32(center[1])
+
+    # equivalent to: np.dot(coords - center, s) + center - coords
+    xcorr = dx * (s[0, 0] - 1) + dy * s[1, 0]
+    ycorr = dx * s[0, 1] + dy * (s[1, 1] - 1)
+
+    # reverse XY coordinates for XDS
+    xcorr, ycorr = ycorr, xcorr
+
+    # In XDS, the geometrically corrected coordinates of a pixel at IX,IY
+    # are found by adding the table_value(IX,IY)/100.0 for the X- and Y-tables, respectively.
+    return np.int32(xcorr * 100), np.int32(ycorr * 100)
+
+
+class CorrectionTableCache(object):
+    """Cache of XCORR/YCORR.cbf files, keyed by the detector shape, beam center and stretch parameters.
+
+    The beam center is rounded to `center_precision` pixels, so that datasets with (nearly) the same
+    beam center share their tables. At the default of 0.1 pixel, the largest difference in the
+    correction is far below the 1/100 pixel resolution of the tables for typical stretch amplitudes.
+
+    The tables are stored in `drc` (default: `cache/correction_tables` in the instamatic directory)
+    and are symlinked into the dataset directory if possible, otherwise they are copied.
+    """
+    def __init__(self, drc=None, center_precision: float=0.1):
+        super().__init__()
+        if drc is None:
+            from instamatic import config
+            drc = config.base_drc / "cache" / "correction_tables"
+        self.drc = Path(drc)
+        self.center_precision = center_precision
+        self.lock = threading.Lock()
+
+    def key(self, shape: tuple, center: tuple, azimuth: float, amplitude: float) -> (str, tuple):
+        """Returns the name of the cache entry and the rounded beam center"""
+        p = self.center_precision
+        center = tuple(round(c / p) * p for c in center)
+        name = f"{shape[0]}x{shape[1]}_center{center[0]:.2f}_{center[1]:.2f}_azimuth{azimuth:.3f}_amplitude{amplitude:.3f}"
+        return name, center
+
+    def get(self, shape: tuple, center: tuple, azimuth: float, amplitude: float) -> Path:
+        """Return the cache directory containing XCORR.cbf/YCORR.cbf, they are calculated if they do not exist yet"""
+        from instamatic.formats import write_cbf
+
+        name, center = self.key(shape, center, azimuth, amplitude)
+        drc = self.drc / name
+
+        with self.lock:
+            if (drc / XCORR).exists() and (drc / YCORR).exists():
+                logger.debug("Using cached geometric correction tables: %s", drc)
+                return drc
+
+            drc.mkdir(parents=True, exist_ok=True)
+            xcorr, ycorr = geometric_correction_tables(shape, center, azimuth, amplitude)
+
+            # write to a temporary file first, so that an interrupted write does not leave a broken entry
+            for fn, table in ((XCORR, xcorr), (YCORR, ycorr)):
+                tmp = drc / f"{fn}.{os.getpid()}.tmp"
+                write_cbf(tmp, table)
+                os.replace(tmp, drc / fn)
+
+            logger.debug("Stored geometric correction tables: %s", drc)
+
+        return drc
+
+    def link(self, path, shape: tuple, center: tuple, azimuth: float, amplitude: float):
+        """Make XCORR.cbf/YCORR.cbf available in directory `path`"""
+        path = Path(path)
+        drc = self.get(shape, center, azimuth, amplitude)
+
+        for fn in (XCORR, YCORR):
+            src = drc / fn
+            dst = path / fn
+            if dst.exists() or dst.is_symlink():
+                dst.unlink()
+            try:
+                os.symlink(src, dst)
+            except (OSError, NotImplementedError):
+                # symlinks need extra privileges on Windows
+                shutil.copyfile(src, dst)
@@ -3,21 +3,20 @@
 import os
 import sys
 
-import matplotlib.pyplot as plt
 import numpy as np
-
-from scipy import ndimage
-
-from skimage import data
-from skimage import color
-from skimage import filters
-from skimage import morphology
-from skimage import segmentation
-from skimage import exposure
-from skimage import measure
 import json
 
-plt.rcParams['image.cmap'] = 'gray'
+from instamatic.utils.lazy_import import lazy_import
+
+# matplotlib, scipy and skimage are slow to import, load them when first used
+plt = lazy_import("matplotlib.pyplot")
+ndimage = lazy_import("scipy.ndimage")
+color = lazy_import("skimage.color")
+filters = lazy_import("skimage.filters")
+morphology = lazy_import("skimage.morphology")
+segmentation = lazy_import("skimage.segmentation")
+exposure = lazy_import("skimage.exposure")
+measure = lazy_import("skimage.measure")
 
 from instamatic.config import calibration
 from instamatic.tools import *
@@ -25,6 +24,8 @@ from instamatic.tools import *
 
 def plot_features(img, segmented):
     """Take image and plot segments on top of them"""
+    plt.rcParams['image.cmap'] = 'gray'
+
     labels, numlabels = ndimage.label(segmented)
     image_label_overlay = color.label2rgb(labels, image=img, bg_label=0)
 
@@ -52,6 +53,8 @@ def plot_props(img, props, fname=None, scale=1):
     """Take image and plot props on top of them"""
     from matplotlib.patches import Rectangle
 
+    plt.rcParams['image.cmap'] = 'gray'
+
     fig = plt.figure(figsize=(15, 10))
     ax = fig.add_subplot(111)
     plt.imshow(img, interpolation="none")
@@ -75,6 +75,30 @@ def apply_flatfield_correction(img, flatfield, darkfield=None):
     return ret
 
 
+def apply_flatfield_correction_inplace(img, flatfield):
+    """
+    Apply flatfield correction to image in place, keeping the dtype of the image
+    (rounded and clipped for integer images). Returns True if the correction was applied.
+
+    Avoids the float64 copy of `apply_flatfield_correction`, only a float32 copy of
+    a single frame is made."""
+
+    if flatfield.shape != img.shape:
+        msg = f"Flatfield not applied: image {img.shape} and flatfield {flatfield.shape} do not match shapes."
+        warnings.warn(msg)
+        return False
+
+    ret = img * (np.mean(flatfield) / flatfield).astype(np.float32)
+
+    if np.issubdtype(img.dtype, np.integer):
+        info = np.iinfo(img.dtype)
+        np.rint(ret, out=ret)
+        np.clip(ret, info.min, info.max, out=ret)
+
+    img[...] = ret
+    return True
+
+
 def collect_flatfield(ctrl=None, frames=100, save_images=False, collect_darkfield=True, drc=".", **kwargs):
     """Routine to collect flatfield correction files.
     
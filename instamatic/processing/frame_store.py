@@ -0,0 +1,172 @@
+import os
+import tempfile
+import weakref
+import numpy as np
+
+from instamatic import config
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# RAM budget in MB for the frames of a single experiment, frames beyond the budget are spilled to disk
+BUDGET = getattr(config.cfg, "frame_store_budget", 2048)
+
+# directory for the spill files, by default the system temp directory
+SPILL_DIRECTORY = getattr(config.cfg, "frame_store_directory", None)
+
+# number of frames that are allocated at once
+BLOCK_SIZE = 32
+
+
+def _remove_files(fns: list):
+    for fn in fns:
+        try:
+            os.remove(fn)
+        except OSError as e:
+            logger.warning("Could not remove spill file %s: %s", fn, e)
+
+
+class FrameStore(object):
+    """Memory-bounded store for the frames collected during an experiment.
+
+    Drop-in replacement for the list of `(index, image, header)` tuples that the
+    experiments collect and pass to `ImgConversion`. The images are copied into
+    preallocated blocks of frames in their native dtype. The blocks are held in memory
+    until `budget` (MB) is reached, further blocks are memory-mapped files in `directory`,
+    so that long data collections do not run out of memory.
+
+    Iterating over the store or indexing it returns `(index, image, header)`, where
+    `image` is a view into the block (in memory or on disk). The header is the dict that
+    was appended, so it can be updated in place. The spill files are removed on `close()`
+    or when the store is garbage collected.
+
+    Usage:
+        buffer = FrameStore()
+        buffer.append((i, img, h))
+        ...
+        img_conv = ImgConversion(buffer=buffer, ...)
+    """
+    def __init__(self, budget: float=None, directory: str=None, block_size: int=BLOCK_SIZE):
+        super().__init__()
+        self.budget = (BUDGET if budget is None else budget) * 1024**2
+        self.directory = directory or SPILL_DIRECTORY
+        self.block_size = block_size
+
+        self.shape = None
+        self.dtype = None
+
+        self._blocks = []
+        self._frames = []   # (index, block number, position in block, header)
+        self._free = 0
+        self._nbytes_ram = 0
+        self._nbytes_disk = 0
+        self._filenames = []
+        weakref.finalize(self, _remove_files, self._filenames)
+
+    def __repr__(self):
+        return (f"FrameStore(frames={len(self)}, shape={self.shape}, dtype={self.dtype}, "
+                f"ram={self.nbytes_ram / 1024**2:.0f} MB, disk={self.nbytes_disk / 1024**2:.0f} MB)")
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __iter__(self):
+        for n in range(len(self._frames)):
+            yield self[n]
+
+    def __getitem__(self, n: int) -> tuple:
+        i, block, position, h = self._frames[n]
+        return i, self._blocks[block][position], h
+
+    @property
+    def frame_nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def nbytes_ram(self) -> int:
+        """Memory allocated for frames in RAM (bytes)"""
+        return self._nbytes_ram
+
+    @property
+    def nbytes_disk(self) -> int:
+        """Size of the spill files (bytes)"""
+        return self._nbytes_disk
+
+    @property
+    def spilled(self) -> bool:
+        """True if frames have been spilled to disk"""
+        return self._nbytes_disk > 0
+
+    @property
+    def indices(self) -> list:
+        return [i for i, block, position, h in self._frames]
+
+    @property
+    def headers(self) -> dict:
+        return {i: h for i, block, position, h in self._frames}
+
+    def _new_block(self):
+        shape = (self.block_size, *self.shape)
+        nbytes = self.block_size * self.frame_nbytes
+
+        if self._nbytes_ram + nbytes <= self.budget:
+            block = np.empty(shape, dtype=self.dtype)
+            self._nbytes_ram += nbytes
+        else:
+            if not self.spilled:
+                logger.info("Frame store exceeds the memory budget (%.0f MB), spilling frames to disk", self.budget / 1024**2)
+            fd, fn = tempfile.mkstemp(prefix="instamatic_frames_", suffix=".dat", dir=self.directory)
+            os.close(fd)
+            self._filenames.append(fn)
+            block = np.memmap(fn, dtype=self.dtype, mode="w+", shape=shape)
+            self._nbytes_disk += nbytes
+
+        self._blocks.append(block)
+        self._free = 0
+
+    def append(self, item: tuple):
+        """Add frame `(index, image, header)`, the image is copied into the store"""
+        i, img, h = item
+        img = np.asarray(img)
+
+        if self.shape is None:
+            self.shape = img.shape
+            self.dtype = img.dtype
+        elif img.shape != self.shape:
+            raise ValueError(f"Frame {i} has shape {img.shape}, expected {self.shape}")
+
+        if not self._blocks or self._free == self.block_size:
+            self._new_block()
+
+        block = len(self._blocks) - 1
+        self._blocks[block][self._free] = img
+        self._frames.append((i, block, self._free, h))
+        self._free += 1
+
+    def pop(self, n: int=-1) -> tuple:
+        """Remove and return frame `n` as `(index, image, header)`.
+        The storage is only released when the store is closed."""
+        item = self[n]
+        del self._frames[n]
+        return item
+
+    def flush(self):
+        """Write the spilled frames to disk"""
+        for block in self._blocks:
+            if isinstance(block, np.memmap):
+                block.flush()
+
+    def close(self):
+        """Release the frames and remove the spill files"""
+        self._frames = []
+        self._blocks = []
+        self._nbytes_ram = self._nbytes_disk = 0
+        _remove_files(self._filenames)
+        self._filenames.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
@@ -0,0 +1,310 @@
+import os
+import glob
+import subprocess as sp
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Frames are rendered to 8-bit arrays with numpy (contrast, crop, resize, panels, markers),
+# without matplotlib, in a pool of worker processes. Every frame is described by a `spec`:
+#     {"out": "movie/00001.png",  # output file (optional for mp4)
+#      "height": 516,             # height of the panels in pixels (optional)
+#      "panels": [{"fn": "tiff/00001.tiff",      # source image
+#                  "crop": (150, 320, 150, 320), # y0, y1, x0, x1 (optional)
+#                  "vmin": 0, "vmax": None,      # contrast limits (optional)
+#                  "percentile": 99.5,           # used if vmax is None
+#                  "markers": [(y, x, radius)],  # red circles, in source pixel coordinates (optional)
+#                  "title": "..."}]}             # drawn with Pillow (optional)
+
+GAP = 4  # pixels between the panels
+MARKER_COLOR = (255, 0, 0)
+PERCENTILE_SAMPLES = 2**18  # the percentile is estimated from at most this many pixels
+
+
+class LazyStack(object):
+    """Reads images on first access and keeps the last `cache_size` in memory, so that an image
+    that appears in several frames (e.g. the overview image of a serialED movie) is read only once.
+
+    fns: list of filenames, the images can be accessed as `stack[i]` or `stack.read(fn)`
+    """
+    def __init__(self, fns=(), cache_size: int=16, reader=None):
+        super().__init__()
+        self.fns = list(fns)
+        self.cache_size = cache_size
+        self.reader = reader
+        self._cache = OrderedDict()
+        self.reads = 0
+
+    def __len__(self):
+        return len(self.fns)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.read(self.fns[i])
+
+    def read(self, fn) -> np.ndarray:
+        fn = str(fn)
+        img = self._cache.get(fn)
+        if img is not None:
+            self._cache.move_to_end(fn)
+            return img
+
+        if self.reader is None:
+            from instamatic.formats import read_image
+            self.reader = read_image
+        img, h = self.reader(fn)
+        self.reads += 1
+
+        self._cache[fn] = img
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return img
+
+
+def percentile(img: np.ndarray, q: float) -> float:
+    """`np.percentile` on a regular subsample of at most `PERCENTILE_SAMPLES` pixels"""
+    flat = img.ravel()
+    step = max(1, flat.size // PERCENTILE_SAMPLES)
+    return float(np.percentile(flat[::step], q))
+
+
+def to_uint8(img: np.ndarray, vmin: float=None, vmax: float=None, percentile_max: float=99.5) -> np.ndarray:
+    """Scale `img` linearly from [vmin, vmax] to [0, 255] (clipped), `vmax` defaults to the
+    `percentile_max` percentile of the image, `vmin` to the minimum"""
+    img = np.asarray(img)
+    if vmin is None:
+        vmin = float(img.min())
+    if vmax is None:
+        vmax = percentile(img, percentile_max)
+    scale = 255.0 / max(vmax - vmin, 1e-12)
+    out = (img.astype(np.float32) - vmin) * scale
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+def resize_nearest(img: np.ndarray, shape: tuple) -> np.ndarray:
+    """Nearest neighbour resize of the first two axes of `img` to `shape`"""
+    rows = (np.arange(shape[0]) * img.shape[0] // shape[0])
+    cols = (np.arange(shape[1]) * img.shape[1] // shape[1])
+    return img[rows[:, None], cols]
+
+
+def draw_markers(rgb: np.ndarray, markers, color: tuple=MARKER_COLOR, width: float=1.5):
+    """Draw circles (y, x, radius) on `rgb` (h, w, 3) in place, a radius <= 3 gives a filled dot"""
+    h, w = rgb.shape[:2]
+    for y, x, r in markers:
+        y0, y1 = int(max(0, y - r - width)), int(min(h, y + r + width + 1))
+        x0, x1 = int(max(0, x - r - width)), int(min(w, x + r + width + 1))
+        if y0 >= y1 or x0 >= x1:
+            continue
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        d = np.sqrt((yy - y)**2 + (xx - x)**2)
+        mask = d <= r if r <= 3 else np.abs(d - r) <= width / 2
+        rgb[y0:y1, x0:x1][mask] = color
+
+
+def draw_title(rgb: np.ndarray, title: str, color: tuple=(255, 255, 255)) -> np.ndarray:
+    """Draw `title` in the top left corner of `rgb` (needs Pillow)"""
+    from PIL import Image, ImageDraw
+    im = Image.fromarray(rgb)
+    draw = ImageDraw.Draw(im)
+    draw.rectangle(draw.textbbox((4, 2), title), fill=(0, 0, 0))
+    draw.text((4, 2), title, fill=color)
+    return np.asarray(im)
+
+
+def render_panel(img: np.ndarray, height: int=None, crop: tuple=None, vmin: float=None, vmax: float=None,
+                 percentile: float=99.5, markers=(), title: str=None) -> np.ndarray:
+    """Render a single image to an RGB uint8 array, see the description of the spec above"""
+    if crop:
+        y0, y1, x0, x1 = crop
+        img = img[y0:y1, x0:x1]
+        markers = [(y - y0, x - x0, r) for y, x, r in markers]
+
+    gray = to_uint8(img, vmin=vmin, vmax=vmax, percentile_max=percentile)
+
+    if height and height != gray.shape[0]:
+        zoom = height / gray.shape[0]
+        gray = resize_nearest(gray, (height, int(round(gray.shape[1] * zoom))))
+        markers = [(y * zoom, x * zoom, r) for y, x, r in markers]
+
+    rgb = np.repeat(gray[..., None], 3, axis=2)
+    if markers:
+        draw_markers(rgb, markers)
+    if title:
+        rgb = draw_title(rgb, title)
+    return rgb
+
+
+def compose(panels: list, gap: int=GAP) -> np.ndarray:
+    """Place the RGB `panels` side by side (top aligned), the size is rounded up to even numbers (for h264)"""
+    height = max(p.shape[0] for p in panels)
+    width = sum(p.shape[1] for p in panels) + gap * (len(panels) - 1)
+    out = np.zeros((height + height % 2, width + width % 2, 3), dtype=np.uint8)
+    x = 0
+    for p in panels:
+        out[:p.shape[0], x:x + p.shape[1]] = p
+        x += p.shape[1] + gap
+    return out
+
+
+# one stack per worker process, so that consecutive frames in a chunk share the cache
+_stack = LazyStack()
+
+
+def render_frame(spec: dict) -> np.ndarray:
+    """Render the frame described by `spec`, and write it to `spec["out"]` if given"""
+    height = spec.get("height")
+    panels = []
+    for panel in spec["panels"]:
+        panel = dict(panel)
+        img = _stack.read(panel.pop("fn"))
+        panels.append(render_panel(img, height=height, **panel))
+
+    frame = compose(panels)
+
+    out = spec.get("out")
+    if out:
+        from PIL import Image
+        Image.fromarray(frame).save(out)
+    return frame
+
+
+def _render_and_discard(spec: dict) -> str:
+    render_frame(spec)
+    return spec["out"]
+
+
+def _chunksize(n: int, workers: int) -> int:
+    # large contiguous chunks, so that the frames that share a source image land in the same worker
+    return max(1, n // (workers * 4))
+
+
+def render_png(specs: list, workers: int=None) -> list:
+    """Render the frames in `specs` to their `out` files (png) in a process pool"""
+    from concurrent.futures import ProcessPoolExecutor
+    from tqdm import tqdm
+
+    workers = workers or os.cpu_count()
+    for spec in specs:
+        Path(spec["out"]).parent.mkdir(parents=True, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(tqdm(pool.map(_render_and_discard, specs, chunksize=_chunksize(len(specs), workers)), total=len(specs)))
+
+
+def render_mp4(specs: list, out: str="movie.mp4", fps: float=20, workers: int=None, crf: int=20):
+    """Render the frames in `specs` in a process pool and pipe them to ffmpeg (must be on the path)"""
+    from concurrent.futures import ProcessPoolExecutor
+    from tqdm import tqdm
+
+    specs = [dict(spec, out=None) for spec in specs]
+    workers = workers or os.cpu_count()
+    p = None
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for frame in tqdm(pool.map(render_frame, specs, chunksize=_chunksize(len(specs), workers)), total=len(specs)):
+            if p is None:
+                height, width = frame.shape[:2]
+                cmd = ["ffmpeg", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s:v", f"{width}x{height}",
+                       "-r", str(fps), "-i", "-", "-c:v", "libx264", "-profile:v", "high", "-crf", str(crf),
+                       "-pix_fmt", "yuv420p", "-y", str(out)]
+                logger.info(" ".join(cmd))
+                p = sp.Popen(cmd, stdin=sp.PIPE)
+            p.stdin.write(frame.tobytes())
+
+    if p is not None:
+        p.stdin.close()
+        p.wait()
+    return out
+
+
+def interval_movie_specs(drc=".", interval: int=10, crop: tuple=(150, 320, 150, 320), out_drc="movie") -> list:
+    """Frames for a movie of a cRED experiment with image interval, the diffraction pattern
+    (`tiff/`) next to the cropped crystal image (`tiff_image/`) taken before it"""
+    drc = Path(drc)
+    fns_diff = sorted(glob.glob(str(drc / "tiff" / "*.tif*")))
+    fns_image = sorted(glob.glob(str(drc / "tiff_image" / "*.tif*")))
+
+    specs = []
+    for i, fn_diff in enumerate(fns_diff):
+        j = i // max(interval - 1, 1)
+        if j >= len(fns_image):
+            break
+        specs.append({"out": str(Path(out_drc) / f"{i:05d}.png"),
+                      "height": 516,
+                      "panels": [{"fn": fn_diff, "percentile": 99.0},
+                                 {"fn": fns_image[j], "crop": crop, "percentile": 99.5}]})
+    return specs
+
+
+def serialed_movie_specs(drc=".", vmax_diff: float=1500, titles: bool=True, out_drc="movie") -> list:
+    """Frames for a movie of a serialED experiment, every diffraction pattern (`data/`) next to
+    the image (`images/`) with the crystal positions, the current crystal is circled"""
+    from instamatic.formats import read_header
+
+    drc = Path(drc)
+    specs = []
+    for fn in sorted(glob.glob(str(drc / "images" / "image*.h5"))):
+        h = read_header(fn)
+        crystal_coords = np.array(h.get("exp_crystal_coords", ())).reshape(-1, 2)
+        dps = sorted(glob.glob(fn.replace("images", "data").replace(".h5", "_*.h5")))
+
+        for j, dp in enumerate(dps):
+            markers = [(x, y, 3) for x, y in crystal_coords]
+            if j < len(crystal_coords):
+                x, y = crystal_coords[j]
+                markers.append((x, y, 12))
+            specs.append({"out": str(Path(out_drc) / f"image_{len(specs):04d}.png"),
+                          "height": 516,
+                          "panels": [{"fn": fn, "percentile": 99.5, "markers": markers,
+                                      "title": Path(fn).name if titles else None},
+                                     {"fn": dp, "vmin": 0, "vmax": vmax_diff,
+                                      "title": Path(dp).name if titles else None}]})
+    return specs
+
+
+def main():
+    import argparse
+
+    description = "Render movies of cRED (with image interval) or serialED experiments. The frames are rendered with numpy in parallel and written as png files or piped to ffmpeg."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("kind", choices=("interval", "serialed"),
+                        help="`interval`: cRED data with image interval (tiff/, tiff_image/), `serialed`: serialED data (images/, data/)")
+    parser.add_argument("drc", nargs="?", default=".",
+                        help="Experiment directory (default: current directory)")
+    parser.add_argument("-o", "--out", default=None,
+                        help="Output mp4 file (requires ffmpeg), otherwise png files are written to `movie/`")
+    parser.add_argument("-r", "--fps", type=float, default=None,
+                        help="Frames per second of the mp4 (default: 20 for interval, 5 for serialed)")
+    parser.add_argument("-i", "--interval", type=int, default=10,
+                        help="Image interval of the cRED experiment (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: number of cpus)")
+    options = parser.parse_args()
+
+    out_drc = Path(options.drc) / "movie"
+    if options.kind == "interval":
+        specs = interval_movie_specs(options.drc, interval=options.interval, out_drc=out_drc)
+        fps = options.fps or 20
+    else:
+        specs = serialed_movie_specs(options.drc, out_drc=out_drc)
+        fps = options.fps or 5
+
+    if not specs:
+        parser.error(f"No frames found in {options.drc}")
+
+    print(f"Rendering {len(specs)} frames")
+    if options.out:
+        render_mp4(specs, out=options.out, fps=fps, workers=options.workers)
+        print(f"Movie written to {options.out}")
+    else:
+        render_png(specs, workers=options.workers)
+        print(f"Frames written to {out_drc}")
+
+
+if __name__ == '__main__':
+    main()
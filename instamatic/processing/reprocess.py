@@ -0,0 +1,520 @@
+"""Reprocess many cRED datasets in parallel.
+
+Every directory with a `cRED_log.txt` and a `tiff/` directory is a dataset. The
+experimental parameters are read from the log, the diffraction patterns from `tiff/`,
+and the data are converted with `ImgConversion` (SMV/MRC/TIFF + input files for
+XDS/DIALS/REDp/PETS), like `scripts/process_dm.py` and `scripts/process_tpx.py` do
+for a single dataset.
+
+The datasets are processed in a pool of processes. A dataset is only started when
+its estimated memory use fits in the memory budget, together with the datasets that
+are running already. After conversion, a manifest (`reprocess.json`) is written to the
+dataset directory with a fingerprint of the inputs (file names, sizes, modification
+times) and the options; datasets whose manifest matches are skipped the next time.
+
+Usage:
+    instamatic.reprocess data/ --workers 8 --memory 16
+"""
+import sys
+import json
+import time
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from instamatic import version
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+CREDLOG = "cRED_log.txt"
+MANIFEST = "reprocess.json"
+MANIFEST_VERSION = 1
+
+TIFF_PATTERNS = ("tiff/*.tif", "tiff/*.tiff")
+
+# module and class of the `ImgConversion` flavours
+CONVERSIONS = {
+    "tpx": ("instamatic.processing.ImgConversionTPX", "ImgConversionTPX"),
+    "dm": ("instamatic.processing.ImgConversionDM", "ImgConversionDM"),
+    "tvips": ("instamatic.processing.ImgConversionTVIPS", "ImgConversionTVIPS"),
+}
+
+# bytes per pixel of the float64 frames made by the flatfield correction and the rescaling of DM images
+FLOAT_ITEMSIZE = 8
+
+# temporary float64 copies of a frame per writer thread (conversion to the output dtype)
+WRITE_COPIES = 2
+
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def _numbers(value: str) -> list:
+    ret = []
+    for item in value.split():
+        try:
+            ret.append(float(item))
+        except ValueError:
+            pass
+    return ret
+
+
+def parse_credlog(fn) -> dict:
+    """Read the experimental parameters from `cRED_log.txt`.
+
+    Reads the logs written by instamatic (`Camera length: 300 mm`), and the logs
+    of the DigitalMicrograph script (`Camera length (mm): 300`). The returned values
+    are in the units expected by `ImgConversion`: pixelsize in px/Angstrom, physical
+    pixelsize in mm, wavelength in Angstrom and the rotation axis in radians."""
+    log = {}
+    dm = False
+
+    with open(fn, "r") as f:
+        for line in f:
+            key, sep, value = line.partition(":")
+            if not sep:
+                continue
+            key = key.strip()
+            numbers = _numbers(value)
+
+            if key == "Data Collection Time":
+                log["timestamp"] = value.strip()
+            elif key == "Camera":
+                log["camera"] = value.strip()
+
+            if not numbers:
+                continue
+
+            if key.startswith("Camera length"):
+                log["camera_length"] = numbers[0]
+            elif key.startswith("Oscillation angle"):
+                log["osc_angle"] = numbers[0]
+            elif key.startswith("Starting angle"):
+                log["start_angle"] = numbers[0]
+            elif key.startswith("Ending angle"):
+                log["end_angle"] = numbers[0]
+            elif key.startswith("Rotation axis"):
+                log["rotation_axis"] = numbers[0]
+            elif key.startswith("Acquisition time"):
+                log["acquisition_time"] = numbers[0]
+            elif key.startswith("Exposure Time"):
+                log["exposure_time"] = numbers[0]
+            elif key.startswith("Wavelength"):
+                log["wavelength"] = numbers[0]
+            elif key.startswith("High tension"):  # DM: kV
+                from instamatic.tools import relativistic_wavelength
+                log["wavelength"] = relativistic_wavelength(numbers[0] * 1000)
+                dm = True
+            elif key.startswith("Image pixelsize"):  # DM: 1/nm -> px/Angstrom
+                log["pixelsize"] = numbers[0] * 10
+                dm = True
+            elif key.startswith("Image physical pixelsize"):  # DM: um -> mm
+                log["physical_pixelsize"] = numbers[0] / 1000
+                dm = True
+            elif key.startswith("Pixelsize"):
+                log["pixelsize"] = numbers[0]
+            elif key.startswith("Physical pixelsize"):
+                log["physical_pixelsize"] = numbers[0]
+            # the labels of the stretch amplitude and azimuth are swapped in the cRED log
+            elif key.startswith("Stretch amplitude"):
+                log["stretch_azimuth"] = numbers[0]
+            elif key.startswith("Stretch azimuth"):
+                log["stretch_amplitude"] = numbers[0]
+
+    if dm:
+        # the DM script logs the rotation axis in degrees
+        log["rotation_axis"] = np.radians(log.get("rotation_axis", 0.0))
+    if "acquisition_time" not in log and "exposure_time" in log:
+        log["acquisition_time"] = log["exposure_time"] + 0.015
+
+    log["conversion"] = "dm" if dm else "tpx"
+    return log
+
+
+def image_number(fn) -> int:
+    """Return the frame number from file names like `00001.tiff` or `image_0001.tif`"""
+    return int(Path(fn).stem.split("_")[-1])
+
+
+class Dataset(object):
+    """A cRED dataset, the directory with `cRED_log.txt` and the `tiff/` directory"""
+    def __init__(self, credlog):
+        super().__init__()
+        self.credlog = Path(credlog)
+        self.drc = self.credlog.parent
+        self.error = None
+
+        image_fns = sorted({fn for pattern in TIFF_PATTERNS for fn in self.drc.glob(pattern)})
+        try:
+            image_fns.sort(key=image_number)
+        except ValueError:
+            self.error = "The frame number cannot be read from all file names in `tiff/`"
+        self.image_fns = image_fns
+
+    def __repr__(self):
+        return f"Dataset('{self.drc}', nframes={self.nframes})"
+
+    @property
+    def nframes(self) -> int:
+        return len(self.image_fns)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the input images on disk"""
+        return sum(fn.stat().st_size for fn in self.image_fns)
+
+    def frame_info(self) -> (int, np.dtype):
+        """Number of pixels and dtype of the frames, read from the header of the first image"""
+        from instamatic.formats import tifffile
+        fn = self.image_fns[0]
+        try:
+            with tifffile.TiffFile(str(fn)) as f:
+                page = f.pages[0]
+                return int(np.prod(page.shape)), np.dtype(page.dtype)
+        except Exception as e:
+            # assume 1 byte per pixel, which overestimates the memory use
+            logger.debug("Could not read the image header of %s: %s", fn, e)
+            return fn.stat().st_size, np.dtype(np.uint8)
+
+    def memory(self, options: dict) -> int:
+        """Estimated peak memory use in bytes when this dataset is converted with `options`.
+
+        ImgConversion keeps all frames in memory, as float64 if the flatfield correction
+        is applied or the images from the DM script are rescaled to the range of uint16,
+        otherwise in the dtype of the tiff files. Every writer thread makes temporary
+        float64 copies of the frame it is writing."""
+        pixels, dtype = self.frame_info()
+        conversion = options.get("conversion") or parse_credlog(self.credlog)["conversion"]
+        float64 = options.get("flatfield") or (conversion == "dm" and dtype != np.uint16)
+
+        itemsize = FLOAT_ITEMSIZE if float64 else dtype.itemsize
+        frames = self.nframes * pixels * itemsize
+        flatfield = pixels * FLOAT_ITEMSIZE if options.get("flatfield") else 0
+        writers = options.get("threads", 1) * WRITE_COPIES * pixels * FLOAT_ITEMSIZE
+        return frames + flatfield + writers
+
+    @property
+    def manifest_fn(self) -> Path:
+        return self.drc / MANIFEST
+
+    def fingerprint(self, content: bool=False) -> str:
+        """Hash of the inputs: the log and the file name, size and modification time
+        of every image. With `content=True`, the contents of the images are hashed instead
+        (slower, but independent of the file times, e.g. after copying the data)."""
+        sha = hashlib.sha1()
+        sha.update(self.credlog.read_bytes())
+        for fn in self.image_fns:
+            if content:
+                sha.update(fn.name.encode())
+                sha.update(fn.read_bytes())
+            else:
+                st = fn.stat()
+                sha.update(f"{fn.name} {st.st_size} {st.st_mtime_ns}\n".encode())
+        return sha.hexdigest()
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_fn, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_manifest(self, fingerprint: str, options: dict, result: dict):
+        manifest = {"version": MANIFEST_VERSION,
+                    "program": version.__long_title__,
+                    "fingerprint": fingerprint,
+                    "options": options,
+                    "outputs": outputs(options),
+                    "nframes": result["nframes"],
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(self.manifest_fn, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def is_up_to_date(self, fingerprint: str, options: dict) -> bool:
+        """The outputs exist and were made from the same inputs with the same options"""
+        manifest = self.read_manifest()
+        return (manifest.get("version") == MANIFEST_VERSION
+                and manifest.get("fingerprint") == fingerprint
+                and manifest.get("options") == options
+                and all((self.drc / drc).exists() for drc in manifest.get("outputs", ())))
+
+
+def find_datasets(paths) -> list:
+    """Find the datasets in `paths`, which may be `cRED_log.txt` files or directories
+    that are searched recursively"""
+    datasets = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            credlogs = sorted(path.glob(f"**/{CREDLOG}"))
+        else:
+            credlogs = [path]
+        datasets.extend(Dataset(credlog) for credlog in credlogs)
+    return datasets
+
+
+def outputs(options: dict) -> list:
+    """Output directories (relative to the dataset directory)"""
+    return [options[key] for key in ("tiff_path", "mrc_path", "smv_path") if options.get(key)]
+
+
+def get_conversion(name: str):
+    import importlib
+    module, cls = CONVERSIONS[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+def load_buffer(dataset: Dataset, log: dict, rescale: bool=False) -> list:
+    """Read the images of `dataset` into an `ImgConversion` buffer, the frames are numbered from 1"""
+    from instamatic.formats import read_tiff
+
+    offset = 1 - image_number(dataset.image_fns[0])
+    defaults = {"ImageGetTime": log.get("timestamp", 0), "ImageExposureTime": log.get("exposure_time", 0)}
+
+    buffer = []
+    for fn in dataset.image_fns:
+        img, h = read_tiff(fn)
+        if rescale and img.dtype != np.uint16:
+            # cast to the range of uint16
+            img = (2**16 - 1) * (img - img.min()) / (img.max() - img.min())
+        buffer.append((image_number(fn) + offset, img, {**defaults, **h}))
+    return buffer
+
+
+def convert(dataset: Dataset, options: dict) -> dict:
+    """Convert a single dataset with `ImgConversion`, runs in a worker process"""
+    import inspect
+
+    t0 = time.perf_counter()
+    log = parse_credlog(dataset.credlog)
+    name = options["conversion"] or log["conversion"]
+    ImgConversion = get_conversion(name)
+
+    buffer = load_buffer(dataset, log, rescale=(name == "dm"))
+    t1 = time.perf_counter()
+
+    kwargs = {"buffer": buffer, "flatfield": options["flatfield"], **log}
+    parameters = inspect.signature(ImgConversion).parameters
+    img_conv = ImgConversion(**{key: value for key, value in kwargs.items() if key in parameters})
+
+    if options.get("beamstop"):
+        try:
+            img_conv.add_beamstop()
+        except Exception as e:
+            logger.warning("Could not determine the beamstop for %s: %s", dataset.drc, e)
+
+    drc = dataset.drc
+    tiff_path, mrc_path, smv_path = (drc / options[key] if options[key] else None for key in ("tiff_path", "mrc_path", "smv_path"))
+
+    img_conv.threadpoolwriter(tiff_path=tiff_path,
+                              mrc_path=mrc_path,
+                              smv_path=smv_path,
+                              workers=options["threads"])
+
+    if mrc_path:
+        img_conv.write_ed3d(mrc_path)
+    if smv_path:
+        img_conv.write_xds_inp(smv_path)
+        if options["dials"]:
+            img_conv.to_dials(smv_path)
+    if options["pets"]:
+        img_conv.write_pets_inp(path=drc, tiff_path=options["tiff_path"] or "tiff")
+    img_conv.write_beam_centers(drc)
+
+    t2 = time.perf_counter()
+    return {"nframes": dataset.nframes, "conversion": name, "t_read": t1 - t0, "t_write": t2 - t1}
+
+
+def _process(dataset: Dataset, options: dict, fingerprint: str) -> dict:
+    """Worker: convert `dataset` and write the manifest, never raises"""
+    t0 = time.perf_counter()
+    try:
+        result = convert(dataset, options)
+        dataset.write_manifest(fingerprint, options, result)
+        result["status"] = DONE
+        result["message"] = ""
+    except Exception as e:
+        logger.exception("Reprocessing %s failed", dataset.drc)
+        result = {"status": FAILED, "message": f"{type(e).__name__}: {e}"}
+    result["time"] = time.perf_counter() - t0
+    return result
+
+
+def reprocess(datasets: list, options: dict, workers: int=None, memory: float=8.0,
+              force: bool=False, hash_content: bool=False, callback=None) -> list:
+    """Reprocess `datasets` in a pool of `workers` processes.
+
+    A dataset is started only when the estimated memory of the running datasets
+    stays below `memory` (GB); a dataset larger than the budget runs on its own.
+    Datasets that are up to date according to their manifest are skipped, unless `force`.
+
+    callback: called as `callback(dataset, result)` when a dataset has finished
+    Returns a list of (dataset, result) tuples in the order of `datasets`."""
+    budget = memory * 1024**3
+    results = {}
+    pending = []
+
+    estimates = {}  # dataset -> estimated memory use in bytes
+
+    for dataset in datasets:
+        if dataset.error:
+            results[dataset] = {"status": FAILED, "message": dataset.error, "time": 0.0}
+            continue
+        if dataset.nframes == 0:
+            results[dataset] = {"status": FAILED, "message": "No images in `tiff/`", "time": 0.0}
+            continue
+        fingerprint = dataset.fingerprint(content=hash_content)
+        if not force and dataset.is_up_to_date(fingerprint, options):
+            results[dataset] = {"status": SKIPPED, "message": "up to date", "nframes": dataset.nframes, "time": 0.0}
+            continue
+        try:
+            estimates[dataset] = dataset.memory(options)
+        except Exception as e:  # e.g. unreadable log
+            results[dataset] = {"status": FAILED, "message": f"{type(e).__name__}: {e}", "time": 0.0}
+            continue
+        pending.append((dataset, fingerprint))
+
+    for dataset, result in results.items():
+        if callback:
+            callback(dataset, result)
+
+    # largest datasets first, so that the small ones fill up the remaining budget at the end
+    pending.sort(key=lambda item: estimates[item[0]], reverse=True)
+
+    running = {}  # future -> dataset
+    in_use = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        max_workers = pool._max_workers
+        while pending or running:
+            for item in list(pending):
+                if len(running) >= max_workers:
+                    break
+                dataset, fingerprint = item
+                if running and in_use + estimates[dataset] > budget:
+                    continue
+                pending.remove(item)
+                in_use += estimates[dataset]
+                running[pool.submit(_process, dataset, options, fingerprint)] = dataset
+                logger.info("Started %s (%.0f MB)", dataset.drc, estimates[dataset] / 1024**2)
+
+            finished, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                dataset = running.pop(future)
+                in_use -= estimates[dataset]
+                try:
+                    result = future.result()
+                except Exception as e:  # e.g. the worker process died
+                    result = {"status": FAILED, "message": f"{type(e).__name__}: {e}", "time": 0.0}
+                results[dataset] = result
+                if callback:
+                    callback(dataset, result)
+
+    return [(dataset, results[dataset]) for dataset in datasets]
+
+
+def summary_table(results: list) -> str:
+    """Return a table with the status of every dataset"""
+    lines = [f"{'status':8s} {'frames':>6s} {'MB':>8s} {'time (s)':>9s} {'read (s)':>9s} {'write (s)':>9s}  dataset"]
+    for dataset, r in results:
+        mb = dataset.nbytes / 1024**2
+        lines.append(f"{r['status']:8s} {r.get('nframes', dataset.nframes):6d} {mb:8.1f} {r['time']:9.1f} "
+                     f"{r.get('t_read', 0):9.1f} {r.get('t_write', 0):9.1f}  {dataset.drc}"
+                     + (f"  ({r['message']})" if r["status"] == FAILED else ""))
+
+    counts = {status: sum(r["status"] == status for dataset, r in results) for status in (DONE, SKIPPED, FAILED)}
+    lines.append(f"\n{len(results)} datasets: {counts[DONE]} done, {counts[SKIPPED]} skipped, {counts[FAILED]} failed")
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    description = f"Reprocess cRED datasets in parallel. Every directory containing `{CREDLOG}` and a `tiff/` directory is a dataset; the data are converted with ImgConversion. Datasets that have not changed since the last run (see `{MANIFEST}` in the dataset directory) are skipped."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("paths", nargs="*", default=["."],
+                        help=f"Directories to search for datasets, or `{CREDLOG}` files (default: current directory)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of datasets to process in parallel (default: number of cpus)")
+    parser.add_argument("-m", "--memory", type=float, default=8.0,
+                        help="Memory budget in GB for the datasets that are processed at the same time (default: %(default)s)")
+    parser.add_argument("-t", "--threads", type=int, default=4,
+                        help="Number of writer threads per dataset (default: %(default)s)")
+    parser.add_argument("-c", "--conversion", choices=tuple(CONVERSIONS), default=None,
+                        help="ImgConversion flavour (default: `dm` for logs from the DM script, otherwise `tpx`)")
+    parser.add_argument("--smv", dest="smv_path", default="SMV_reprocessed",
+                        help="Output directory for SMV files + XDS.INP, empty to skip (default: %(default)s)")
+    parser.add_argument("--mrc", dest="mrc_path", default="",
+                        help="Output directory for MRC files + REDp input, empty to skip (default: skip)")
+    parser.add_argument("--tiff", dest="tiff_path", default="",
+                        help="Output directory for TIFF files, empty to skip (default: skip)")
+    parser.add_argument("--flatfield", default=None,
+                        help="Flatfield correction file (default: none)")
+    parser.add_argument("--dials", action="store_true",
+                        help="Write the files for DIALS")
+    parser.add_argument("--pets", action="store_true",
+                        help="Write the PETS input file")
+    parser.add_argument("--beamstop", action="store_true",
+                        help="Add the beamstop to the untrusted areas in XDS.INP (looked up per camera length, see `instamatic.utils.beamstop`)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Reprocess all datasets, also the ones that are up to date")
+    parser.add_argument("--hash", dest="hash_content", action="store_true",
+                        help="Compare the contents of the images instead of their modification times")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Only list the datasets and whether they are up to date")
+    parser.add_argument("-s", "--summary", default=None,
+                        help="Also write the summary table to this file")
+    options = parser.parse_args()
+
+    conversion_options = {"conversion": options.conversion,
+                          "smv_path": options.smv_path,
+                          "mrc_path": options.mrc_path,
+                          "tiff_path": options.tiff_path,
+                          "flatfield": options.flatfield,
+                          "dials": options.dials,
+                          "pets": options.pets,
+                          "beamstop": options.beamstop,
+                          "threads": options.threads}
+
+    datasets = find_datasets(options.paths)
+    if not datasets:
+        print(f"No datasets found (no `{CREDLOG}` in {', '.join(options.paths)})")
+        sys.exit(1)
+
+    total = sum(dataset.nbytes for dataset in datasets) / 1024**3
+    print(f"Found {len(datasets)} datasets ({total:.1f} GB)")
+
+    if options.dry_run:
+        for dataset in datasets:
+            if dataset.error:
+                print(f"{'error':10s} {dataset.nframes:6d}  {dataset.drc}  ({dataset.error})")
+                continue
+            up_to_date = dataset.is_up_to_date(dataset.fingerprint(content=options.hash_content), conversion_options)
+            print(f"{'up to date' if up_to_date else 'todo':10s} {dataset.nframes:6d}  {dataset.drc}")
+        return
+
+    def callback(dataset, result):
+        print(f"{result['status']:8s} {dataset.drc}  {result['time']:.1f} s  {result.get('message', '')}")
+
+    results = reprocess(datasets, conversion_options, workers=options.workers, memory=options.memory,
+                        force=options.force, hash_content=options.hash_content, callback=callback)
+
+    table = summary_table(results)
+    print()
+    print(table)
+
+    if options.summary:
+        with open(options.summary, "w") as f:
+            print(table, file=f)
+
+    if any(r["status"] == FAILED for dataset, r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
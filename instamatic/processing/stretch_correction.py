@@ -1,12 +1,15 @@
 import sys
+import functools
 
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Slider
-
-from skimage.feature import canny
-from skimage.measure import label, regionprops
-from scipy.ndimage import morphology, interpolation
+from instamatic.utils.lazy_import import lazy_import
+
+# matplotlib, skimage and scipy are slow to import, load them when first used
+plt = lazy_import("matplotlib.pyplot")
+feature = lazy_import("skimage.feature")
+measure = lazy_import("skimage.measure")
+ndimage = lazy_import("scipy.ndimage")
+sparse = lazy_import("scipy.sparse")
 import math
 
 from instamatic.formats import read_tiff
@@ -27,7 +30,7 @@ def apply_transform_to_image(img, transform, center=None):
     shift = center - displacement
     
     # order=1; linear interpolation, anything higher may introduce artifacts
-    img_tf = interpolation.affine_transform(img, transform, offset=shift, mode="constant", order=1, cval=0.0)
+    img_tf = ndimage.affine_transform(img, transform, offset=shift, mode="constant", order=1, cval=0.0)
     return img_tf
 
 
@@ -83,11 +86,111 @@ def apply_stretch_correction(z, center=None, azimuth: float=0, amplitude: float=
     returns:
         (N,N) ndarray
     """
-    azimuth_rad = np.radians(azimuth)    # go to radians
-    amplitude_pc = amplitude / (2*100)   # as percentage
-    tr_mat = affine_transform_ellipse_to_circle(azimuth_rad, amplitude_pc)
-    z = apply_transform_to_image(z, tr_mat, center=center)
-    return z
+    if center is not None:
+        center = tuple(float(c) for c in center)
+    corrector = get_stretch_corrector(z.shape, center, azimuth, amplitude)
+    return corrector.apply(z)
+
+
+@functools.lru_cache(maxsize=8)
+def get_stretch_corrector(shape: tuple, center: tuple=None, azimuth: float=0, amplitude: float=0):
+    """Return a (cached) `StretchCorrector` for the given geometry"""
+    return StretchCorrector.from_stretch(shape, center, azimuth, amplitude)
+
+
+class StretchCorrector(object):
+    """Apply the same affine transformation to many images (e.g. stretch correction of a rotation dataset).
+
+    The inverse mapping and the bilinear interpolation weights are computed once for the
+    image shape and stored as a sparse matrix, after which every image is transformed with
+    a single sparse matrix-vector product.
+    The result is the same as `apply_transform_to_image` (`ndimage.affine_transform` with
+    order=1, mode='constant', cval=0), to within rounding.
+
+    Usage:
+        corrector = StretchCorrector.from_stretch(img.shape, center, azimuth, amplitude)
+        corrected = corrector.apply_stack(imgs, workers=4)
+    """
+    def __init__(self, shape: tuple, transform: np.ndarray, center=None):
+        super().__init__()
+        self.shape = tuple(shape)
+        transform = np.asarray(transform, dtype=float)
+
+        if center is None:
+            center = (np.array(shape)[::-1]-1)/2.0
+        center = np.asarray(center, dtype=float)
+        offset = center - np.dot(transform, center)
+
+        nx, ny = self.shape
+        ox = np.arange(nx, dtype=float)[:, None]
+        oy = np.arange(ny, dtype=float)[None, :]
+
+        # input coordinates for every output pixel
+        cx = (transform[0, 0] * ox + transform[0, 1] * oy + offset[0]).ravel()
+        cy = (transform[1, 0] * ox + transform[1, 1] * oy + offset[1]).ravel()
+
+        # no interpolation beyond the edges of the input (mode='constant')
+        valid = (cx >= 0) & (cx <= nx - 1) & (cy >= 0) & (cy <= ny - 1)
+        cx = cx[valid]
+        cy = cy[valid]
+
+        x0 = np.minimum(np.floor(cx), max(nx - 2, 0)).astype(np.intp)
+        y0 = np.minimum(np.floor(cy), max(ny - 2, 0)).astype(np.intp)
+        x1 = np.minimum(x0 + 1, nx - 1)
+        y1 = np.minimum(y0 + 1, ny - 1)
+        wx = cx - x0
+        wy = cy - y0
+
+        indices = np.stack([x0 * ny + y0, x0 * ny + y1, x1 * ny + y0, x1 * ny + y1])
+        weights = np.stack([(1 - wx) * (1 - wy), (1 - wx) * wy, wx * (1 - wy), wx * wy])
+        rows = np.broadcast_to(np.flatnonzero(valid), indices.shape)
+
+        # sparse (npixels x npixels) interpolation matrix, rows of pixels that map outside the input are empty
+        size = nx * ny
+        self.matrix = sparse.csr_matrix((weights.ravel(), (rows.ravel(), indices.ravel())), shape=(size, size))
+
+    @classmethod
+    def from_stretch(cls, shape: tuple, center=None, azimuth: float=0, amplitude: float=0):
+        """Same parameters as `apply_stretch_correction`"""
+        azimuth_rad = np.radians(azimuth)    # go to radians
+        amplitude_pc = amplitude / (2*100)   # as percentage
+        tr_mat = affine_transform_ellipse_to_circle(azimuth_rad, amplitude_pc)
+        return cls(shape, tr_mat, center=center)
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        return self.apply(img)
+
+    def apply(self, img: np.ndarray) -> np.ndarray:
+        """Transform a single image, the output has the same dtype as the input"""
+        if img.shape != self.shape:
+            raise ValueError(f"Image shape {img.shape} does not match the shape of the corrector {self.shape}")
+
+        values = self.matrix.dot(img.ravel())
+        if np.issubdtype(img.dtype, np.integer):
+            values = np.round(values)
+        return values.astype(img.dtype).reshape(self.shape)
+
+    def apply_stack(self, imgs, workers: int=None, chunksize: int=4) -> list:
+        """Transform all images in `imgs`. If `workers` is given, the images are
+        distributed over a pool of `workers` processes"""
+        if not workers:
+            return [self.apply(img) for img in imgs]
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as pool:
+            return list(pool.map(_apply_in_worker, imgs, chunksize=chunksize))
+
+
+_worker_corrector = None
+
+
+def _init_worker(corrector):
+    global _worker_corrector
+    _worker_corrector = corrector
+
+
+def _apply_in_worker(img):
+    return _worker_corrector.apply(img)
 
 
 def make_title(prop):
@@ -101,7 +204,9 @@ def make_title(prop):
 
 def get_sigma_interactive(img, sigma=20):
     """Interactive function to get the sigma threshold value for the edge detection"""
-    edges = canny(img, sigma=sigma, low_threshold=None, high_threshold=None)
+    from matplotlib.widgets import Slider
+
+    edges = feature.canny(img, sigma=sigma, low_threshold=None, high_threshold=None)
     
     fig, ax = plt.subplots()
     plt.subplots_adjust(bottom=0.25)
@@ -127,7 +232,7 @@ def get_sigma_interactive(img, sigma=20):
         fig.canvas.draw()
     
     def update_sigma(val):
-        edges = canny(img, sigma=slsigma.val, low_threshold=None, high_threshold=None)
+        edges = feature.canny(img, sigma=slsigma.val, low_threshold=None, high_threshold=None)
         im2.set_data(edges)
         try:
             prop = get_ring_props(edges)[0]
@@ -176,16 +281,16 @@ def plot_props(edges, props):
 def get_ring_props(edges):
     """Get the rings with low eccentricity from the edge structures"""
     # label edges
-    labeled = label(edges)
+    labeled = measure.label(edges)
     
     props = []
     for i in range(1, labeled.max()+1):
         obj = labeled == i
 
         # fill holes so that regionprops can calculate inertia tensor correctly
-        obj = morphology.binary_fill_holes(obj)
+        obj = ndimage.binary_fill_holes(obj)
         
-        props.extend(regionprops(obj.astype(int)))
+        props.extend(measure.regionprops(obj.astype(int)))
     
     # filter ugly/small props
     props = [prop for prop in props if (prop.eccentricity < 0.5 and prop.area > 10)]
@@ -214,7 +319,7 @@ def main_entry(sigma=None):
         sigma = get_sigma_interactive(img)
 
     # edge detection
-    edges = canny(img, sigma=sigma, low_threshold=None, high_threshold=None)
+    edges = feature.canny(img, sigma=sigma, low_threshold=None, high_threshold=None)
 
     # get regionprops
     props = get_ring_props(edges)
@@ -8,15 +8,10 @@ import logging
 import threading
 from pathlib import Path
 
-import pickle
+from instamatic.server.indexing_queue import JobQueue, handle
 
 
-try:
-    EXE = Path(sys.argv[1])
-except:
-    EXE = Path(config.cfg.dials_script)
-
-CWD = EXE.parent
+EXE = Path(config.cfg.dials_script)
 
 HOST = config.cfg.indexing_server_host
 PORT = config.cfg.indexing_server_port
@@ -28,69 +23,58 @@ def parse_dials_index_log(fn="dials.index.log"):
         print("Unit cell = ...")
 
 
-def run_dials_indexing(path):
-    cmd = [str(EXE), path]
+def run_dials_indexing(path, exe=EXE):
+    """Run the DIALS script `exe` on the given `path`.
+    Returns a message and the unit cell reported by DIALS (None if indexing failed)"""
+    exe = Path(exe)
+    cmd = [str(exe), str(path)]
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     fn = config.logs_drc / f"Dials_indexing_{date}.log"
     unitcelloutput = []
 
-    p = sp.Popen(cmd, cwd=CWD, stdout = sp.PIPE)
+    p = sp.Popen(cmd, cwd=exe.parent, stdout = sp.PIPE)
     for line in p.stdout:
         if b'Unit cell:' in line:
             print(line.decode('utf-8'))
             unitcelloutput = line
 
+    result = None
     if unitcelloutput:
+        unitcell = unitcelloutput.decode('utf-8').split("Unit cell:")[-1].strip()
+        result = {"unit_cell": unitcell}
         with open(fn, "a") as f:
             f.write(f"\nData Path: {path}\n")
-            f.write("{unitcelloutput[4:].decode('utf-8')}")
+            f.write(f"{unitcelloutput[4:].decode('utf-8')}")
             print(f"Indexing result written to dials indexing log file; path: {path}")
     
     p.wait()
 
     # parse_dials_index_log("dials.index.log")
-    msg = "DIALS indexing completed"
+    if result:
+        msg = f"{path}: DIALS indexing completed, unit cell: {result['unit_cell']}"
+    else:
+        msg = f"{path}: DIALS indexing completed but no cell reported..."
 
     now = datetime.datetime.now().strftime("%H:%M:%S.%f")
     print(f"{now} | DIALS indexing has finished")
 
-    return msg
-
-
-def handle(conn):
-    """Handle incoming connection."""
-    ret = 0
-
-    while True:
-        data = conn.recv(BUFF).decode()
-        now = datetime.datetime.now().strftime("%H:%M:%S.%f")
-
-        if not data:
-            break
-    
-        print(f"{now} | {data}")
-        if data == "close":
-            print(f"{now} | Closing connection")
-            break
-
-        elif data == "kill":
-            print(f"{now} | Killing server")
-            ret = 1
-            break
+    return msg, result
 
-        else:
-            conn.send(b"OK")
-            msg = run_dials_indexing(data)
-            conn.send(msg.encode())
 
-    conn.send(b"Connection closed")
-    conn.close()
-    print("Connection closed")
+def main():
+    import argparse
 
-    return ret
+    parser = argparse.ArgumentParser(description="Indexing server (DIALS), runs the DIALS script on the datasets it receives using a job queue.")
+    parser.add_argument("exe", nargs="?", default=EXE,
+                        help="DIALS script to run, called as `EXE PATH` (default: `%(default)s`)")
+    parser.add_argument("-w", "--workers", type=int, default=getattr(config.cfg, "indexing_server_workers", 2),
+                        help="Number of DIALS processes to run concurrently")
+    parser.add_argument("-d", "--db", default=None,
+                        help="SQLite database to store the indexing results in (default: logs directory)")
+    options = parser.parse_args()
 
+    exe = Path(options.exe)
 
-def main():
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     logfile = config.logs_drc / f"instamatic_indexing_server_{date}.log"
     logging.basicConfig(format="%(asctime)s | %(module)s:%(lineno)s | %(levelname)s | %(message)s", 
@@ -99,21 +83,25 @@ def main():
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
+    db = options.db if options.db else config.logs_drc / "instamatic_indexing_results.sqlite"
+    jobs = JobQueue(runner=lambda path: run_dials_indexing(path, exe=exe), workers=options.workers, db=db)
+
     s = socket(AF_INET, SOCK_STREAM)
     s.bind((HOST,PORT))
     s.listen(5)
 
     log.info(f"Indexing server (DIALS) listening on {HOST}:{PORT}")
-    log.info(f"Running command: {EXE}")
+    log.info(f"Running command: {exe}")
     print(f"Indexing server (DIALS) listening on {HOST}:{PORT}")
-    print(f"Running command: {EXE}")
+    print(f"Running command: {exe}")
+    print(f"Workers: {options.workers} | Results: {db}")
 
     with s:
         while True:
             conn, addr = s.accept()
             log.info('Connected by %s', addr)
             print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+            threading.Thread(target=handle, args=(conn, jobs)).start()
 
     
 if __name__ == '__main__':
@@ -0,0 +1,329 @@
+import datetime
+import itertools
+import json
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from instamatic.utils.xds_results import XDSResults
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+BUFF = 1024
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job(object):
+    """Indexing job for the dataset at `path`, lower `priority` values run first"""
+    def __init__(self, job_id: int, path: str, priority: int=0):
+        super().__init__()
+        self.id = job_id
+        self.path = str(path)
+        self.priority = priority
+        self.status = QUEUED
+        self.message = ""
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return f"Job(id={self.id}, path='{self.path}', priority={self.priority}, status='{self.status}')"
+
+    def summary(self) -> str:
+        """One line summary of the job"""
+        if self.finished:
+            runtime = f"{self.finished - self.started:.1f} s"
+        elif self.started:
+            runtime = f"{time.time() - self.started:.1f} s (running)"
+        else:
+            runtime = "-"
+        return f"{self.id: 5d} | {self.status:9s} | prio {self.priority: 3d} | {runtime:>18s} | {self.path}"
+
+
+class JobDatabase(XDSResults):
+    """Persist jobs and their results in the SQLite database of `XDSResults`.
+
+    The state of the jobs is stored in the `jobs` table. If a finished job has produced
+    `CORRECT.LP` (XDS), the parsed results go into the `correct_lp` table of `XDSResults`,
+    other results (e.g. the unit cell from DIALS) are stored with the job."""
+    def __init__(self, fn):
+        super().__init__(fn)
+        self.lock = threading.Lock()
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER,
+            path TEXT,
+            priority INTEGER,
+            status TEXT,
+            submitted REAL,
+            started REAL,
+            finished REAL,
+            message TEXT,
+            result TEXT,
+            correct_lp TEXT)""")
+        self.conn.commit()
+
+    def update_job(self, job):
+        """Write the current state of `job` to the database"""
+        result = correct_lp = None
+        if job.result is not None:
+            fn = Path(job.path) / "CORRECT.LP"
+            if job.status == DONE and fn.exists():
+                correct_lp = str(fn.resolve())
+            else:
+                result = json.dumps(job.result, default=str)
+
+        with self.lock:
+            if correct_lp:
+                self.store(correct_lp, job.result)
+            cur = self.conn.execute("UPDATE jobs SET priority=?, status=?, submitted=?, started=?, finished=?, message=?, result=?, correct_lp=? WHERE id=? AND path=?",
+                                    (job.priority, job.status, job.submitted, job.started, job.finished, job.message, result, correct_lp, job.id, job.path))
+            if cur.rowcount == 0:
+                self.conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (job.id, job.path, job.priority, job.status, job.submitted, job.started, job.finished, job.message, result, correct_lp))
+            self.conn.commit()
+
+    def results(self, path: str=None) -> list:
+        """Return finished jobs as a list of dicts, optionally only for `path`"""
+        query = """SELECT jobs.id, jobs.path, jobs.status, jobs.finished, jobs.message, jobs.result, correct_lp.data
+                   FROM jobs LEFT JOIN correct_lp ON jobs.correct_lp = correct_lp.fn
+                   WHERE jobs.status IN (?, ?)"""
+        args = [DONE, FAILED]
+        if path:
+            query += " AND jobs.path=?"
+            args.append(str(path))
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY jobs.finished", args).fetchall()
+        ret = []
+        for job_id, path, status, finished, message, result, data in rows:
+            if data:
+                result = pickle.loads(data)
+            elif result:
+                result = json.loads(result)
+            ret.append({"id": job_id, "path": path, "status": status, "finished": finished, "message": message, "result": result})
+        return ret
+
+    def last_id(self) -> int:
+        with self.lock:
+            (last,) = self.conn.execute("SELECT MAX(id) FROM jobs").fetchone()
+        return last or 0
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class JobQueue(object):
+    """Run indexing jobs on a pool of worker threads, each of which drives one indexing subprocess at a time.
+
+    runner: callable
+        Called as `runner(path)` in a worker thread, must return `(message, result)`,
+        where `result` is a json-serializable dict (or None) with the parsed results
+    workers: int
+        Number of jobs to run concurrently
+    db: str or Path
+        Path to the SQLite database to store the jobs/results in (optional)
+
+    Jobs are deduplicated by path: submitting a path that is already queued or running returns
+    the existing job (raising its priority if the new one is more urgent).
+    """
+    def __init__(self, runner, workers: int=2, db=None):
+        super().__init__()
+        self.runner = runner
+        self.db = JobDatabase(db) if db else None
+
+        self.jobs = {}
+        self.active = {}  # path -> job, for queued/running jobs
+        self.lock = threading.RLock()
+        self.q = queue.PriorityQueue()
+
+        start = self.db.last_id() + 1 if self.db is not None else 1
+        self.counter = itertools.count(start)
+        self.sequence = itertools.count()
+
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"indexing-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, path: str, priority: int=0) -> Job:
+        """Add the dataset at `path` to the queue, returns the `Job`"""
+        key = str(Path(path).resolve())
+        with self.lock:
+            job = self.active.get(key)
+            if job:
+                if job.status == QUEUED and priority < job.priority:
+                    job.priority = priority
+                    self.q.put((priority, next(self.sequence), job.id))
+                logger.info("Job %d already in queue for %s", job.id, key)
+                return job
+
+            job = Job(next(self.counter), key, priority=priority)
+            self.jobs[job.id] = job
+            self.active[key] = job
+            self.q.put((priority, next(self.sequence), job.id))
+
+        logger.info("Queued job %d: %s (priority %d)", job.id, key, priority)
+        self._store(job)
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancel a queued job, returns True if the job was cancelled"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            del self.active[job.path]
+        self._store(job)
+        return True
+
+    def status(self, job_id: int=None) -> str:
+        """Return the status of job `job_id`, or a table with all jobs"""
+        with self.lock:
+            if job_id is not None:
+                job = self.jobs.get(job_id)
+                return job.summary() if job else f"Unknown job: {job_id}"
+            return "\n".join(job.summary() for job in self.jobs.values()) or "No jobs"
+
+    def result(self, job_id: int) -> str:
+        """Return the result message of job `job_id`"""
+        job = self.jobs.get(job_id)
+        if not job:
+            return f"Unknown job: {job_id}"
+        elif job.status in (DONE, FAILED):
+            return job.message
+        else:
+            return f"Job {job_id} is {job.status}"
+
+    def join(self):
+        """Block until all queued jobs have been processed"""
+        self.q.join()
+
+    def _store(self, job):
+        if self.db is not None:
+            self.db.update_job(job)
+
+    def _worker(self):
+        while True:
+            priority, _, job_id = self.q.get()
+            try:
+                with self.lock:
+                    job = self.jobs[job_id]
+                    # stale entry after a priority change, or cancelled
+                    if job.status != QUEUED or job.priority != priority:
+                        continue
+                    job.status = RUNNING
+                    job.started = time.time()
+                self._store(job)
+
+                try:
+                    job.message, job.result = self.runner(job.path)
+                except Exception as e:
+                    logger.exception("Job %d failed", job.id)
+                    job.message = f"{job.path}: {e}"
+                    job.status = FAILED
+                else:
+                    job.status = DONE if job.result else FAILED
+                finally:
+                    job.finished = time.time()
+                    with self.lock:
+                        self.active.pop(job.path, None)
+
+                now = datetime.datetime.now().strftime("%H:%M:%S.%f")
+                print(f"{now} | Job {job.id} {job.status} ({job.finished - job.started:.1f} s): {job.path}")
+                self._store(job)
+            finally:
+                self.q.task_done()
+
+
+def parse_request(data: bytes) -> (str, dict):
+    """Parse an incoming request, returns the command and its arguments.
+
+    Supported requests:
+        `close`, `kill`
+        `status` / `status JOB_ID`
+        `result JOB_ID`
+        `cancel JOB_ID`
+        `PATH` / `submit PRIORITY PATH`
+        pickled dict with `path` (and optionally `priority`), as sent by autocRED
+    """
+    try:
+        text = data.decode()
+    except UnicodeDecodeError:
+        d = pickle.loads(data)
+        return "submit", {"path": str(d["path"]), "priority": int(d.get("priority", 0))}
+
+    text = text.strip()
+    cmd, _, arg = text.partition(" ")
+
+    if text in ("close", "kill", "status"):
+        return text, {}
+    elif cmd in ("status", "result", "cancel"):
+        return cmd, {"job_id": int(arg)}
+    elif cmd == "submit":
+        priority, _, path = arg.strip().partition(" ")
+        return "submit", {"path": path, "priority": int(priority)}
+    else:
+        return "submit", {"path": text, "priority": 0}
+
+
+def handle(conn, jobs: JobQueue):
+    """Handle incoming connection, jobs are added to `jobs` and the job ID is returned immediately"""
+    ret = 0
+
+    while True:
+        data = conn.recv(BUFF)
+        now = datetime.datetime.now().strftime("%H:%M:%S.%f")
+
+        if not data:
+            break
+
+        try:
+            cmd, kwargs = parse_request(data)
+        except Exception as e:
+            print(f"{now} | Invalid request: {e}")
+            conn.send(f"ERROR: invalid request ({e})".encode())
+            continue
+
+        print(f"{now} | {cmd} {kwargs if kwargs else ''}")
+
+        if cmd == "close":
+            print(f"{now} | Closing connection")
+            break
+
+        elif cmd == "kill":
+            print(f"{now} | Killing server")
+            ret = 1
+            break
+
+        elif cmd == "submit":
+            job = jobs.submit(**kwargs)
+            conn.send(f"OK | Job {job.id} {job.status}: {job.path}".encode())
+
+        elif cmd == "status":
+            conn.send(jobs.status(**kwargs).encode())
+
+        elif cmd == "result":
+            conn.send(jobs.result(**kwargs).encode())
+
+        elif cmd == "cancel":
+            cancelled = jobs.cancel(**kwargs)
+            conn.send(f"Job {kwargs['job_id']} {'cancelled' if cancelled else 'could not be cancelled'}".encode())
+
+    conn.send(b"Connection closed")
+    conn.close()
+    print("Connection closed")
+
+    return ret
@@ -1,3 +1,5 @@
+import os
+import shlex
 import subprocess as sp
 from socket import *
 import datetime
@@ -7,18 +9,25 @@ import logging
 import threading
 from pathlib import Path
 
+from instamatic.server.indexing_queue import JobQueue, handle
+
 HOST = config.cfg.indexing_server_host
 PORT = config.cfg.indexing_server_port
 BUFF = 1024
 
+# Uses WSL (Windows 10 only), can be replaced by any command that runs XDS in the current directory
+XDS_CMD = "bash -c xds_par 2>&1 >/dev/null"
+
 rlock = threading.RLock()
 
 
 def parse_xds(path):
-    """Parse the XDS output file `CORRECT.LP` and print a summary"""
+    """Parse the XDS output file `CORRECT.LP` and print a summary
+    Returns the summary message and the parsed results (None if indexing failed)"""
     from instamatic.utils.xds_parser import xds_parser
 
     fn = Path(path) / "CORRECT.LP"
+    result = None
     
     # rlock prevents messages getting mangled with 
     # simultaneous print statements from different threads
@@ -39,56 +48,39 @@ def parse_xds(path):
                 msg += p.integration_info()
                 msg += "\n"
                 print(msg)
+                result = p.d
 
-    return msg
+    return msg, result
 
-def run_xds_indexing(path):
-    """Call XDS on the given `path`. Uses WSL (Windows 10 only)."""
-    p = sp.Popen("bash -c xds_par 2>&1 >/dev/null", cwd=path)
+
+def run_xds_indexing(path, cmd=XDS_CMD):
+    """Call XDS on the given `path`. Uses WSL (Windows 10 only) by default.
+    Returns the summary message and parsed results from `CORRECT.LP`"""
+    if isinstance(cmd, str) and os.name != "nt":
+        cmd = shlex.split(cmd)
+    p = sp.Popen(cmd, cwd=path)
     p.wait()
 
-    msg = parse_xds(path)
+    msg, result = parse_xds(path)
 
     now = datetime.datetime.now().strftime("%H:%M:%S.%f")
     print(f"{now} | XDS indexing has finished")
 
-    return msg
-
-
-def handle(conn):
-    """Handle incoming connection."""
-    ret = 0
-
-    while True:
-        data = conn.recv(BUFF).decode()
-        now = datetime.datetime.now().strftime("%H:%M:%S.%f")
-
-        if not data:
-            break
-    
-        print(f"{now} | {data}")
-        if data == "close":
-            print(f"{now} | Closing connection")
-            break
-
-        elif data == "kill":
-            print(f"{now} | Killing server")
-            ret = 1
-            break
-
-        else:
-            conn.send(b"OK")
-            msg = run_xds_indexing(data)
-            conn.send(msg.encode())
+    return msg, result
 
-    conn.send(b"Connection closed")
-    conn.close()
-    print("Connection closed")
 
-    return ret
+def main():
+    import argparse
 
+    parser = argparse.ArgumentParser(description="Indexing server (XDS), runs XDS on the datasets it receives using a job queue.")
+    parser.add_argument("-w", "--workers", type=int, default=getattr(config.cfg, "indexing_server_workers", 2),
+                        help="Number of XDS processes to run concurrently")
+    parser.add_argument("-c", "--cmd", default=XDS_CMD,
+                        help="Command to run in the data directory (default: `%(default)s`)")
+    parser.add_argument("-d", "--db", default=None,
+                        help="SQLite database to store the indexing results in (default: logs directory)")
+    options = parser.parse_args()
 
-def main():
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     logfile = config.logs_drc / f"instamatic_indexing_server_{date}.log"
     logging.basicConfig(format="%(asctime)s | %(module)s:%(lineno)s | %(levelname)s | %(message)s", 
@@ -97,19 +89,23 @@ def main():
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
+    db = options.db if options.db else config.logs_drc / "instamatic_indexing_results.sqlite"
+    jobs = JobQueue(runner=lambda path: run_xds_indexing(path, cmd=options.cmd), workers=options.workers, db=db)
+
     s = socket(AF_INET, SOCK_STREAM)
     s.bind((HOST,PORT))
     s.listen(5)
 
     log.info(f"Indexing server (XDS) listening on {HOST}:{PORT}")
     print(f"Indexing server (XDS) listening on {HOST}:{PORT}")
+    print(f"Workers: {options.workers} | Results: {db}")
 
     with s:
         while True:
             conn, addr = s.accept()
             log.info('Connected by %s', addr)
             print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+            threading.Thread(target=handle, args=(conn, jobs)).start()
 
     
 if __name__ == '__main__':
@@ -2,9 +2,13 @@ from instamatic.formats import read_tiff, write_tiff
 import sys, os
 import numpy as np
 import glob
-from skimage import exposure
-from skimage.measure import regionprops
-from scipy import ndimage, interpolate
+from instamatic.utils.lazy_import import lazy_import
+
+# scipy and skimage are slow to import, load them when first used
+exposure = lazy_import("skimage.exposure")
+measure = lazy_import("skimage.measure")
+ndimage = lazy_import("scipy.ndimage")
+interpolate = lazy_import("scipy.interpolate")
 
 
 def to_xds_untrusted_area(kind: str, coords: list) -> str:
@@ -152,7 +156,7 @@ def find_beam_center_with_beamstop(img, z: int=None, method="thresh", plot=False
         seg = img > np.percentile(img, z)
         labeled, _ = ndimage.label(seg)
         
-        props = regionprops(labeled)
+        props = measure.regionprops(labeled)
         props.sort(key=lambda x: x.area, reverse=True)
         prop = props[0]
 
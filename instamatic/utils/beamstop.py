@@ -1,4 +1,7 @@
 import numpy as np
+import functools
+import threading
+import yaml
 
 from pathlib import Path
 
@@ -76,6 +79,21 @@ def minimum_bounding_rectangle(points):
     return rval
 
 
+@functools.lru_cache(maxsize=16)
+def radius_bins(shape: tuple, center: tuple) -> (np.ndarray, np.ndarray):
+    """Return the integer radius of every pixel (flattened) about `center` for an image
+    of `shape`, and the number of pixels in each radius bin. The result is cached,
+    because the shape and beam center are fixed for a whole dataset.
+
+    Do not modify the returned arrays."""
+    y, x = np.indices(shape)
+    r = np.sqrt((x - center[1])**2 + (y - center[0])**2).astype(np.intp).ravel()
+    nr = np.bincount(r)
+    r.flags.writeable = False
+    nr.flags.writeable = False
+    return r, nr
+
+
 def radial_average(z, center, as_radial_map=False):
     """Calculate the radial profile by azimuthal averaging about a specified
     center.
@@ -93,20 +111,50 @@ def radial_average(z, center, as_radial_map=False):
     radial_profile : array
         Radial profile of the diffraction pattern.
     """
-    y, x = np.indices(z.shape)
-    r = np.sqrt((x - center[1])**2 + (y - center[0])**2)
-    r = r.astype(np.int)
+    r, nr = radius_bins(z.shape, (float(center[0]), float(center[1])))
 
-    tbin = np.bincount(r.ravel(), z.ravel())
-    nr = np.bincount(r.ravel())
-    averaged = tbin / nr
+    tbin = np.bincount(r, z.ravel())
+    with np.errstate(invalid="ignore"):
+        averaged = tbin / nr
 
     if as_radial_map:
-        return averaged[r]
+        return averaged[r].reshape(z.shape)
     else:
         return averaged
 
 
+class RunningMean(object):
+    """Incrementally compute the mean of a stack of images, so that the stack
+    never has to be held in memory"""
+    def __init__(self):
+        super().__init__()
+        self.total = None
+        self.n = 0
+
+    def add(self, img: np.ndarray):
+        if self.total is None:
+            self.total = np.zeros(img.shape, dtype=np.float64)
+        self.total += img
+        self.n += 1
+
+    def update(self, imgs):
+        """Add all images from the iterable `imgs`"""
+        for img in imgs:
+            self.add(img)
+        return self
+
+    @property
+    def mean(self) -> np.ndarray:
+        if not self.n:
+            raise ValueError("No images have been added")
+        return self.total / self.n
+
+
+def mean_image(imgs) -> np.ndarray:
+    """Mean of the images in the iterable `imgs`, which may be a lazy generator"""
+    return RunningMean().update(imgs).mean
+
+
 def find_beamstop_rect(img, center=None, threshold=0.5, pad=1, minsize=500, savefig=False):
     """Find rectangle fitting the beamstop
     
@@ -148,14 +196,15 @@ def find_beamstop_rect(img, center=None, threshold=0.5, pad=1, minsize=500, save
 
     arr = find_contours(seg, 0.5)
 
-    if len(arr) > 1:
-        rects = [minimum_bounding_rectangle(a) for a in arr if len(a) > minsize]
-    
-        a = [np.mean(rect, axis=0) for rect in rects]
-        dists = [np.linalg.norm(b - center) for b in a]
-        i = np.argmin(dists)
-    
-        rect = rects[i]
+    rects = [minimum_bounding_rectangle(a) for a in arr if len(a) > minsize]
+    if not rects:
+        raise ValueError("Could not find the beamstop, no contours larger than `minsize`")
+
+    a = [np.mean(rect, axis=0) for rect in rects]
+    dists = [np.linalg.norm(b - center) for b in a]
+    i = np.argmin(dists)
+
+    rect = rects[i]
 
     ## This is not robust if there are other shaded areas
     # rect = sorted(arr, key=lambda x: len(x), reverse=True)[0]
@@ -192,23 +241,110 @@ def find_beamstop_rect(img, center=None, threshold=0.5, pad=1, minsize=500, save
     return rect
 
 
-if __name__ == '__main__':
-    drc = "."
-    fns = list(Path(drc).glob("raw/*.tif"))
+class BeamstopStore(object):
+    """Persist the beamstop rectangle for each camera/camera length configuration,
+    so that the untrusted areas only have to be determined once.
+
+    The rectangles are stored in `beamstop.yaml` in the instamatic logs directory by default."""
+    def __init__(self, fn=None):
+        super().__init__()
+        if fn is None:
+            from instamatic import config
+            fn = config.logs_drc / "beamstop.yaml"
+        self.fn = Path(fn)
+        self.lock = threading.Lock()
+        self._d = None
+
+    @staticmethod
+    def key(camera_length, shape: tuple, camera: str=None) -> str:
+        if camera is None:
+            from instamatic import config
+            camera = config.camera.name
+        return f"{camera}/{camera_length}/{shape[0]}x{shape[1]}"
+
+    @property
+    def d(self) -> dict:
+        if self._d is None:
+            if self.fn.exists():
+                with open(self.fn, "r") as f:
+                    self._d = yaml.load(f, Loader=yaml.Loader) or {}
+            else:
+                self._d = {}
+        return self._d
+
+    def get(self, camera_length, shape: tuple, camera: str=None) -> np.ndarray:
+        """Return the stored beamstop rectangle (4x2 array) or None"""
+        entry = self.d.get(self.key(camera_length, shape, camera=camera))
+        if entry is None:
+            return None
+        return np.array(entry["rect"])
+
+    def set(self, rect: np.ndarray, camera_length, shape: tuple, center=None, camera: str=None):
+        """Store the beamstop rectangle and write the file"""
+        entry = {"rect": np.asarray(rect).tolist()}
+        if center is not None:
+            entry["center"] = [float(c) for c in center]
+        with self.lock:
+            self.d[self.key(camera_length, shape, camera=camera)] = entry
+            self.fn.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.fn, "w") as f:
+                yaml.dump(self.d, f, default_flow_style=None)
+
+    def find(self, imgs, camera_length, center=None, camera: str=None, force: bool=False, **kwargs) -> np.ndarray:
+        """Return the beamstop rectangle for this configuration, it is only determined from
+        the mean of `imgs` (an iterable of images, consumed lazily) if nothing has been stored yet,
+        or if `force` is set. `kwargs` are passed to `find_beamstop_rect`."""
+        it = iter(imgs)
+        running = RunningMean()
+        try:
+            running.add(next(it))
+        except StopIteration:
+            raise ValueError("No images to determine the beamstop from")
+
+        shape = running.total.shape
+        rect = None if force else self.get(camera_length, shape, camera=camera)
+        if rect is not None:
+            return rect
+
+        img = running.update(it).mean
+        if center is None:
+            center = find_beam_center_with_beamstop(img, z=99)
+
+        rect = find_beamstop_rect(img, center=center, **kwargs)
+        self.set(rect, camera_length, shape, center=center, camera=camera)
+        return rect
+
+
+def main():
+    import argparse
+    from instamatic.tools import to_xds_untrusted_area
 
+    description = "Find the beamstop from the mean of a stack of TIFF images and print the XDS untrusted area."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("args", type=str, nargs="*", metavar="FILE",
+                        help="TIFF files to average (default: raw/*.tif)")
+    parser.add_argument("-c", "--camera_length", default=None,
+                        help="Store the result for this camera length, so it can be reused by `ImgConversion`")
+    parser.add_argument("-p", "--pad", type=int, default=1,
+                        help="Padding around the beamstop in pixels (default: %(default)s)")
+    options = parser.parse_args()
+
+    fns = options.args if options.args else list(Path(".").glob("raw/*.tif"))
     print(len(fns))
-    
-    imgs, hs = zip(*(read_tiff(fn) for fn in fns))
-    
-    stack_mean = np.mean(imgs, axis=0)
 
-    center = find_beam_center_with_beamstop(stack_mean, z=99)
+    imgs = (read_tiff(fn)[0] for fn in fns)
 
-    beamstop_rect = find_beamstop_rect(stack_mean, center, pad=1, plot=True)
-    
-    from instamatic.tools import to_xds_untrusted_area
+    if options.camera_length is not None:
+        beamstop_rect = BeamstopStore().find(imgs, options.camera_length, pad=options.pad, force=True, savefig=True)
+    else:
+        stack_mean = mean_image(imgs)
+        center = find_beam_center_with_beamstop(stack_mean, z=99)
+        beamstop_rect = find_beamstop_rect(stack_mean, center, pad=options.pad, savefig=True)
 
     xds_quad = to_xds_untrusted_area("quadrilateral", beamstop_rect)
 
     print(xds_quad)
 
+
+if __name__ == '__main__':
+    main()
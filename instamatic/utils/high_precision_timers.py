@@ -1,24 +1,32 @@
-from ctypes import wintypes
+import sys
+import time
 import ctypes
 import atexit
 
-winmm = ctypes.WinDLL('winmm')
+if sys.platform == "win32":
+    from ctypes import wintypes
+    winmm = ctypes.WinDLL('winmm')
+
+    class TIMECAPS(ctypes.Structure):
+        _fields_ = (('wPeriodMin', wintypes.UINT),
+                    ('wPeriodMax', wintypes.UINT))
+else:
+    winmm = None  # sleep resolution is already well below 1 ms on Linux/macOS
 
 ENABLED = False
 
-class TIMECAPS(ctypes.Structure):
-    _fields_ = (('wPeriodMin', wintypes.UINT),
-                ('wPeriodMax', wintypes.UINT))
+# time.sleep may overshoot by up to a timer period, the last part of a wait is spent spinning
+SPIN_TIME = 0.002  # s
 
 
 def enable(milliseconds: int=1) -> None:
     """Set up the system for increased timer precision, e.g. time.sleep().
     Will be reset to the default of 10 ms once the parent process is killed.
-    This effect is system-wide.
+    This effect is system-wide. Does nothing on other platforms than Windows.
 
     https://docs.microsoft.com/en-us/windows/desktop/api/timeapi/"""
     global ENABLED
-    if ENABLED:
+    if ENABLED or winmm is None:
         # print("High precision timers are already enabled")
         return
 
@@ -38,6 +46,23 @@ def enable(milliseconds: int=1) -> None:
     ENABLED = True
 
 
+def sleep_until(deadline: float, spin: float=SPIN_TIME) -> float:
+    """Sleep until `time.perf_counter()` reaches `deadline`. Sleeps until `spin` seconds
+    before the deadline, and spins for the rest. Returns the overshoot in seconds."""
+    remaining = deadline - time.perf_counter()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            return now - deadline
+
+
+def precise_sleep(seconds: float, spin: float=SPIN_TIME) -> float:
+    """Like `time.sleep`, but accurate to a few microseconds, see `sleep_until`"""
+    return sleep_until(time.perf_counter() + seconds, spin=spin)
+
+
 if __name__ == '__main__':
     import timeit
 
@@ -51,3 +76,8 @@ if __name__ == '__main__':
     setup = 'import time'
     stmt = 'time.sleep(0.001)'
     print(timeit.timeit(stmt, setup, number=1000))
+
+    print("precise_sleep")
+    setup = 'from instamatic.utils.high_precision_timers import precise_sleep'
+    stmt = 'precise_sleep(0.001)'
+    print(timeit.timeit(stmt, setup, number=1000))
@@ -0,0 +1,115 @@
+"""Measure the import time of the instamatic entry points, and check that
+they do not pull in the heavy dependencies at import.
+
+Usage:
+    python -m instamatic.utils.import_time            # table of import times
+    python -m instamatic.utils.import_time --check    # exit code 1 on a regression
+
+Every module is imported in a fresh interpreter with `python -X importtime`.
+"""
+import re
+import sys
+import json
+import subprocess as sp
+
+# modules behind the console scripts that should start quickly
+MODULES = (
+    "instamatic.camera.camera",
+    "instamatic.TEMController",
+    "instamatic.server.tem_server",
+    "instamatic.server.cam_server",
+    "instamatic.server.xds_server",
+    "instamatic.formats",
+    "instamatic.tools",
+    "instamatic.calibrate",
+    "instamatic.processing",
+    "instamatic.neural_network",
+)
+
+# dependencies that must only be imported when they are used, see `instamatic.utils.lazy_import`
+HEAVY_MODULES = ("pandas", "scipy", "skimage", "h5py", "tifffile", "matplotlib", "lmfit", "IPython")
+
+# default import time budget per module in ms (cumulative, as reported by `-X importtime`)
+BUDGET = 500
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str, python: str=sys.executable) -> dict:
+    """Import `module` in a fresh interpreter and return the cumulative import time (ms),
+    the import times of all the modules it imports, and the heavy modules that were loaded"""
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    p = sp.run([python, "-X", "importtime", "-c", code], stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"Cannot import {module}:\n{p.stderr[-2000:]}")
+
+    imports = {}
+    for line in p.stderr.splitlines():
+        m = _IMPORTTIME_LINE.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            imports[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+
+    return {"module": module,
+            "time": imports.get(module, (0, 0))[1],
+            "imports": imports,
+            "heavy": json.loads(p.stdout.strip().splitlines()[-1])}
+
+
+def check(results: list, budget: float=BUDGET) -> list:
+    """Return a list of problems: heavy modules imported, or import time over `budget` ms"""
+    problems = []
+    for r in results:
+        if r["heavy"]:
+            problems.append(f"{r['module']} imports {', '.join(r['heavy'])}")
+        if r["time"] > budget:
+            problems.append(f"{r['module']} takes {r['time']:.0f} ms to import (budget: {budget:.0f} ms)")
+    return problems
+
+
+def report(results: list, top: int=5):
+    """Print the import time of every module and its slowest imports"""
+    for r in results:
+        heavy = f"  heavy: {', '.join(r['heavy'])}" if r["heavy"] else ""
+        print(f"{r['module']:35s} {r['time']:8.1f} ms{heavy}")
+        if top:
+            slowest = sorted(((t_self, name) for name, (t_self, t_cum) in r["imports"].items()), reverse=True)[:top]
+            for t_self, name in slowest:
+                print(f"    {name:50s} {t_self:8.1f} ms")
+
+
+def main():
+    import argparse
+
+    description = "Measure the import time of instamatic modules (by default the modules behind the console scripts)."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("modules", nargs="*", default=MODULES,
+                        help="Modules to import (default: %(default)s)")
+    parser.add_argument("-c", "--check", action="store_true",
+                        help="Exit with status 1 if a module imports one of the heavy dependencies or is over budget")
+    parser.add_argument("-b", "--budget", type=float, default=BUDGET,
+                        help="Import time budget per module in ms for --check (default: %(default)s)")
+    parser.add_argument("-t", "--top", type=int, default=5,
+                        help="Number of slowest imports to show per module (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Import every module this many times, and keep the fastest (default: %(default)s)")
+    options = parser.parse_args()
+
+    results = []
+    for module in options.modules:
+        runs = [measure(module) for i in range(options.repeat)]
+        results.append(min(runs, key=lambda r: r["time"]))
+
+    report(results, top=options.top)
+
+    if options.check:
+        problems = check(results, budget=options.budget)
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        if problems:
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == '__main__':
+    main()
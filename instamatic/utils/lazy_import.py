@@ -0,0 +1,63 @@
+import sys
+import importlib
+import threading
+import warnings
+
+
+class LazyModule(object):
+    """Stand-in for a module that is imported on first attribute access.
+
+    Heavy dependencies (h5py, pandas, scipy, skimage, matplotlib, ...) take a large part
+    of the start-up time of the command line tools, even when they are not used.
+    Replace
+        import h5py
+    by
+        h5py = lazy_import("h5py")
+    and the import happens when `h5py.File` is first used.
+    """
+    def __init__(self, name: str, ignore_warnings: bool=False):
+        super().__init__()
+        self.__dict__["_name"] = name
+        self.__dict__["_ignore_warnings"] = ignore_warnings
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is not None:
+            return module
+
+        with self._lock:
+            module = self.__dict__["_module"]
+            if module is None:
+                with warnings.catch_warnings():
+                    if self._ignore_warnings:
+                        warnings.simplefilter("ignore")
+                    module = importlib.import_module(self._name)
+                self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__["_module"] is None:
+            return f"<lazy module '{self._name}' (not loaded)>"
+        return repr(self._module)
+
+
+def lazy_import(name: str, ignore_warnings: bool=False):
+    """Return module `name` if it has been imported already, otherwise a `LazyModule`
+    that imports it on first use.
+
+    ignore_warnings: suppress the warnings emitted during the import (e.g. FutureWarnings from h5py)"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name, ignore_warnings=ignore_warnings)
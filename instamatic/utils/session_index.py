@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from instamatic.formats import read_image, read_header
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_INDEX = "session_index.sqlite"
+
+# edge lengths of the thumbnail pyramid, every level is made from the previous one by 2x2 binning
+THUMBNAIL_SIZES = (256, 128, 64, 32)
+
+COLUMNS = (
+    ("fn", "TEXT PRIMARY KEY"),
+    ("size", "INTEGER"),
+    ("mtime", "REAL"),
+    ("x", "REAL"),
+    ("y", "REAL"),
+    ("ncrystals", "INTEGER"),
+    ("crystal_coords", "TEXT"),
+    ("stage_x", "REAL"),
+    ("stage_y", "REAL"),
+    ("dim_x", "REAL"),
+    ("dim_y", "REAL"),
+)
+
+
+def _tolist(value):
+    return np.asarray(value).tolist()
+
+
+def header_to_row(fn: str, h: dict) -> dict:
+    """Extract the stage map information from image header `h`"""
+    try:
+        dx, dy = h["exp_hole_offset"]
+        cx, cy = h["exp_hole_center"]
+    except KeyError:
+        dx, dy = h["exp_scan_offset"]
+        cx, cy = h["exp_scan_center"]
+
+    crystal_coords = _tolist(h.get("exp_crystal_coords", []))
+    stage_x, stage_y = h.get("exp_stage_position", (0, 0))
+    dim_x, dim_y = h.get("ImageDimensions", (0, 0))
+
+    st = os.stat(fn)
+    return {"fn": str(fn), "size": st.st_size, "mtime": st.st_mtime,
+            "x": float(cx + dx), "y": float(cy + dy),
+            "ncrystals": len(crystal_coords), "crystal_coords": json.dumps(crystal_coords),
+            "stage_x": float(stage_x), "stage_y": float(stage_y),
+            "dim_x": float(dim_x), "dim_y": float(dim_y)}
+
+
+def bin_image(img: np.ndarray, binsize: int) -> np.ndarray:
+    """Bin `img` by averaging blocks of `binsize` x `binsize` pixels, edges that do not fit are dropped"""
+    ny, nx = img.shape[0] // binsize, img.shape[1] // binsize
+    return img[:ny*binsize, :nx*binsize].reshape(ny, binsize, nx, binsize).mean(axis=(1, 3))
+
+
+def make_thumbnails(img: np.ndarray, sizes: tuple=THUMBNAIL_SIZES) -> list:
+    """Make the thumbnail pyramid for `img`, returns a list of uint8 arrays (one for every size).
+    The intensities are scaled between the 0.5 and 99.5 percentile of the first level."""
+    img = np.asarray(img, dtype=np.float32)
+    binsize = max(1, max(img.shape) // sizes[0])
+    thumb = bin_image(img, binsize) if binsize > 1 else img
+
+    lo, hi = np.percentile(thumb, (0.5, 99.5))
+    scale = 255 / (hi - lo) if hi > lo else 0
+    thumb = np.clip((thumb - lo) * scale, 0, 255)
+
+    thumbs = []
+    for size in sizes:
+        while max(thumb.shape) > size:
+            thumb = bin_image(thumb, 2)
+        thumbs.append(thumb.astype(np.uint8))
+    return thumbs
+
+
+def index_file(fn: str, thumbnails: bool=True) -> (dict, list):
+    """Read the header (and image if `thumbnails` is set) of `fn` for the index.
+    Runs in a worker process, so it must be a module-level function."""
+    if thumbnails:
+        img, h = read_image(fn)
+        thumbs = make_thumbnails(img)
+    else:
+        h = read_header(fn)
+        thumbs = None
+    return header_to_row(fn, h), thumbs
+
+
+class SessionIndex(object):
+    """Index of the images in a serialED session, stored in an SQLite database.
+
+    Holds the metadata needed to draw the stage map (read from the image headers only)
+    and a pyramid of uint8 thumbnails for every image, so that the browser can show the
+    stage map without reading all images. Entries are only updated if the size or
+    modification time of the image has changed.
+
+    The index can be filled during acquisition (`add`), or afterwards (`update`).
+
+    Usage:
+        index = SessionIndex.for_images(fns)
+        index.update(fns, thumbnails=True)
+        coords, ncrystals = index.stage_coords(fns)
+        thumbs = index.thumbnails(fns, size=64)
+    """
+    def __init__(self, fn=DEFAULT_INDEX):
+        super().__init__()
+        self.fn = Path(fn)
+        self.conn = sqlite3.connect(str(self.fn))
+        self.conn.row_factory = sqlite3.Row
+        cols = ", ".join(f"{name} {kind}" for name, kind in COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS images ({cols})")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS thumbnails (fn TEXT, size INTEGER, shape_x INTEGER, shape_y INTEGER, data BLOB, PRIMARY KEY (fn, size))")
+        self.conn.commit()
+
+    @classmethod
+    def for_images(cls, fns: list):
+        """Return the index for the images in `fns`, stored next to the directory containing the images
+        (i.e. in the experiment directory for `images/image_0000.h5`)"""
+        drc = Path(fns[0]).absolute().parents[1]
+        return cls(drc / DEFAULT_INDEX)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def stale(self, fns: list, thumbnails: bool=False) -> list:
+        """Return the files from `fns` that are not in the index, or have changed since.
+        If `thumbnails` is set, files without thumbnails are also returned."""
+        known = {row["fn"]: (row["size"], row["mtime"]) for row in self.conn.execute("SELECT fn, size, mtime FROM images")}
+        if thumbnails:
+            have_thumbs = {row["fn"] for row in self.conn.execute("SELECT DISTINCT fn FROM thumbnails")}
+        ret = []
+        for fn in fns:
+            fn = str(fn)
+            try:
+                st = os.stat(fn)
+            except FileNotFoundError:
+                continue
+            if known.get(fn) != (st.st_size, st.st_mtime) or (thumbnails and fn not in have_thumbs):
+                ret.append(fn)
+        return ret
+
+    def add(self, fn, img: np.ndarray=None, header: dict=None, commit: bool=True):
+        """Add a single image to the index, i.e. directly after it has been written during acquisition.
+        If `img`/`header` are not given, they are read from `fn`."""
+        fn = str(Path(fn).absolute())
+        if header is None:
+            header = read_header(fn)
+        row = header_to_row(fn, header)
+        thumbs = make_thumbnails(img) if img is not None else None
+        self._insert(((row, thumbs), ), commit=commit)
+
+    def update(self, fns: list, thumbnails: bool=False, workers: int=None, chunksize: int=16) -> int:
+        """Index the files in `fns` that are new or have changed. Only the headers are read,
+        unless `thumbnails` is set. Indexing is done in parallel using `workers` processes
+        (default: number of cpus), set `workers=0` to index in the current process.
+        Returns the number of indexed files."""
+        fns = self.stale((Path(fn).absolute() for fn in fns), thumbnails=thumbnails)
+        if not fns:
+            return 0
+
+        t0 = time.perf_counter()
+
+        if workers == 0 or len(fns) < 2*chunksize:
+            self._insert(index_file(fn, thumbnails) for fn in fns)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                self._insert(pool.map(index_file, fns, [thumbnails]*len(fns), chunksize=chunksize))
+
+        logger.info("Indexed %d files into %s (%.1f s)", len(fns), self.fn, time.perf_counter() - t0)
+        return len(fns)
+
+    def _insert(self, results, commit: bool=True):
+        names = [name for name, _ in COLUMNS]
+        query = f"INSERT OR REPLACE INTO images ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+        for row, thumbs in results:
+            self.conn.execute(query, [row.get(name) for name in names])
+            if thumbs is None:
+                # the image may have changed, so the old thumbnails are no longer valid
+                self.conn.execute("DELETE FROM thumbnails WHERE fn=?", (row["fn"], ))
+            else:
+                self.conn.executemany("INSERT OR REPLACE INTO thumbnails (fn, size, shape_x, shape_y, data) VALUES (?, ?, ?, ?, ?)",
+                                      ((row["fn"], size, thumb.shape[0], thumb.shape[1], thumb.tobytes()) for size, thumb in zip(THUMBNAIL_SIZES, thumbs)))
+        if commit:
+            self.conn.commit()
+
+    def _rows(self, fns: list, query: str, args: tuple=()) -> list:
+        fns = [str(Path(fn).absolute()) for fn in fns]
+        rows = {}
+        # SQLite limits the number of parameters per query
+        for i in range(0, len(fns), 500):
+            chunk = fns[i:i+500]
+            q = query.format(", ".join("?" for _ in chunk))
+            for row in self.conn.execute(q, (*chunk, *args)):
+                rows[row["fn"]] = row
+        return [rows.get(fn) for fn in fns]
+
+    def records(self, fns: list) -> list:
+        """Return the index entries (`sqlite3.Row`) for `fns`, None for files that are not indexed"""
+        return self._rows(fns, "SELECT * FROM images WHERE fn IN ({})")
+
+    def stage_coords(self, fns: list) -> (np.ndarray, np.ndarray):
+        """Return the stage coordinates (in micrometer) and number of crystals for `fns`"""
+        rows = self.records(fns)
+        coords = np.array([(row["x"], row["y"]) for row in rows]) / 1000
+        ncrystals = np.array([row["ncrystals"] for row in rows])
+        return coords, ncrystals
+
+    def crystal_coords(self, fn) -> np.ndarray:
+        """Return the crystal coordinates (in pixels) found in image `fn`"""
+        row, = self.records([fn])
+        return np.array(json.loads(row["crystal_coords"]))
+
+    def thumbnails(self, fns: list, size: int=64) -> list:
+        """Return the thumbnails (uint8) of the given `size` for `fns`, None if it is not available"""
+        rows = self._rows(fns, "SELECT * FROM thumbnails WHERE fn IN ({}) AND size=?", (size, ))
+        return [np.frombuffer(row["data"], dtype=np.uint8).reshape(row["shape_x"], row["shape_y"]) if row else None for row in rows]
+
+
+def mosaic(coords: np.ndarray, thumbs: list, dims: tuple, max_size: int=4096) -> (np.ndarray, list):
+    """Paste `thumbs` at `coords` into a single image, so that the stage map can be drawn
+    with a single `imshow` instead of one call per image.
+
+    coords: (n, 2) array with the image centers (in micrometer)
+    thumbs: list of uint8 thumbnails (None is skipped)
+    dims: (x, y) size of an image in micrometer
+    max_size: maximum size of the mosaic in pixels along either axis
+
+    Returns the mosaic (uint8, 0 where there is no image) and the extent for `imshow`
+    """
+    half_x, half_y = np.array(dims) / 2
+    xmin, ymin = coords.min(axis=0) - (half_x, half_y)
+    xmax, ymax = coords.max(axis=0) + (half_x, half_y)
+
+    shape = next((thumb.shape for thumb in thumbs if thumb is not None), (1, 1))
+    scale = min(shape[1] / (2*half_x), shape[0] / (2*half_y))   # pixels per micrometer
+    scale = min(scale, max_size / (xmax - xmin), max_size / (ymax - ymin))
+
+    out = np.zeros((int(np.ceil((ymax - ymin) * scale)), int(np.ceil((xmax - xmin) * scale))), dtype=np.uint8)
+    tx, ty = int(round(2*half_x*scale)), int(round(2*half_y*scale))
+
+    for (x, y), thumb in zip(coords, thumbs):
+        if thumb is None:
+            continue
+        # nearest neighbour resampling to the size in the mosaic
+        thumb = thumb[np.linspace(0, thumb.shape[0] - 1, ty).astype(int)][:, np.linspace(0, thumb.shape[1] - 1, tx).astype(int)]
+        # the first row of the mosaic is at ymax (imshow: origin='upper')
+        i = int(round((ymax - (y + half_y)) * scale))
+        j = int(round((x - half_x - xmin) * scale))
+        view = out[i:i+ty, j:j+tx]
+        view[:] = thumb[:view.shape[0], :view.shape[1]]
+
+    return out, [xmin, xmax, ymin, ymax]
+
+
+def main():
+    import argparse
+
+    description = "Index the images of a serialED session (stage coordinates, crystal coordinates and thumbnails) for `instamatic.browser`. Only new or changed files are indexed."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("args", type=str, nargs="?", metavar="PATTERN", default="images/*.h5",
+                        help="File pattern to the images (default: %(default)s)")
+    parser.add_argument("-i", "--index", default=None,
+                        help=f"Index file (default: {DEFAULT_INDEX} next to the image directory)")
+    parser.add_argument("-n", "--no-thumbnails", action="store_false", dest="thumbnails",
+                        help="Only index the headers, do not make thumbnails")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of processes to index with (default: number of cpus)")
+    options = parser.parse_args()
+
+    import glob
+    fns = sorted(glob.glob(options.args))
+    if not fns:
+        parser.error(f"No files matching: {options.args}")
+
+    index = SessionIndex(options.index) if options.index else SessionIndex.for_images(fns)
+    n = index.update(fns, thumbnails=options.thumbnails, workers=options.workers)
+    print(f"Found {len(fns)} files, indexed {n} new/changed -> {index.fn}")
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,15 @@ class xds_parser(object):
         self.filename = Path(filename).resolve()
         self.d = self.parse()
 
+    @classmethod
+    def from_dict(cls, d, filename):
+        """Restore parser from previously parsed data `d` (see `xds_parser.d`) without reading the file"""
+        p = cls.__new__(cls)
+        p.ios_threshold = 0.8
+        p.filename = Path(filename)
+        p.d = d
+        return p
+
     def parse(self):
         ios_threshold = self.ios_threshold
 
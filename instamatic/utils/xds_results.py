@@ -0,0 +1,273 @@
+import sys
+import os
+import time
+import pickle
+import sqlite3
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from instamatic.utils.xds_parser import xds_parser, parse_fns
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DB = "xds_results.sqlite"
+
+COLUMNS = (
+    ("fn", "TEXT PRIMARY KEY"),
+    ("size", "INTEGER"),
+    ("mtime", "REAL"),
+    ("parsed", "REAL"),
+    ("ok", "INTEGER"),
+    ("spgr", "INTEGER"),
+    ("a", "REAL"), ("b", "REAL"), ("c", "REAL"),
+    ("al", "REAL"), ("be", "REAL"), ("ga", "REAL"),
+    ("volume", "REAL"),
+    ("raw_volume", "REAL"),
+    ("ISa", "REAL"),
+    ("Boverall", "REAL"),
+    ("dmax", "REAL"),
+    ("dmin", "REAL"),
+    ("ntot", "INTEGER"),
+    ("nuniq", "INTEGER"),
+    ("completeness", "REAL"),
+    ("ios", "REAL"),
+    ("rmeas", "REAL"),
+    ("cchalf", "REAL"),
+    ("data", "BLOB"),
+)
+
+
+def parse_correct_lp(fn: str) -> dict:
+    """Parse `CORRECT.LP` at `fn`, returns the row to store in the database.
+    Runs in a worker process, so it must be a module-level function."""
+    try:
+        d = xds_parser(fn).d
+    except (UnboundLocalError, ValueError, IndexError, StopIteration):
+        d = None
+
+    return correct_lp_row(fn, d)
+
+
+def correct_lp_row(fn: str, d: dict=None) -> dict:
+    """Return the row to store in the database for `CORRECT.LP` at `fn`,
+    `d` is the parsed file (`xds_parser.d`), or None if it could not be parsed"""
+    fn = Path(fn)
+    st = fn.stat()
+    row = {"fn": str(fn), "size": st.st_size, "mtime": st.st_mtime, "parsed": time.time(), "ok": 0}
+
+    if not d:
+        return row
+
+    total = d["total"]
+    dmax, dmin = d["res_range"]
+    row.update(ok=1, spgr=d["spgr"], volume=d["volume"], raw_volume=d["raw_volume"],
+               ISa=d["ISa"], Boverall=d["Boverall"], dmax=dmax, dmin=dmin,
+               ntot=total["ntot"], nuniq=total["nuniq"], completeness=total["completeness"],
+               ios=total["ios"], rmeas=total["rmeas"], cchalf=total["cchalf"],
+               data=pickle.dumps(d))
+    row.update(zip(("a", "b", "c", "al", "be", "ga"), d["cell"]))
+    return row
+
+
+class XDSResults(object):
+    """Incremental store of `CORRECT.LP` results in an SQLite database.
+
+    Files are only (re-)parsed if their size or modification time has changed
+    since they were last stored, so repeated summaries over many datasets are cheap.
+    The indexing servers store their jobs in the same database (`JobDatabase`), so the
+    results of the indexing server can be summarized with `instamatic.xds_results -d DB`.
+
+    Usage:
+        db = XDSResults("xds_results.sqlite")
+        db.update(Path(".").glob("**/CORRECT.LP"))
+        for p in db.parsers(isa_min=5, volume=1234.5):
+            print(p.cell_info())
+    """
+    def __init__(self, fn=DEFAULT_DB):
+        super().__init__()
+        self.fn = Path(fn)
+        self.conn = sqlite3.connect(str(self.fn), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        cols = ", ".join(f"{name} {kind}" for name, kind in COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS correct_lp ({cols})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_volume ON correct_lp (volume)")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM correct_lp").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def stale(self, fns: list) -> list:
+        """Return the files from `fns` that are not in the database, or have changed since"""
+        known = {row["fn"]: (row["size"], row["mtime"]) for row in self.conn.execute("SELECT fn, size, mtime FROM correct_lp")}
+        ret = []
+        for fn in fns:
+            fn = str(fn)
+            try:
+                st = os.stat(fn)
+            except FileNotFoundError:
+                continue
+            if known.get(fn) != (st.st_size, st.st_mtime):
+                ret.append(fn)
+        return ret
+
+    def update(self, fns: list, workers: int=None, chunksize: int=8) -> int:
+        """Parse the files in `fns` that are new or have changed and store them.
+        Parsing is done in parallel using `workers` processes (default: number of cpus),
+        set `workers=0` to parse in the current process. Returns the number of parsed files."""
+        fns = self.stale(Path(fn).resolve() for fn in fns)
+        if not fns:
+            return 0
+
+        if workers == 0 or len(fns) < 2*chunksize:
+            rows = map(parse_correct_lp, fns)
+            self._insert(rows)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                self._insert(pool.map(parse_correct_lp, fns, chunksize=chunksize))
+
+        logger.info("Parsed %d files into %s", len(fns), self.fn)
+        return len(fns)
+
+    def store(self, fn: str, d: dict):
+        """Store the already parsed `CORRECT.LP` at `fn` (`xds_parser.d`)"""
+        self._insert([correct_lp_row(Path(fn).resolve(), d)])
+
+    def get(self, fn: str) -> dict:
+        """Return the parsed contents of `CORRECT.LP` at `fn`, or None if it is not in the database"""
+        row = self.conn.execute("SELECT data FROM correct_lp WHERE fn=?", (str(Path(fn).resolve()), )).fetchone()
+        return pickle.loads(row["data"]) if row and row["data"] else None
+
+    def _insert(self, rows):
+        names = [name for name, _ in COLUMNS]
+        query = f"INSERT OR REPLACE INTO correct_lp ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+        self.conn.executemany(query, ([row.get(name) for name in names] for row in rows))
+        self.conn.commit()
+
+    def prune(self) -> int:
+        """Remove entries of which the file no longer exists, returns the number of removed entries"""
+        gone = [(row["fn"],) for row in self.conn.execute("SELECT fn FROM correct_lp") if not os.path.exists(row["fn"])]
+        self.conn.executemany("DELETE FROM correct_lp WHERE fn=?", gone)
+        self.conn.commit()
+        return len(gone)
+
+    def query(self, isa_min: float=None, volume: float=None, volume_tol: float=0.02, spgr: int=None,
+              completeness_min: float=None, where: str=None, args: tuple=(), order_by: str="volume") -> list:
+        """Select successfully parsed entries, returns a list of `sqlite3.Row`
+
+        isa_min: only datasets with ISa > `isa_min`
+        volume: only datasets with a cell volume within `volume_tol` (fraction) of `volume`
+        spgr: only datasets with the given space group number
+        completeness_min: only datasets with a total completeness (%) > `completeness_min`
+        where/args: additional SQL condition with parameters, e.g. `where="cchalf > ?", args=(90,)`
+        """
+        conditions = ["ok = 1"]
+        params = []
+        if isa_min is not None:
+            conditions.append("ISa > ?")
+            params.append(isa_min)
+        if volume is not None:
+            conditions.append("volume BETWEEN ? AND ?")
+            params.extend((volume * (1 - volume_tol), volume * (1 + volume_tol)))
+        if spgr is not None:
+            conditions.append("spgr = ?")
+            params.append(spgr)
+        if completeness_min is not None:
+            conditions.append("completeness > ?")
+            params.append(completeness_min)
+        if where:
+            conditions.append(f"({where})")
+            params.extend(args)
+
+        query = f"SELECT * FROM correct_lp WHERE {' AND '.join(conditions)} ORDER BY {order_by}"
+        return self.conn.execute(query, params).fetchall()
+
+    def parsers(self, **kwargs) -> list:
+        """Same as `query`, but returns `xds_parser` instances restored from the database"""
+        return [xds_parser.from_dict(pickle.loads(row["data"]), row["fn"]) for row in self.query(**kwargs)]
+
+
+def cluster_by_volume(rows: list, tol: float=0.02) -> list:
+    """Group rows (sorted by volume) into clusters where consecutive volumes differ by less than `tol` (fraction)"""
+    clusters = []
+    for row in sorted(rows, key=lambda row: row["volume"]):
+        if clusters and row["volume"] <= clusters[-1][-1]["volume"] * (1 + tol):
+            clusters[-1].append(row)
+        else:
+            clusters.append([row])
+    return clusters
+
+
+def cluster_table(clusters: list) -> str:
+    """Summary table with the average cell for each cluster"""
+    s  = "  #     n  spgr        a        b        c       al       be       ga     volume   <ISa>\n"
+    s += "---------------------------------------------------------------------------------------\n"
+    for i, cluster in enumerate(clusters):
+        n = len(cluster)
+        mean = {key: sum(row[key] for row in cluster) / n for key in ("a", "b", "c", "al", "be", "ga", "volume", "ISa")}
+        spgrs = sorted(set(row["spgr"] for row in cluster))
+        spgr = spgrs[0] if len(spgrs) == 1 else "mix"
+        s += "{i: 3d} {n: 5d} {spgr:>5} {a: 8.2f} {b: 8.2f} {c: 8.2f} {al: 8.2f} {be: 8.2f} {ga: 8.2f} {volume: 10.1f} {ISa: 7.2f}\n".format(
+            i=i, n=n, spgr=spgr, **mean)
+    return s
+
+
+def main():
+    import argparse
+
+    description = "Collect the results from `CORRECT.LP` files into an SQLite database and print summary tables. Only new or changed files are parsed."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("args", type=str, nargs="*", metavar="PATH",
+                        help="Files or directories to search for CORRECT.LP (default: current directory)")
+    parser.add_argument("-d", "--db", default=DEFAULT_DB,
+                        help="Database file (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of processes to parse with (default: number of cpus)")
+    parser.add_argument("--isa", type=float, default=None,
+                        help="Only show datasets with ISa above this value")
+    parser.add_argument("--volume", type=float, default=None,
+                        help="Only show datasets with a cell volume close to this value")
+    parser.add_argument("--tol", type=float, default=0.02,
+                        help="Relative tolerance for the volume selection and clustering (default: %(default)s)")
+    parser.add_argument("--spgr", type=int, default=None,
+                        help="Only show datasets with this space group number")
+    parser.add_argument("--cells", action="store_true",
+                        help="Print the cell info and integration info for every dataset")
+    options = parser.parse_args()
+
+    fns = [Path(fn) for fn in options.args] if options.args else [Path(".")]
+
+    t0 = time.perf_counter()
+    fns = parse_fns(fns)
+    t1 = time.perf_counter()
+
+    db = XDSResults(options.db)
+    n = db.update(fns, workers=options.workers)
+    t2 = time.perf_counter()
+
+    print(f"Found {len(fns)} files matching CORRECT.LP ({t1-t0:.2f} s), parsed {n} new/changed ({t2-t1:.2f} s)\n")
+
+    rows = db.query(isa_min=options.isa, volume=options.volume, volume_tol=options.tol, spgr=options.spgr)
+
+    if options.cells:
+        ps = [xds_parser.from_dict(pickle.loads(row["data"]), row["fn"]) for row in rows]
+        for i, p in enumerate(ps):
+            print(p.cell_info(sequence=i))
+        print()
+        for i, p in enumerate(ps):
+            print(p.integration_info(sequence=i, filename=True))
+        print()
+
+    clusters = cluster_by_volume(rows, tol=options.tol)
+    print(f"{len(rows)} datasets in {len(clusters)} clusters (volume tolerance: {options.tol:.0%})\n")
+    print(cluster_table(clusters))
+
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,44 +5,39 @@ import os, sys, glob
 import numpy as np
 from pathlib import Path
 
-from scipy import ndimage
-
 import argparse
-import tqdm
 
 from instamatic import neural_network
+from instamatic.utils.session_index import SessionIndex, THUMBNAIL_SIZES, mosaic
 
 CMAP = "gray" # "viridis", "gray"
 
+MAX_MOSAIC_PIXELS = 4096**2
+
 ANGLE = -0.88 + np.pi/2
 R = np.array([
             [ np.cos(ANGLE), -np.sin(ANGLE)],
             [ np.sin(ANGLE),  np.cos(ANGLE)]])
 
-def get_stage_coords(fns, return_ims=False):
-    coords = []
-    has_crystals = []
-    t = tqdm.tqdm(fns, desc="Parsing files")
+def get_stage_coords(fns, return_ims=False, index=None):
+    """Get the stage coordinates (and thumbnails if `return_ims` is set) from the session index.
+    Only the headers of new or changed files are read, and only the images without a thumbnail."""
+    if index is None:
+        index = SessionIndex.for_images(fns)
 
-    imgs = []
+    index.update(fns, thumbnails=return_ims)
 
-    for fn in t:
-        img, h = read_image(fn)
-        try:
-            dx, dy = h["exp_hole_offset"]
-            cx, cy = h["exp_hole_center"]
-        except KeyError:
-            dx, dy = h["exp_scan_offset"]
-            cx, cy = h["exp_scan_center"]
-        coords.append((cx + dx, cy + dy))
+    # coordinates are in um
+    coords, ncrystals = index.stage_coords(fns)
 
-        has_crystals.append(len(h["exp_crystal_coords"]) > 0)
-        if return_ims:
-            img = ndimage.zoom(img, 0.0969)
-            imgs.append(img)
-    # convert to um
+    if return_ims:
+        # pick the largest thumbnails that keep the stage map at a reasonable size
+        size = next((size for size in THUMBNAIL_SIZES if len(fns) * size**2 <= MAX_MOSAIC_PIXELS), THUMBNAIL_SIZES[-1])
+        imgs = index.thumbnails(fns, size=size)
+    else:
+        imgs = []
 
-    return np.array(coords) / 1000, np.array(has_crystals), imgs
+    return coords, ncrystals > 0, imgs
 
 
 def lst2colormap(lst):
@@ -54,13 +49,15 @@ def lst2colormap(lst):
     return colormap
 
 
-def run(filepat="images/image_*.tiff", results=None, stitch=False):
+def run(filepat="images/image_*.tiff", results=None, stitch=False, index=None):
      # use relpath to normalizes path
-    fns = [Path(fn).absolute() for fn in  glob.glob(filepat)]
+    fns = [Path(fn).absolute() for fn in  sorted(glob.glob(filepat))]
 
     if len(fns) == 0:
         sys.exit()
 
+    index = SessionIndex(index) if index else SessionIndex.for_images(fns)
+
     if stitch:
         coord_color = "none"
     else:
@@ -77,12 +74,11 @@ def run(filepat="images/image_*.tiff", results=None, stitch=False):
             projector = Projector.from_parameters(thickness=d["projections"]["thickness"], **d["cell"])
             indexer = Indexer.from_projector(projector, pixelsize=d["experiment"]["pixelsize"])
 
-    coords, has_crystals, imgs = get_stage_coords(fns, return_ims=stitch)
-
+    coords, has_crystals, imgs = get_stage_coords(fns, return_ims=stitch, index=index)
 
     fn = fns[0]
     img, h = read_image(fn)
-    imdim_x, imdim_y = np.array(h["ImageDimensions"]) / 2
+    imdim = np.array(h["ImageDimensions"])
 
     fig = plt.figure()
     fig.canvas.set_window_title('instamatic.browser')
@@ -93,9 +89,9 @@ def run(filepat="images/image_*.tiff", results=None, stitch=False):
     coords = np.dot(coords, R)
 
     if stitch:
-        for mini_img, coord in zip(imgs, coords):
-            sx, sy = coord
-            ax1.imshow(mini_img, interpolation='bilinear', extent=[sx-imdim_x, sx+imdim_x, sy-imdim_y, sy+imdim_y], cmap=CMAP)
+        # draw all thumbnails as a single image, one imshow per image is very slow for large sessions
+        stage_map, extent = mosaic(coords, imgs, imdim, max_size=int(MAX_MOSAIC_PIXELS**0.5))
+        ax1.imshow(stage_map, interpolation='bilinear', extent=extent, cmap=CMAP)
     
     ax1.scatter(coords[has_crystals==True, 0], coords[has_crystals==True, 1], marker="o", facecolor=coord_color)
     ax1.scatter(coords[:, 0], coords[:, 1], marker=".", color=coord_color, picker=8)
@@ -240,8 +236,13 @@ Program for indexing electron diffraction images.
                         action="store_true", dest="stitch",
                         help="Stitch images together.")
     
+    parser.add_argument("-i", "--index",
+                        action="store", type=str, dest="index",
+                        help="Session index to use (default: session_index.sqlite next to the image directory), see `instamatic.utils.session_index`")
+
     parser.set_defaults(results=None,
-                        stitch=False
+                        stitch=False,
+                        index=None
                         )
     
     options = parser.parse_args()
@@ -254,7 +255,7 @@ Program for indexing electron diffraction images.
             parser.print_help()
             sys.exit()
 
-    run(filepat=arg, results=options.results, stitch=options.stitch)
+    run(filepat=arg, results=options.results, stitch=options.stitch, index=options.index)
 
 
 if __name__ == '__main__':
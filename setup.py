@@ -73,11 +73,16 @@ setup(
             # processing
             'instamatic.flatfield                     = instamatic.processing.flatfield:main_entry',
             'instamatic.stretch_correction            = instamatic.processing.stretch_correction:main_entry',
+            'instamatic.beam_drift                    = instamatic.processing.beam_drift:main',
+            'instamatic.movie                         = instamatic.processing.movie:main',
+            'instamatic.reprocess                     = instamatic.processing.reprocess:main',
             'instamatic.find_crystals                 = instamatic.processing.find_crystals:main_entry',
+            'instamatic.xds_results                   = instamatic.utils.xds_results:main',
             'instamatic.learn                         = scripts.learn:main_entry',
             # explore
             'instamatic.browser                       = scripts.browser:main',
             'instamatic.viewer                        = scripts.viewer:main',
+            'instamatic.index_session                 = instamatic.utils.session_index:main',
             # server
             'instamatic.watcher                       = instamatic.server.TEMbkgWatcher:main',
             'instamatic.temserver                     = instamatic.server.tem_server:main',